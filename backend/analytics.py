@@ -0,0 +1,240 @@
+"""
+Analítica por cohorte (curso) y materia para EduSmart.
+
+Los results y los videos completados se guardan en columnas (array.array
+de enteros: estudiante, aciertos, nivel final, duración; estudiante,
+video) que se alimentan incrementalmente de storage._changes, como el
+Leaderboard. Cada reporte cruza esas columnas con students.course y
+videos.subject y calcula conteos, promedios e histogramas por grupo en
+pasadas vectorizadas con NumPy (bincount sobre claves de grupo); sin NumPy,
+el mismo cálculo en Python puro.
+"""
+import array, bisect, os, threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# "auto" (NumPy si está instalado), "numpy" o "python"
+ANALYTICS_ENGINE = os.environ.get("EDUSMART_ANALYTICS_ENGINE", "auto").strip().lower()
+
+# Aciertos posibles por test (0..5) y niveles (1..5)
+MAX_CORRECT = 5
+LEVELS = (1, 2, 3, 4, 5)
+# Límites superiores (segundos) del histograma de duración; el último es abierto
+DURATION_BUCKETS = (60, 120, 180, 300, 600, 900)
+
+def engine():
+    return "numpy" if np is not None and ANALYTICS_ENGINE in ("auto", "numpy") else "python"
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+class _Codes(dict):
+    """Valor -> código entero consecutivo."""
+    def code(self, value):
+        c = self.get(value)
+        if c is None:
+            c = self[value] = len(self)
+        return c
+
+class CohortColumns:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Compartido por ambas columnas: sobrevive a que se reinicie una sola
+        self.students = _Codes()
+        self.clear_results()
+        self.clear_rewards()
+
+    def clear_results(self):
+        with self._lock:
+            self.r_student = array.array("q")
+            self.r_correct = array.array("q")
+            self.r_level = array.array("q")
+            self.r_duration = array.array("q")
+            self.results_cursor = None
+
+    def clear_rewards(self):
+        with self._lock:
+            self.videos = _Codes()
+            self.v_student = array.array("q")
+            self.v_video = array.array("q")
+            self.rewards_cursor = None
+
+    def sync(self, results_changes, rewards_changes):
+        """
+        Agrega los results y rewards nuevos. *_changes(cursor) ->
+        (registros, cursor, reset) como storage._changes.
+        """
+        with self._lock:
+            results, cursor, reset = results_changes(self.results_cursor)
+            if reset:
+                self.clear_results()
+            for r in results:
+                sid = r.get("student_id")
+                if not sid:
+                    continue
+                self.r_student.append(self.students.code(sid))
+                self.r_correct.append(_int(r.get("correct")))
+                self.r_level.append(_int(r.get("final_level")))
+                self.r_duration.append(_int(r.get("duration_seconds")))
+            self.results_cursor = cursor
+
+            rewards, cursor, reset = rewards_changes(self.rewards_cursor)
+            if reset:
+                self.clear_rewards()
+            for r in rewards:
+                sid, video_id = r.get("student_id"), r.get("video_id")
+                if r.get("type") != "video" or not sid or not video_id:
+                    continue
+                self.v_student.append(self.students.code(sid))
+                self.v_video.append(self.videos.code(video_id))
+            self.rewards_cursor = cursor
+
+    def report(self, students, videos, course=None):
+        """
+        Agregados por curso (solo course, si se indica): tests, promedios de
+        aciertos/nivel/duración, histogramas y tasa de completado por materia.
+        """
+        courses = sorted({s.get("course") for s in students if s.get("course")})
+        if course is not None:
+            courses = [c for c in courses if c == course]
+        subjects = sorted({v.get("subject") for v in videos if v.get("subject")})
+        course_index = {c: i for i, c in enumerate(courses)}
+        subject_index = {s: i for i, s in enumerate(subjects)}
+        enrolled = [0] * len(courses)
+        for s in students:
+            i = course_index.get(s.get("course"))
+            if i is not None:
+                enrolled[i] += 1
+        catalog = [0] * len(subjects)
+        for v in videos:
+            if v.get("subject") in subject_index:
+                catalog[subject_index[v["subject"]]] += 1
+
+        with self._lock:
+            # Curso de cada código de estudiante y materia de cada código de video (-1: ninguno)
+            course_of = [-1] * len(self.students)
+            for s in students:
+                code = self.students.get(s.get("id"))
+                if code is not None:
+                    course_of[code] = course_index.get(s.get("course"), -1)
+            subject_of = [-1] * len(self.videos)
+            for v in videos:
+                code = self.videos.get(v.get("id"))
+                if code is not None:
+                    subject_of[code] = subject_index.get(v.get("subject"), -1)
+            compute = _numpy_groups if engine() == "numpy" else _python_groups
+            groups = compute(self, course_of, subject_of, len(courses), len(subjects))
+
+        out = []
+        for i, name in enumerate(courses):
+            tests = groups["tests"][i]
+            mean = lambda total: round(total / tests, 2) if tests else None
+            out.append({
+                "course": name,
+                "students": enrolled[i],
+                "tests": tests,
+                "avg_correct": mean(groups["correct"][i]),
+                "avg_final_level": mean(groups["level"][i]),
+                "avg_duration_seconds": mean(groups["duration"][i]),
+                "score_histogram": {str(k): groups["score_hist"][i][k] for k in range(MAX_CORRECT + 1)},
+                "final_level_histogram": {str(l): groups["level_hist"][i][j] for j, l in enumerate(LEVELS)},
+                "duration_histogram": [
+                    {"le": bound, "count": groups["duration_hist"][i][j]}
+                    for j, bound in enumerate(DURATION_BUCKETS + (None,))
+                ],
+                "subjects": {
+                    subject: {
+                        "videos": catalog[j],
+                        "completions": groups["completions"][i][j],
+                        "completion_rate": round(groups["completions"][i][j] / (enrolled[i] * catalog[j]), 4)
+                        if enrolled[i] and catalog[j] else 0.0,
+                    }
+                    for j, subject in enumerate(subjects)
+                },
+            })
+        return out
+
+def _python_groups(cols, course_of, subject_of, n_courses, n_subjects):
+    n_buckets = len(DURATION_BUCKETS) + 1
+    tests = [0] * n_courses
+    correct, level, duration = [0] * n_courses, [0] * n_courses, [0] * n_courses
+    score_hist = [[0] * (MAX_CORRECT + 1) for _ in range(n_courses)]
+    level_hist = [[0] * len(LEVELS) for _ in range(n_courses)]
+    duration_hist = [[0] * n_buckets for _ in range(n_courses)]
+    for sid, ok, lvl, secs in zip(cols.r_student, cols.r_correct, cols.r_level, cols.r_duration):
+        c = course_of[sid]
+        if c < 0:
+            continue
+        tests[c] += 1
+        correct[c] += ok
+        level[c] += lvl
+        duration[c] += secs
+        score_hist[c][min(max(ok, 0), MAX_CORRECT)] += 1
+        level_hist[c][min(max(lvl, LEVELS[0]), LEVELS[-1]) - LEVELS[0]] += 1
+        duration_hist[c][bisect.bisect_left(DURATION_BUCKETS, secs)] += 1
+
+    completions = [[0] * n_subjects for _ in range(n_courses)]
+    for sid, vid in set(zip(cols.v_student, cols.v_video)):
+        c, s = course_of[sid], subject_of[vid]
+        if c >= 0 and s >= 0:
+            completions[c][s] += 1
+    return {
+        "tests": tests, "correct": correct, "level": level, "duration": duration,
+        "score_hist": score_hist, "level_hist": level_hist, "duration_hist": duration_hist,
+        "completions": completions,
+    }
+
+def _column(values):
+    # Copia (memcpy) del array.array: un append posterior no puede
+    # redimensionar un buffer exportado
+    return np.frombuffer(values, dtype=np.int64).copy()
+
+def _numpy_groups(cols, course_of, subject_of, n_courses, n_subjects):
+    course_of = np.array(course_of, dtype=np.int64)
+    subject_of = np.array(subject_of, dtype=np.int64)
+    c = course_of[_column(cols.r_student)]
+    keep = c >= 0
+    c = c[keep]
+    ok = _column(cols.r_correct)[keep]
+    lvl = _column(cols.r_level)[keep]
+    secs = _column(cols.r_duration)[keep]
+
+    def grouped(values=None):
+        return np.bincount(c, weights=values, minlength=n_courses)
+
+    def histogram(bins, n_bins):
+        # Clave de grupo curso * n_bins + bin: un solo bincount para todos los cursos
+        return np.bincount(c * n_bins + bins, minlength=n_courses * n_bins).reshape(n_courses, n_bins)
+
+    n_buckets = len(DURATION_BUCKETS) + 1
+    score_hist = histogram(np.clip(ok, 0, MAX_CORRECT), MAX_CORRECT + 1)
+    level_hist = histogram(np.clip(lvl, LEVELS[0], LEVELS[-1]) - LEVELS[0], len(LEVELS))
+    duration_hist = histogram(np.searchsorted(np.array(DURATION_BUCKETS), secs, side="left"), n_buckets)
+
+    completions = np.zeros((n_courses, n_subjects), dtype=np.int64)
+    if len(cols.v_student) and n_courses and n_subjects:
+        # (estudiante, video) únicos: un video visto dos veces cuenta una vez
+        n_videos = len(subject_of)
+        pairs = np.sort(_column(cols.v_student) * n_videos + _column(cols.v_video))
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        vc, vs = course_of[pairs // n_videos], subject_of[pairs % n_videos]
+        keep = (vc >= 0) & (vs >= 0)
+        completions = np.bincount(vc[keep] * n_subjects + vs[keep], minlength=n_courses * n_subjects).reshape(n_courses, n_subjects)
+
+    as_int = lambda a: [int(x) for x in a]
+    return {
+        "tests": as_int(grouped()),
+        "correct": as_int(grouped(ok)),
+        "level": as_int(grouped(lvl)),
+        "duration": as_int(grouped(secs)),
+        "score_hist": [as_int(row) for row in score_hist],
+        "level_hist": [as_int(row) for row in level_hist],
+        "duration_hist": [as_int(row) for row in duration_hist],
+        "completions": [as_int(row) for row in completions],
+    }
@@ -1,58 +1,271 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file, g, json as flask_json
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import json, os, threading, datetime, random
-from werkzeug.security import generate_password_hash, check_password_hash
+import os, sys, datetime, random, time, collections, threading, gzip, zlib, hmac
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+if __package__ in (None, ""):
+    # Ejecutado como script (py -3 backend/app.py): habilita los imports del paquete
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import click
+
+from backend.storage import (
+    _read, _find_one, _query, _latest, _page, _stats, _distinct, _indexed, _snapshot, _transaction,
+    _init_storage, _migrate_to_sqlite, _sqlite_path, _group_commit_stats, _rebuild_summaries, _changes,
+    _changes_cursor, _cache_stats, _etag, _iter_sorted, _recover, _compact, _compaction_stats, _history_cost,
+    _sqlite, _shared_secret, LOG_COLLECTIONS,
+)
+from backend.completions import REASON_PREFIX, CompletedVideos, match_legacy
+from backend.leaderboard import Leaderboard
+from backend.performance import RecentPerformance
+from backend import analytics, metrics, passwords, profiling, pubsub, serializer
+from backend.static_assets import build_manifest
 
 static_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../frontend"))
-app = Flask(__name__, static_folder=static_folder_path, static_url_path="")
+class _JSONProvider(DefaultJSONProvider):
+    """jsonify vía serializer: compacto y con orjson si está instalado."""
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        return serializer.dumps(
+            obj, default=kwargs.get("default", self.default),
+            sort_keys=kwargs.get("sort_keys", self.sort_keys), indent=bool(kwargs.get("indent")),
+        ).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return serializer.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Directo a bytes: sin pasar por str
+        body = serializer.dumps(obj, default=self.default, sort_keys=self.sort_keys)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+# Los archivos los sirve static_proxy (con su política de caché), no la ruta estática de Flask
+app = Flask(__name__, static_folder=None)
+app.json = _JSONProvider(app)
+# Firma los tokens de sesión de test; con varios workers debe ser la misma en
+# todos: sin EDUSMART_SECRET_KEY se comparte una generada en DB_DIR
+app.config["SECRET_KEY"] = os.environ.get("EDUSMART_SECRET_KEY") or _shared_secret()
 CORS(app)
 
-DB_DIR = os.path.join(os.path.dirname(__file__), "db")
-LOCK = threading.Lock()
+# Antes de atender pedidos: repara escrituras cortadas por una caída (ver storage._recover)
+for _name, _fixed in _recover().items():
+    app.logger.warning("storage: %s reparado tras una escritura incompleta: %s", _name, _fixed)
+
+# --- Métricas ---
+# Registrado antes que _compress: los after_request corren en orden inverso,
+# así que la latencia incluye la compresión
+@app.before_request
+def _metrics_start():
+    g.metrics_started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+
+@app.after_request
+def _metrics_record(response):
+    started = g.get("metrics_started")
+    if started is not None:
+        # La regla, no la URL: /api/student-stats/<student_id> es una sola serie
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method)
+        metrics.REQUESTS.inc(1, route, request.method, str(response.status_code))
+    return response
+
+@app.teardown_request
+def _metrics_done(exc):
+    # pop: el teardown puede correr dos veces (contextos preservados)
+    if g.pop("metrics_started", None) is not None:
+        metrics.IN_FLIGHT.dec()
+
+@app.get("/metrics")
+def get_metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    if not metrics.ENABLED:
+        return jsonify({"error": "métricas desactivadas"}), 404
+    return app.response_class(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8",
+                              headers={"Cache-Control": "no-store"})
+
+# --- Admin ---
+# Token de los endpoints /api/admin (header X-Admin-Token); sin token, desactivados
+ADMIN_TOKEN = os.environ.get("EDUSMART_ADMIN_TOKEN", "")
+
+def _is_admin():
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def _forbidden():
+    return jsonify({"error": "requiere X-Admin-Token válido"}), 403
 
-def _db_path(name):
-    return os.path.join(DB_DIR, f"{name}.json")
+# --- Perfilado (ver profiling.py) ---
+@app.before_request
+def _profile_start():
+    if not profiling.ENABLED:
+        return
+    # X-Profile solo cuenta con token de admin: perfilar duplica el costo del request
+    if profiling.should_profile(bool(request.headers.get("X-Profile")) and _is_admin()):
+        g.profile_started = time.perf_counter()
+        g.profiler = profiling.start()
 
-def _read(name):
-    path = _db_path(name)
-    if not os.path.exists(path):
-        os.makedirs(DB_DIR, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+@app.after_request
+def _profile_finish(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        response.headers["X-Profile-Id"] = profiling.finish(profiler, {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - g.profile_started) * 1000, 3),
+        })
+    return response
+
+@app.teardown_request
+def _profile_done(exc):
+    # Si una excepción se saltó after_request, el profiler quedaría activo en el hilo
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+@app.get("/api/admin/profiles")
+def list_profiles():
+    if not _is_admin():
+        return _forbidden()
+    return jsonify({"enabled": profiling.ENABLED, "sample_rate": profiling.SAMPLE_RATE, "profiles": profiling.list_profiles()})
+
+@app.get("/api/admin/profiles/<profile_id>")
+def get_profile(profile_id):
+    """Resumen de un perfil: funciones con más tiempo acumulado."""
+    if not _is_admin():
+        return _forbidden()
+    profile = profiling.load(profile_id)
+    if profile is None:
+        return jsonify({"error": "perfil no encontrado"}), 404
+    return jsonify(profile)
 
-def _write(name, data):
-    with LOCK:
-        os.makedirs(DB_DIR, exist_ok=True)
-        with open(_db_path(name), "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+@app.get("/api/admin/profiles/<profile_id>/pstats")
+def get_profile_pstats(profile_id):
+    """El perfil completo en formato pstats (snakeviz, flameprof...)."""
+    if not _is_admin():
+        return _forbidden()
+    path = profiling.pstats_path(profile_id)
+    if path is None:
+        return jsonify({"error": "perfil no encontrado"}), 404
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=f"{profile_id}.prof")
 
 def _now_iso():
     return datetime.datetime.utcnow().isoformat() + "Z"
 
-def _calculate_level_from_performance(results):
-    """Calculate suggested level based on recent performance"""
-    if not results:
-        return 2
-    
-    recent_results = sorted(results, key=lambda r: r.get("created_at", ""), reverse=True)[:3]
-    avg_correct = sum(r.get("correct", 0) for r in recent_results) / len(recent_results)
-    
-    if avg_correct >= 4:
-        return 3
-    elif avg_correct >= 2.5:
-        return 2
+# --- Caché HTTP ---
+# Segundos que el navegador puede reusar el catálogo sin preguntar
+CATALOG_MAX_AGE = int(os.environ.get("EDUSMART_CATALOG_MAX_AGE", 60))
+# Sirve frontend/ con fingerprint + gzip precalculado (ver static_assets.py)
+STATIC_FINGERPRINT = os.environ.get("EDUSMART_STATIC_FINGERPRINT", "").strip().lower() in ("1", "true", "yes")
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Compresión de respuestas: tamaño mínimo (bytes) y nivel (1-9)
+COMPRESS_MIN_BYTES = int(os.environ.get("EDUSMART_COMPRESS_MIN_BYTES", 1024))
+COMPRESS_LEVEL = int(os.environ.get("EDUSMART_COMPRESS_LEVEL", 6))
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/css", "text/javascript", "application/javascript", "text/plain"}
+
+@app.after_request
+def _compress(response):
+    """gzip o deflate según Accept-Encoding, para respuestas grandes."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    coding = request.accept_encodings.best_match(["gzip", "deflate"])
+    if coding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if coding == "gzip":
+        body = gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
     else:
-        return 1
+        body = zlib.compress(body, COMPRESS_LEVEL)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = coding
+    # Otra representación del mismo recurso: el ETag pasa a ser débil
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+_BODY_CACHE = collections.OrderedDict()
+_BODY_CACHE_MAX = 256
+_BODY_CACHE_LOCK = threading.Lock()
+
+def _cached_json(etag, build, cache_control):
+    """
+    Respuesta JSON con ETag: 304 si el cliente ya tiene esa versión; si no,
+    el cuerpo serializado se reusa mientras el ETag no cambie.
+    """
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+    if request.if_none_match.contains_weak(etag):
+        return app.response_class(status=304, headers=headers)
+    key = (request.full_path, etag)
+    with _BODY_CACHE_LOCK:
+        body = _BODY_CACHE.get(key)
+        if body is not None:
+            _BODY_CACHE.move_to_end(key)
+    if body is None:
+        body = flask_json.dumps(build()).encode("utf-8")
+        with _BODY_CACHE_LOCK:
+            _BODY_CACHE[key] = body
+            if len(_BODY_CACHE) > _BODY_CACHE_MAX:
+                _BODY_CACHE.popitem(last=False)
+    return app.response_class(body, mimetype="application/json", headers=headers)
+
+_ASSETS = None
+_ASSETS_LOCK = threading.Lock()
+
+def _assets():
+    """({ruta: Asset}, rutas con fingerprint), armado una vez por proceso."""
+    global _ASSETS
+    if _ASSETS is None:
+        with _ASSETS_LOCK:
+            if _ASSETS is None:
+                assets, renamed = build_manifest(static_folder_path)
+                _ASSETS = (assets, set(renamed.values()))
+    return _ASSETS
+
+def _send_asset(path, asset, immutable):
+    headers = {
+        "ETag": f'"{asset.etag}"',
+        "Vary": "Accept-Encoding",
+        # Con fingerprint el contenido no cambia nunca; el resto se revalida
+        "Cache-Control": f"public, max-age={IMMUTABLE_MAX_AGE}, immutable" if immutable else "no-cache",
+    }
+    if request.if_none_match.contains_weak(asset.etag):
+        return app.response_class(status=304, headers=headers)
+    body = asset.body
+    if asset.gzip_body is not None and "gzip" in request.accept_encodings:
+        body = asset.gzip_body
+        headers["Content-Encoding"] = "gzip"
+    return app.response_class(body, mimetype=asset.mimetype, headers=headers)
+
+def _send_static(path):
+    if STATIC_FINGERPRINT:
+        assets, immutable = _assets()
+        asset = assets.get(path)
+        if asset is not None:
+            return _send_asset(path, asset, path in immutable)
+    # Sin fingerprint la URL no cambia con el contenido: siempre se revalida
+    # (ETag -> 304), o tras un deploy un HTML nuevo podría usar un app.js viejo
+    response = send_from_directory(static_folder_path, path)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route("/")
 def root():
-    return send_from_directory(static_folder_path, "index.html")
+    return _send_static("index.html")
 
 @app.route("/<path:path>")
 def static_proxy(path):
-    return send_from_directory(static_folder_path, path)
+    return _send_static(path)
 
 # --- Students ---
 @app.post("/api/students")
@@ -63,11 +276,12 @@ def create_or_get_student():
     if not name or not course:
         return jsonify({"error": "name and course are required"}), 400
     
-    students = _read("students")
     sid = f"{name.lower().replace(' ','_')}__{course.lower().replace(' ','_')}"
     
-    existing_student = next((s for s in students if s.get("id") == sid), None)
-    if not existing_student:
+    def create_or_get(tx):
+        existing_student = _find_one("students", "id", sid)
+        if existing_student:
+            return existing_student
         new_student = {
             "id": sid, 
             "name": name, 
@@ -78,11 +292,10 @@ def create_or_get_student():
             "tests_completed": 0,
             "videos_watched": 0
         }
-        students.append(new_student)
-        _write("students", students)
-        return jsonify(new_student)
+        tx.append("students", new_student)
+        return new_student
     
-    return jsonify(existing_student)
+    return jsonify(_transaction(["students"], create_or_get))
 
 # --- Auth (simple) ---
 @app.post("/api/auth/register")
@@ -100,16 +313,21 @@ def auth_register():
     if not username or not password or not name or not course:
         return jsonify({"error": "username, password, name y course son requeridos"}), 400
 
-    students = _read("students")
     # username único (case-insensitive)
-    if any((s.get("username") or "").lower() == username for s in students):
+    if _find_one("students", "username", username):
         return jsonify({"error": "username ya existe"}), 409
 
+    try:
+        # En el pool de hashing: una ráfaga de registros no frena la API
+        password_hash = passwords.hash_password(password)
+    except passwords.Saturated:
+        return _busy()
+
     sid = f"user_{username}"
     student = {
         "id": sid,
         "username": username,
-        "password_hash": generate_password_hash(password),
+        "password_hash": password_hash,
         "name": name,
         "course": course,
         "created_at": _now_iso(),
@@ -118,14 +336,47 @@ def auth_register():
         "tests_completed": 0,
         "videos_watched": 0,
     }
-    students.append(student)
-    _write("students", students)
+
+    def register(tx):
+        # Se vuelve a comprobar dentro de la transacción: dos registros
+        # simultáneos con el mismo username no pueden pasar ambos
+        if _find_one("students", "username", username):
+            return False
+        tx.append("students", student)
+        return True
+
+    if not _transaction(["students"], register):
+        return jsonify({"error": "username ya existe"}), 409
 
     # Nunca devolver password_hash
     out = {k: v for k, v in student.items() if k != "password_hash"}
     return jsonify(out), 201
 
 
+def _busy():
+    response = jsonify({"error": "servidor ocupado, reintente en unos segundos"})
+    response.headers["Retry-After"] = "2"
+    return response, 503
+
+def _rehash_if_outdated(sid, stored_hash, password):
+    """
+    Tras un login correcto, rehace el hash si se generó con otro método o
+    costo. Es best-effort: con el pool saturado se deja para otro login.
+    """
+    try:
+        if not passwords.needs_rehash(stored_hash):
+            return
+        new_hash = passwords.hash_password(password)
+    except passwords.Saturated:
+        return
+
+    def rehash(tx):
+        # Solo si nadie cambió el hash mientras tanto
+        current = _find_one("students", "id", sid)
+        if current and current.get("password_hash") == stored_hash:
+            tx.update_one("students", "id", sid, {"password_hash": new_hash})
+    _transaction(["students"], rehash)
+
 @app.post("/api/auth/login")
 def auth_login():
     """
@@ -139,16 +390,21 @@ def auth_login():
     if not username or not password:
         return jsonify({"error": "username y password son requeridos"}), 400
 
-    students = _read("students")
-    student = next((s for s in students if (s.get("username") or "").lower() == username), None)
+    student = _find_one("students", "username", username)
 
     # Permite compatibilidad: si todavía no migraste, no hay username.
     if not student:
         return jsonify({"error": "credenciales inválidas"}), 401
 
-    if not check_password_hash(student.get("password_hash", ""), password):
+    stored_hash = student.get("password_hash", "")
+    try:
+        valid = passwords.verify_password(stored_hash, password)
+    except passwords.Saturated:
+        return _busy()
+    if not valid:
         return jsonify({"error": "credenciales inválidas"}), 401
 
+    _rehash_if_outdated(student["id"], stored_hash, password)
     out = {k: v for k, v in student.items() if k != "password_hash"}
     return jsonify(out)
 
@@ -158,29 +414,41 @@ def auth_logout():
     # Stateless: el cliente borra su sesión. Aquí solo confirmamos.
     return jsonify({"ok": True})
 
+def _student_summary(student_id):
+    """Contadores de un estudiante según sus logs de results y rewards."""
+    where = {"student_id": student_id}
+    results_stats = _stats("results", where, ["correct"])
+    rewards_by_type = _stats("rewards", where, ["points"], group_by="type")
+    return {
+        "total_points": sum(group["sum"]["points"] for group in rewards_by_type.values()),
+        "tests_completed": results_stats["count"],
+        "videos_watched": rewards_by_type.get("video", {}).get("count", 0),
+        "avg_score": results_stats["sum"]["correct"] / results_stats["count"] if results_stats["count"] else 0,
+    }
+
 @app.get("/api/student-stats/<student_id>")
 def get_student_stats(student_id):
     """Get comprehensive student statistics"""
-    students = _read("students")
-    student = next((s for s in students if s.get("id") == student_id), None)
-    if not student:
-        return jsonify({"error": "Student not found"}), 404
-    
-    # Get recent performance
-    results = _read("results")
-    student_results = [r for r in results if r.get("student_id") == student_id]
-    
-    # Get rewards
-    rewards = _read("rewards")
-    student_rewards = [r for r in rewards if r.get("student_id") == student_id]
-    total_points = sum(r.get("points", 0) for r in student_rewards)
+    with _snapshot("students", "results", "rewards"):
+        student = _find_one("students", "id", student_id)
+        if not student:
+            return jsonify({"error": "Student not found"}), 404
+        
+        where = {"student_id": student_id}
+
+        # Get recent performance (resúmenes materializados + final del índice)
+        recent_results = _latest("results", where, 5)
+        summary = _student_summary(student_id)
+        
+        # Get rewards
+        recent_videos = _latest("rewards", {**where, "type": "video"}, 5)
     
-    # Calculate suggested level
-    suggested_level = _calculate_level_from_performance(student_results)
+    # Nivel sugerido según la ventana de results recientes
+    suggested_level = _performance().suggested_level(student_id)
     
     # Recent activity (last 5 items)
     recent_activity = []
-    for result in student_results[-5:]:
+    for result in recent_results:
         recent_activity.append({
             "type": "test",
             "description": f"Test completado: {result.get('correct', 0)}/5 correctas",
@@ -188,26 +456,25 @@ def get_student_stats(student_id):
             "points": 10 + min(max(result.get('correct', 0), 0), 5) * 8
         })
     
-    for reward in student_rewards:
-        if reward.get("type") == "video":
-            recent_activity.append({
-                "type": "video",
-                "description": reward.get("reason", ""),
-                "date": reward.get("created_at"),
-                "points": reward.get("points", 0)
-            })
+    for reward in recent_videos:
+        recent_activity.append({
+            "type": "video",
+            "description": reward.get("reason", ""),
+            "date": reward.get("created_at"),
+            "points": reward.get("points", 0)
+        })
     
     # Sort by date, most recent first
     recent_activity = sorted(recent_activity, key=lambda x: x.get("date", ""), reverse=True)[:5]
     
+    counters = {k: summary[k] for k in ("total_points", "tests_completed", "videos_watched")}
     return jsonify({
-        "student": student,
+        # Los contadores guardados en el student pueden estar atrasados
+        "student": {**student, **counters},
         "stats": {
-            "total_points": total_points,
-            "tests_completed": len(student_results),
-            "videos_watched": len([r for r in student_rewards if r.get("type") == "video"]),
+            **counters,
             "suggested_level": suggested_level,
-            "avg_score": sum(r.get("correct", 0) for r in student_results) / len(student_results) if student_results else 0
+            "avg_score": summary["avg_score"]
         },
         "recent_activity": recent_activity
     })
@@ -215,35 +482,72 @@ def get_student_stats(student_id):
 # --- Videos & Materias ---
 @app.get("/api/materias")
 def get_materias():
-    videos = _read("videos")
-    materias = sorted(list({v.get("subject") for v in videos if v.get("subject")}))
-    return jsonify(materias)
+    return _cached_json(_etag("videos"), lambda: _distinct("videos", "subject"), f"public, max-age={CATALOG_MAX_AGE}")
+
+_COMPLETIONS = CompletedVideos()
+
+def _completions():
+    """Videos completados al día (solo se agregan los rewards nuevos)."""
+    _COMPLETIONS.sync(lambda cursor: _changes("rewards", cursor))
+    return _COMPLETIONS
+
+def _completed_video_ids(student_id):
+    return _completions().ids(student_id)
 
 @app.get("/api/videos")
 def get_videos():
     subject = request.args.get("materia")
-    videos = _read("videos")
-    if subject:
-        videos = [v for v in videos if v.get("subject") == subject]
-
     student_id = request.args.get("student_id")
 
-    if student_id:
-        rewards = _read("rewards")
-        completed_videos = {
-            r.get("video_id")
-            for r in rewards
-            if r.get("student_id") == student_id and r.get("type") == "video"
-        }
-        # completed calculado por ID cuando hay student_id
-        for v in videos:
-            v["completed"] = v.get("id") in completed_videos
-    else:
+    def build():
+        videos = _query("videos", {"subject": subject} if subject else None)
+        if student_id:
+            # completed calculado por ID cuando hay student_id
+            completed_videos = _completed_video_ids(student_id)
+            return [{**v, "completed": v.get("id") in completed_videos} for v in videos]
         # sin student_id: ningún video marcado como completado
-        for v in videos:
-            v["completed"] = False
+        return [{**v, "completed": False} for v in videos]
+
+    if student_id:
+        # Mezcla catálogo y progreso: solo cacheable por el propio navegador
+        with _snapshot("videos", "rewards"):
+            return _cached_json(_etag("videos", "rewards"), build, "private, no-cache")
+    # El catálogo es igual para todos: se combina con /api/videos-completados
+    with _snapshot("videos"):
+        return _cached_json(_etag("videos"), build, f"public, max-age={CATALOG_MAX_AGE}")
+
+@app.get("/api/videos-completados")
+def get_completed_videos():
+    """IDs de videos completados por el estudiante (la parte por estudiante de /api/videos)."""
+    student_id = request.args.get("student_id")
+    if not student_id:
+        return jsonify({"error": "student_id es requerido"}), 400
+    with _snapshot("rewards"):
+        return _cached_json(
+            _etag("rewards"),
+            lambda: {"student_id": student_id, "video_ids": sorted(v for v in _completed_video_ids(student_id) if v)},
+            "private, no-cache",
+        )
+
+def _video_points(video):
+    # Puntos por duración (mínimo 10, 20 si >= 10:00)
+    duration = video.get("duration", "00:00")
+    try:
+        m, s = map(int, duration.split(":"))
+        return 20 if (m*60 + s) >= 600 else 10
+    except Exception:
+        return 10
 
-    return jsonify(videos)
+def _video_reward(sid, video, created_at=None):
+    """Recompensa por completar video (el duplicado lo descarta quien llama)."""
+    return {
+        "student_id": sid,
+        "type": "video",
+        "video_id": video.get("id"),
+        "points": _video_points(video),
+        "reason": f"{REASON_PREFIX}{video.get('title')}",
+        "created_at": created_at or _now_iso(),
+    }
 
 @app.post("/api/video-completo")
 def video_completo():
@@ -253,72 +557,62 @@ def video_completo():
     if not sid or not video_id:
         return jsonify({"error": "student_id y video_id son requeridos"}), 400
 
-    students = _read("students")
-    videos   = _read("videos")
-    rewards  = _read("rewards")
+    def complete(tx):
+        student = _find_one("students", "id", sid)
+        video   = _find_one("videos", "id", video_id)
+        if not student or not video:
+            return None
 
-    student = next((s for s in students if s.get("id") == sid), None)
-    video   = next((v for v in videos   if v.get("id") == video_id), None)
-    if not student or not video:
-        return jsonify({"error": "Student or video not found"}), 404
+        # Duplicado por video_id (o por título en rewards antiguos), en O(1)
+        if _completions().has(sid, video):
+            return 0
+        reward = _video_reward(sid, video)
+        tx.append("rewards", reward)
 
-    # ✅ Duplicado por ID (estable)
-    already_completed = any(
-        r.get("student_id") == sid and
-        r.get("type") == "video" and
-        r.get("video_id") == video_id
-        for r in rewards
-    )
-    # (Opcional) compatibilidad con recompensas antiguas sin video_id:
-    if not already_completed:
-        already_completed = any(
-            r.get("student_id") == sid and
-            r.get("type") == "video" and
-            video.get("title") in (r.get("reason") or "")
-            for r in rewards if "video_id" not in r
-        )
+        # Actualizar stats del estudiante
+        tx.update_one("students", "id", sid, {
+            "videos_watched": student.get("videos_watched", 0) + 1,
+            "total_points":   student.get("total_points", 0) + reward["points"],
+        })
+        return reward["points"]
 
-    if already_completed:
+    # Lectura y escritura en una transacción: dos pedidos simultáneos no
+    # otorgan el mismo video dos veces ni pierden incrementos de los contadores.
+    # rewards no entra en el CAS (cada append de test_result forzaría un
+    # reintento): todo reward de video actualiza también al estudiante, así
+    # que el CAS sobre students ya detecta el mismo video otorgado en paralelo.
+    awarded = _transaction(["students", "videos"], complete)
+    if awarded:
+        _leaderboard()
+        _publish_live()
+    if awarded is None:
+        return jsonify({"error": "Student or video not found"}), 404
+    if awarded == 0:
         return jsonify({"ok": True, "awarded": 0, "message": "Video ya completado"})
 
-    # Puntos por duración (mínimo 10, 20 si >= 10:00)
-    duration = video.get("duration", "00:00")
-    try:
-        m, s = map(int, duration.split(":"))
-        base_points = 20 if (m*60 + s) >= 600 else 10
-    except Exception:
-        base_points = 10
-
-    # Guardar reward con video_id
-    rewards.append({
-        "student_id": sid,
-        "type": "video",
-        "video_id": video_id,  # 👈 clave nueva
-        "points": base_points,
-        "reason": f"Video completado: {video.get('title')}",
-        "created_at": _now_iso(),
-    })
-    _write("rewards", rewards)
+    return jsonify({"ok": True, "awarded": awarded})
 
-    # Actualizar stats del estudiante
-    student["videos_watched"] = student.get("videos_watched", 0) + 1
-    student["total_points"]   = student.get("total_points", 0) + base_points
-    _write("students", students)
+# --- Tests Adaptativos ---
+LEVEL_MIN, LEVEL_MAX = 1, 3
+TEST_QUESTIONS = 5
+# Validez del token de una sesión de test
+TEST_SESSION_MAX_AGE = 2 * 60 * 60
 
-    return jsonify({"ok": True, "awarded": base_points})
+def _closest_level(level):
+    levels = _distinct("questions", "level")
+    return min(levels, key=lambda x: abs(x - level)) if levels else None
 
-# --- Tests Adaptativos ---
 @app.get("/api/pregunta")
 def get_question():
     level = int(request.args.get("nivel", 2))
-    questions = _read("questions")
-    subset = [q for q in questions if q.get("level") == level]
+    # Bucket del índice por nivel: elegir al azar es O(1)
+    subset = _indexed("questions", "level", level)
     
     if not subset:
         # Fallback to closest level
-        all_levels = sorted(list({q.get("level") for q in questions if q.get("level")}))
-        closest_level = min(all_levels, key=lambda x: abs(x - level)) if all_levels else 2
-        subset = [q for q in questions if q.get("level") == closest_level]
+        closest_level = _closest_level(level)
+        if closest_level is not None:
+            subset = _indexed("questions", "level", closest_level)
     
     if not subset:
         return jsonify({"error": "no questions found"}), 404
@@ -327,27 +621,127 @@ def get_question():
     q = random.choice(subset)
     return jsonify(q)
 
-@app.post("/api/test-result")
-def test_result():
-    payload = request.get_json(force=True)
-    sid = payload.get("student_id")
-    correct = int(payload.get("correct", 0))
-    final_level = int(payload.get("final_level", 2))
-    duration_seconds = int(payload.get("duration_seconds", 0))
+def _session_serializer():
+    return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt="test-session")
+
+def _public_question(q):
+    # La respuesta se corrige en el servidor: no viaja con la pregunta
+    return {k: v for k, v in q.items() if k != "answer_index"}
+
+def _draw_question(state, level):
+    """
+    Saca sin reposición una pregunta del nivel (o del más cercano con
+    preguntas restantes) y la anota en state. Cada nivel es un Fisher-Yates
+    perezoso: [restantes, {posición: reemplazo}], O(1) por pregunta.
+    """
+    pools = state["pools"]
+    levels = [level] + sorted((l for l in _distinct("questions", "level") if l != level), key=lambda l: abs(l - level))
+    for lvl in levels:
+        bucket = _indexed("questions", "level", lvl)
+        pool = pools.setdefault(str(lvl), [len(bucket), {}])
+        while pool[0] > 0:
+            remaining, swaps = pool
+            j = random.randrange(remaining)
+            last = remaining - 1
+            picked = swaps.get(str(j), j)
+            swaps[str(j)] = swaps.get(str(last), last)
+            swaps.pop(str(last), None)
+            pool[0] = last
+            # El banco pudo achicarse desde que empezó la sesión
+            if picked < len(bucket):
+                question = bucket[picked]
+                state["q"] = question.get("id")
+                state["lv"] = lvl
+                return question
+    return None
+
+def _session_payload(state, question):
+    return {
+        "session": _session_serializer().dumps(state),
+        "step": state["step"] + 1,
+        "total": state["total"],
+        "level": state["lv"],
+        "correct_count": state["ok"],
+        "question": _public_question(question),
+    }
+
+@app.post("/api/test-session")
+def start_test_session():
+    """
+    Abre un test adaptativo. body: {student_id, nivel?, preguntas?}
+    El estado viaja firmado en "session": cualquier worker puede seguirlo.
+    """
+    p = request.get_json(force=True)
+    if not isinstance(p, dict):
+        return jsonify({"error": "se espera un objeto JSON"}), 400
+    try:
+        level = min(max(int(p.get("nivel", 2)), LEVEL_MIN), LEVEL_MAX)
+        total = min(max(int(p.get("preguntas", TEST_QUESTIONS)), 1), 20)
+    except (TypeError, ValueError):
+        return jsonify({"error": "nivel y preguntas deben ser enteros"}), 400
+    state = {
+        "sid": p.get("student_id"),
+        "step": 0,
+        "total": total,
+        "ok": 0,
+        "lv": level,
+        "q": None,
+        "t0": int(time.time()),
+        "pools": {},
+    }
+    question = _draw_question(state, level)
+    if question is None:
+        return jsonify({"error": "no questions found"}), 404
+    return jsonify(_session_payload(state, question)), 201
+
+@app.post("/api/test-session/answer")
+def answer_test_session():
+    """
+    Corrige la respuesta a la pregunta actual y devuelve la siguiente.
+    body: {session, answer}. Al terminar, "done" y el resultado para
+    /api/test-result.
+    """
+    p = request.get_json(force=True)
+    if not isinstance(p, dict):
+        return jsonify({"error": "se espera un objeto JSON"}), 400
+    try:
+        state = _session_serializer().loads(p.get("session") or "", max_age=TEST_SESSION_MAX_AGE)
+    except BadSignature:
+        return jsonify({"error": "sesión inválida o vencida"}), 400
     
-    if not sid:
-        return jsonify({"error": "student_id required"}), 400
+    question = _find_one("questions", "id", state["q"])
+    if question is None:
+        return jsonify({"error": "la pregunta ya no existe"}), 409
     
-    results = _read("results")
+    ok = p.get("answer") == question.get("answer_index")
+    state["step"] += 1
+    state["ok"] += 1 if ok else 0
+    # Misma regla que el cliente: sube un nivel si acierta, baja si no
+    next_level = min(state["lv"] + 1, LEVEL_MAX) if ok else max(state["lv"] - 1, LEVEL_MIN)
+    graded = {"correct": ok, "answer_index": question.get("answer_index")}
+    
+    next_question = None
+    if state["step"] < state["total"]:
+        next_question = _draw_question(state, next_level)
+    if next_question is None:
+        return jsonify({**graded, "done": True, "result": {
+            "student_id": state["sid"],
+            "correct": state["ok"],
+            "final_level": next_level,
+            "duration_seconds": int(time.time()) - state["t0"],
+        }})
+    return jsonify({**graded, "done": False, **_session_payload(state, next_question)})
+
+def _test_records(sid, correct, final_level, duration_seconds, created_at=None):
+    """Resultado, recompensa y desglose de puntos de un test."""
+    created_at = created_at or _now_iso()
     entry = {
         "student_id": sid, 
         "correct": correct, 
         "final_level": final_level,
         "duration_seconds": duration_seconds,
-        "created_at": _now_iso()
+        "created_at": created_at
     }
-    results.append(entry)
-    _write("results", results)
 
     # More sophisticated point calculation
     base_points = 10
@@ -357,81 +751,547 @@ def test_result():
     
     total_points = base_points + accuracy_bonus + speed_bonus + level_bonus
     
-    rewards = _read("rewards")
-    rewards.append({
+    reward = {
         "student_id": sid, 
         "type": "test", 
         "points": total_points,
         "reason": f"Test completado ({correct}/5) nivel final {final_level} en {duration_seconds//60}m {duration_seconds%60}s",
-        "created_at": _now_iso()
-    })
-    _write("rewards", rewards)
-
-    return jsonify({"ok": True, "awarded": total_points, "breakdown": {
+        "created_at": created_at
+    }
+    breakdown = {
         "base": base_points,
         "accuracy": accuracy_bonus,
         "speed": speed_bonus,
         "level": level_bonus
-    }})
+    }
+    return entry, reward, breakdown
+
+@app.post("/api/test-result")
+def test_result():
+    payload = request.get_json(force=True)
+    sid = payload.get("student_id")
+    correct = int(payload.get("correct", 0))
+    final_level = int(payload.get("final_level", 2))
+    duration_seconds = int(payload.get("duration_seconds", 0))
+    
+    if not sid:
+        return jsonify({"error": "student_id required"}), 400
+    
+    entry, reward, breakdown = _test_records(sid, correct, final_level, duration_seconds)
+
+    # Resultado y recompensa se publican juntos: nadie ve uno sin el otro
+    def record(tx):
+        tx.append("results", entry)
+        tx.append("rewards", reward)
+    _transaction([], record)
+    _leaderboard()
+    _publish_live()
+
+    return jsonify({
+        "ok": True,
+        "awarded": reward["points"],
+        "breakdown": breakdown,
+        "suggested_level": _performance().suggested_level(sid),
+    })
+
+# --- Sincronización por lotes (tablets offline) ---
+BATCH_MAX_EVENTS = 500
+# Adelanto máximo aceptado en el reloj de una tablet (segundos)
+CLIENT_CLOCK_SKEW = int(os.environ.get("EDUSMART_CLIENT_CLOCK_SKEW", 300))
+
+def _client_time(value):
+    """
+    created_at de un evento en el formato de _now_iso (UTC), para que se
+    compare bien como texto. ValueError si no es ISO-8601 o está en el
+    futuro (más allá de CLIENT_CLOCK_SKEW).
+    """
+    if not isinstance(value, str):
+        raise ValueError("created_at inválido")
+    try:
+        dt = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith(("Z", "z")) else value)
+    except ValueError:
+        raise ValueError("created_at inválido")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    if dt > datetime.datetime.utcnow() + datetime.timedelta(seconds=CLIENT_CLOCK_SKEW):
+        raise ValueError("created_at en el futuro")
+    return dt.isoformat() + "Z"
+
+def _batch_events():
+    """Lista de eventos del body ({"events": [...]} o el array directo), o (respuesta, status)."""
+    p = request.get_json(force=True)
+    events = p.get("events") if isinstance(p, dict) else p
+    if not isinstance(events, list):
+        return None, (jsonify({"error": "se espera una lista de eventos"}), 400)
+    if len(events) > BATCH_MAX_EVENTS:
+        return None, (jsonify({"error": f"máximo {BATCH_MAX_EVENTS} eventos por lote"}), 413)
+    return events, None
+
+def _batch_response(outcomes):
+    _leaderboard()
+    _publish_live()
+    return jsonify({
+        "ok": True,
+        "awarded": sum(o.get("awarded", 0) for o in outcomes),
+        "items": outcomes,
+    })
+
+@app.post("/api/test-result/batch")
+def test_result_batch():
+    """
+    Registra varios tests de una vez. Cada evento es como el body de
+    /api/test-result, con created_at opcional (hora original en la tablet).
+    Un evento con el mismo student_id y created_at que un resultado ya
+    guardado (o anterior en el lote) es un reenvío y se ignora.
+    """
+    events, error = _batch_events()
+    if error:
+        return error
+
+    def record_all(tx):
+        outcomes, seen = [], {}
+        for i, ev in enumerate(events):
+            try:
+                if not isinstance(ev, dict) or not ev.get("student_id"):
+                    raise ValueError("student_id required")
+                sid = ev["student_id"]
+                created_at = ev.get("created_at")
+                if created_at is not None:
+                    created_at = _client_time(created_at)
+                entry, reward, breakdown = _test_records(
+                    sid, int(ev.get("correct", 0)), int(ev.get("final_level", 2)),
+                    int(ev.get("duration_seconds", 0)), created_at,
+                )
+            except (TypeError, ValueError) as e:
+                outcomes.append({"index": i, "status": "invalid", "error": str(e)})
+                continue
+            if created_at:
+                if sid not in seen:
+                    seen[sid] = {r.get("created_at") for r in _query("results", {"student_id": sid})}
+                if created_at in seen[sid]:
+                    outcomes.append({"index": i, "status": "duplicate", "awarded": 0})
+                    continue
+                seen[sid].add(created_at)
+            tx.append("results", entry)
+            tx.append("rewards", reward)
+            outcomes.append({"index": i, "status": "ok", "awarded": reward["points"], "breakdown": breakdown})
+        return outcomes
+
+    # Todo el lote en una transacción: un append por colección
+    return _batch_response(_transaction(["results"], record_all))
+
+@app.post("/api/video-completo/batch")
+def video_completo_batch():
+    """
+    Marca varios videos como completados de una vez, con las mismas reglas
+    de duplicado que /api/video-completo (también entre eventos del lote).
+    Cada evento: {student_id, video_id, created_at?}.
+    """
+    events, error = _batch_events()
+    if error:
+        return error
+
+    def complete_all(tx):
+        # Se sincroniza antes de agregar nada: los del lote se llevan en added
+        done = _completions()
+        outcomes, added, totals = [], {}, {}
+        for i, ev in enumerate(events):
+            sid = ev.get("student_id") if isinstance(ev, dict) else None
+            video_id = ev.get("video_id") if isinstance(ev, dict) else None
+            if not sid or not video_id:
+                outcomes.append({"index": i, "status": "invalid", "error": "student_id y video_id son requeridos"})
+                continue
+            try:
+                created_at = _client_time(ev["created_at"]) if ev.get("created_at") is not None else None
+            except ValueError as e:
+                outcomes.append({"index": i, "status": "invalid", "error": str(e)})
+                continue
+            student = _find_one("students", "id", sid)
+            video = _find_one("videos", "id", video_id)
+            if not student or not video:
+                outcomes.append({"index": i, "status": "not_found", "error": "Student or video not found"})
+                continue
+            if video_id in added.get(sid, ()) or done.has(sid, video):
+                outcomes.append({"index": i, "status": "duplicate", "awarded": 0})
+                continue
+            reward = _video_reward(sid, video, created_at)
+            added.setdefault(sid, set()).add(video_id)
+            tx.append("rewards", reward)
+            watched, points = totals.get(sid, (0, 0))
+            totals[sid] = (watched + 1, points + reward["points"])
+            outcomes.append({"index": i, "status": "ok", "awarded": reward["points"]})
+
+        # Un update por estudiante con los incrementos de todo el lote
+        for sid, (watched, points) in totals.items():
+            student = _find_one("students", "id", sid)
+            tx.update_one("students", "id", sid, {
+                "videos_watched": student.get("videos_watched", 0) + watched,
+                "total_points":   student.get("total_points", 0) + points,
+            })
+        return outcomes
+
+    # Como /api/video-completo: rewards solo se agrega, el CAS va sobre students
+    return _batch_response(_transaction(["students", "videos"], complete_all))
 
 # --- Rewards & Results ---
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 500
+
+def _page_args():
+    """Filtros y paginación comunes: student_id, since, until, limit, cursor."""
+    sid = request.args.get("student_id")
+    where = {"student_id": sid} if sid else None
+    since = request.args.get("since") or None
+    until = request.args.get("until") or None
+    try:
+        limit = int(request.args.get("limit", PAGE_DEFAULT_LIMIT))
+    except ValueError:
+        limit = PAGE_DEFAULT_LIMIT
+    limit = min(max(limit, 1), PAGE_MAX_LIMIT)
+    return where, since, until, limit, request.args.get("cursor")
+
 @app.get("/api/rewards")
 def get_rewards():
-    sid = request.args.get("student_id")
-    rewards = _read("rewards")
-    if sid:
-        rewards = [r for r in rewards if r.get("student_id") == sid]
-    
-    rewards = sorted(rewards, key=lambda r: r.get("created_at", ""), reverse=True)
-    total = sum(r.get("points", 0) for r in rewards)
-    
-    # Group by type for summary
-    by_type = {}
-    for r in rewards:
-        type_key = r.get("type", "other")
-        if type_key not in by_type:
-            by_type[type_key] = {"count": 0, "points": 0}
-        by_type[type_key]["count"] += 1
-        by_type[type_key]["points"] += r.get("points", 0)
+    where, since, until, limit, cursor = _page_args()
+    with _snapshot("rewards"):
+        try:
+            rewards, next_cursor = _page("rewards", where, since, until, limit, cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Group by type for summary (todo el rango, no solo esta página)
+        by_type = {}
+        for type_key, group in _stats("rewards", where, ["points"], group_by="type", since=since, until=until).items():
+            entry = by_type.setdefault(type_key or "other", {"count": 0, "points": 0})
+            entry["count"] += group["count"]
+            entry["points"] += group["sum"]["points"]
+    total = sum(entry["points"] for entry in by_type.values())
     
     return jsonify({
         "total": total, 
         "items": rewards,
+        "next_cursor": next_cursor,
         "summary": by_type
     })
 
 @app.get("/api/results")
 def get_results():
-    sid = request.args.get("student_id")
-    results = _read("results")
-    if sid:
-        results = [r for r in results if r.get("student_id") == sid]
-    
-    results = sorted(results, key=lambda r: r.get("created_at", ""), reverse=True)
-    
-    # Add some analytics
-    if results:
-        avg_score = sum(r.get("correct", 0) for r in results) / len(results)
-        best_score = max(r.get("correct", 0) for r in results)
-        avg_level = sum(r.get("final_level", 2) for r in results) / len(results)
+    where, since, until, limit, cursor = _page_args()
+    with _snapshot("results"):
+        try:
+            results, next_cursor = _page("results", where, since, until, limit, cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Add some analytics
+        agg = _stats("results", where, ["correct", "final_level"], since=since, until=until)
+    if agg["count"]:
+        avg_score = agg["sum"]["correct"] / agg["count"]
+        best_score = agg["max"]["correct"] or 0
+        avg_level = agg["sum"]["final_level"] / agg["count"]
     else:
         avg_score = avg_level = best_score = 0
     
     return jsonify({
         "results": results,
+        "next_cursor": next_cursor,
         "analytics": {
-            "total_tests": len(results),
+            "total_tests": agg["count"],
             "avg_score": round(avg_score, 1),
             "best_score": best_score,
             "avg_level": round(avg_level, 1)
         }
     })
 
+# --- Export ---
+# El stream se arma en tramos de este tamaño (bytes, antes de comprimir)
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+@app.get("/api/export/<collection>")
+def export_collection(collection):
+    """
+    results o rewards completos como NDJSON en streaming, del más nuevo al
+    más viejo. Filtros: student_id, course, since, until. Memoria constante
+    sin importar el tamaño; con Accept-Encoding: gzip el stream va comprimido.
+    """
+    if collection not in ("results", "rewards"):
+        return jsonify({"error": "colección no exportable"}), 404
+    sid = request.args.get("student_id") or None
+    course = (request.args.get("course") or "").strip() or None
+    since = request.args.get("since") or None
+    until = request.args.get("until") or None
+
+    records = _iter_sorted(collection, {"student_id": sid} if sid else None, since, until)
+    if course:
+        # El curso está en students: se filtra por el conjunto de sus ids
+        members = {s["id"] for s in _query("students", {"course": course})}
+        records = (r for r in records if r.get("student_id") in members)
+    compress = request.accept_encodings.best_match(["gzip", "identity"]) == "gzip"
+
+    def generate():
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31) if compress else None
+        buffer, size = [], 0
+        for record in records:
+            line = serializer.dumps(record) + b"\n"
+            buffer.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_BYTES:
+                data = b"".join(buffer)
+                buffer, size = [], 0
+                data = compressor.compress(data) if compressor else data
+                if data:
+                    yield data
+        data = b"".join(buffer)
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+
+    headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return app.response_class(generate(), mimetype="application/x-ndjson", headers=headers)
+
+# --- Leaderboard ---
+LEADERBOARD_DEFAULT_LIMIT = 10
+_LEADERBOARD = Leaderboard()
+
+def _leaderboard():
+    """Ranking al día: aplica solo los rewards nuevos desde la última vez."""
+    def course_of(sid):
+        student = _find_one("students", "id", sid)
+        return student.get("course") if student else None
+    _LEADERBOARD.sync(lambda cursor: _changes("rewards", cursor), course_of)
+    return _LEADERBOARD
+
+# --- Nivel sugerido (ver performance.py) ---
+_PERFORMANCE = RecentPerformance()
+
+def _performance():
+    """Ventanas de results recientes al día (solo se agregan los results nuevos)."""
+    _PERFORMANCE.sync(lambda cursor: _changes("results", cursor))
+    return _PERFORMANCE
+
+@app.get("/api/leaderboard")
+def get_leaderboard():
+    course = (request.args.get("course") or "").strip()
+    if not course:
+        return jsonify({"error": "course es requerido"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", LEADERBOARD_DEFAULT_LIMIT)), 1), 100)
+    except ValueError:
+        limit = LEADERBOARD_DEFAULT_LIMIT
+    
+    board = _leaderboard()
+    top = []
+    for rank, sid, points in board.top(course, limit):
+        student = _find_one("students", "id", sid) or {}
+        top.append({"rank": rank, "student_id": sid, "name": student.get("name"), "points": points})
+    
+    me = None
+    sid = request.args.get("student_id")
+    if sid:
+        rank, points = board.rank(course, sid)
+        me = {"rank": rank, "student_id": sid, "points": points}
+    
+    return jsonify({"course": course, "students": board.size(course), "top": top, "me": me})
+
+# --- Eventos en vivo (SSE) ---
+_BROKER = pubsub.Broker()
+_LIVE_CURSORS = {}
+_LIVE_LOCK = threading.Lock()
+
+def _live_totals(student_id):
+    by_type = _stats("rewards", {"student_id": student_id}, ["points"], group_by="type")
+    return {
+        **_student_summary(student_id),
+        "by_type": {t or "other": {"count": group["count"], "points": group["sum"]["points"]} for t, group in by_type.items()},
+    }
+
+def _publish_live(revalidate=False):
+    """
+    Publica a los estudiantes suscritos sus results/rewards nuevos (según
+    storage._changes, así que cubre cualquier camino de escritura) y sus
+    totales al día. Sin suscriptores no lee nada. Corre tras cada escritura
+    y, desde el Poller, cada SSE_POLL_SECONDS con revalidate (lo que
+    escribieron otros workers).
+    """
+    with _LIVE_LOCK:
+        if not _BROKER.subscribers():
+            # Se retoma desde el presente con el próximo suscriptor
+            _LIVE_CURSORS.clear()
+            return
+        touched = set()
+        for name, event in (("results", "result"), ("rewards", "reward")):
+            if name not in _LIVE_CURSORS:
+                # Primer suscriptor: desde el final, sin copiar el historial
+                _LIVE_CURSORS[name] = _changes_cursor(name)
+                continue
+            records, cursor, reset = _changes(name, _LIVE_CURSORS[name], revalidate)
+            _LIVE_CURSORS[name] = cursor
+            if reset:
+                # Primera lectura o colección reescrita: no son novedades
+                continue
+            for record in records:
+                sid = record.get("student_id")
+                if _BROKER.subscribers(sid):
+                    _BROKER.publish(sid, event, record)
+                    touched.add(sid)
+        for sid in touched:
+            _BROKER.publish(sid, "totals", _live_totals(sid))
+
+_LIVE_POLLER = pubsub.Poller(_BROKER, lambda: _publish_live(revalidate=True))
+
+@app.get("/api/events/<student_id>")
+def student_events(student_id):
+    """
+    Server-Sent Events del estudiante: "totals" al conectar y después
+    "result", "reward" y "totals" a medida que se confirman.
+    """
+    if _BROKER.full():
+        return _busy()
+
+    def on_subscribe():
+        # Fija los cursores antes de leer los totales: lo posterior llega como evento
+        _publish_live()
+        _LIVE_POLLER.start()
+        return [("totals", _live_totals(student_id))]
+
+    return app.response_class(
+        pubsub.stream(_BROKER, student_id, on_subscribe), mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Analítica por curso ---
+_COHORTS = analytics.CohortColumns()
+
+def _cohorts():
+    """Columnas de results/rewards al día (solo se agregan los registros nuevos)."""
+    _COHORTS.sync(lambda cursor: _changes("results", cursor), lambda cursor: _changes("rewards", cursor))
+    return _COHORTS
+
+@app.get("/api/analytics/cohorts")
+def get_cohort_analytics():
+    """
+    Por curso: distribución de aciertos, nivel final y duración de los
+    tests, y completado de videos por materia. ?course= para uno solo. Se
+    recalcula solo cuando cambia alguna de las colecciones.
+    """
+    course = (request.args.get("course") or "").strip() or None
+    names = ("students", "videos", "results", "rewards")
+    with _snapshot(*names):
+        return _cached_json(
+            _etag(*names),
+            lambda: {"engine": analytics.engine(), "courses": _cohorts().report(_read("students"), _read("videos"), course)},
+            "private, no-cache",
+        )
+
+# --- Storage ---
+@app.get("/api/storage/stats")
+def get_storage_stats():
+    # Cuántos registros llevó cada escritura agrupada de results/rewards
+    return jsonify({"group_commit": _group_commit_stats(), "compaction": _compaction_stats(), "cache": _cache_stats()})
+
+# --- CLI ---
+@app.cli.command("migrate-sqlite")
+@click.option("--force", is_flag=True, help="Sobrescribe la base SQLite aunque ya tenga datos.")
+def migrate_sqlite_command(force):
+    """Copia backend/db/*.json a la base SQLite (una sola vez)."""
+    copied = _migrate_to_sqlite(force=force)
+    if copied is None:
+        click.echo(f"{_sqlite_path()} ya tiene datos; use --force para sobrescribir.")
+        return
+    for name, count in copied.items():
+        click.echo(f"{name}: {count} registros")
+    click.echo(f"Migración completa en {_sqlite_path()}. Active el backend con EDUSMART_STORAGE=sqlite.")
+
+def _size(n):
+    return f"{n / 1024 / 1024:.1f} MiB" if n >= 1024 * 1024 else f"{n / 1024:.1f} KiB"
+
+@app.cli.command("compact")
+@click.argument("names", nargs=-1)
+def compact_command(names):
+    """Pasa el historial de results/rewards a snapshots e informa el ahorro."""
+    if _sqlite() is not None:
+        click.echo("La compactación es del backend de archivos; SQLite no la necesita.")
+        return
+    for name in names or sorted(LOG_COLLECTIONS):
+        if name not in LOG_COLLECTIONS:
+            raise click.BadParameter(f"{name} no es un log ({', '.join(sorted(LOG_COLLECTIONS))})")
+        load_before, _ = _history_cost(name)
+        report = _compact(name)
+        if report is None:
+            click.echo(f"{name}: nada que compactar.")
+            continue
+        load_after, bytes_after = _history_cost(name)
+        click.echo(
+            f"{name}: {report['records']} registros; disco {_size(report['before_bytes'])} -> {_size(bytes_after)} "
+            f"(snapshot {_size(report['snapshot_bytes'])} + cola {_size(report['tail_bytes'])}); "
+            f"carga {load_before * 1000:.1f} ms -> {load_after * 1000:.1f} ms"
+        )
+
+@app.cli.command("reconcile-summaries")
+@click.option("--fix", is_flag=True, help="Guarda en cada student los contadores recalculados.")
+def reconcile_summaries_command(fix):
+    """Recalcula los resúmenes por estudiante desde los logs e informa diferencias."""
+    drifted = 0
+    for name in ("results", "rewards"):
+        for key, (cached, rebuilt) in sorted(_rebuild_summaries(name).items(), key=lambda kv: str(kv[0])):
+            drifted += 1
+            click.echo(f"{name}[{key}]: en memoria {cached} != recalculado {rebuilt}")
+
+    fields = ("total_points", "tests_completed", "videos_watched")
+    def reconcile(tx):
+        stale = []
+        for student in _read("students"):
+            summary = _student_summary(student["id"])
+            changes = {f: summary[f] for f in fields if student.get(f) != summary[f]}
+            if changes:
+                stale.append((student["id"], {f: student.get(f) for f in changes}, changes))
+                if fix:
+                    tx.update_one("students", "id", student["id"], changes)
+        return stale
+
+    stale = _transaction(["students", "results", "rewards"], reconcile)
+    for sid, before, after in stale:
+        click.echo(f"students[{sid}]: {before} -> {after}")
+    click.echo(f"{drifted} resúmenes y {len(stale)} students con diferencias"
+               + ("; students corregidos." if fix and stale else "."))
+
+@app.cli.command("backfill-video-ids")
+@click.option("--dry-run", is_flag=True, help="Solo informa qué se cambiaría.")
+def backfill_video_ids_command(dry_run):
+    """Agrega video_id a los rewards de video antiguos (identificados por título)."""
+    def backfill(tx):
+        videos = _read("videos")
+        by_title = {}
+        for v in videos:
+            if v.get("title") and v.get("id"):
+                by_title.setdefault(v["title"], []).append(v["id"])
+        rewards, filled, unmatched = _read("rewards"), 0, []
+        for i, r in enumerate(rewards):
+            if r.get("type") != "video" or "video_id" in r:
+                continue
+            video_id = match_legacy(r, by_title, videos)
+            if video_id is None:
+                unmatched.append(r)
+                continue
+            rewards[i] = {**r, "video_id": video_id}
+            filled += 1
+        if filled and not dry_run:
+            tx.write("rewards", rewards)
+        return filled, unmatched
+
+    filled, unmatched = _transaction(["videos", "rewards"], backfill)
+    for r in unmatched:
+        click.echo(f"sin video: student {r.get('student_id')} {r.get('created_at')} {r.get('reason')!r}")
+    click.echo(f"{filled} rewards con video_id agregado{' (dry run)' if dry_run else ''}, "
+               f"{len(unmatched)} sin video identificable.")
+
 if __name__ == "__main__":
     # Ensure DB directory exists and preload files
-    os.makedirs(DB_DIR, exist_ok=True)
-    for fname in ["students", "videos", "questions", "results", "rewards"]:
-        if not os.path.exists(_db_path(fname)):
-            _write(fname, [])
+    _init_storage()
+    # Arma el ranking desde rewards antes de atender pedidos
+    _leaderboard()
     
     app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""
+Videos completados por estudiante para EduSmart.
+
+Un set de video_id por estudiante, alimentado de los rewards nuevos
+(storage._changes) como el Leaderboard: saber si un video ya se completó
+es O(1) en vez de recorrer los rewards del estudiante. Los rewards de
+video antiguos sin video_id se guardan aparte (su reason) y solo para
+ellos se compara el título por substring; el comando backfill-video-ids
+les agrega el video_id y deja ese camino vacío.
+"""
+import threading
+
+# Prefijo del reason de los rewards de video (el título va a continuación)
+REASON_PREFIX = "Video completado: "
+
+class CompletedVideos:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = {}     # student_id -> {video_id}
+        self._legacy = {}  # student_id -> [reason] de rewards de video sin video_id
+        self.cursor = None
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+            self._legacy = {}
+            self.cursor = None
+
+    def add(self, reward):
+        sid = reward.get("student_id")
+        if reward.get("type") != "video" or not sid:
+            return
+        with self._lock:
+            if "video_id" in reward:
+                self._ids.setdefault(sid, set()).add(reward["video_id"])
+            else:
+                self._legacy.setdefault(sid, []).append(reward.get("reason") or "")
+
+    def sync(self, changes):
+        """
+        Agrega los rewards nuevos desde la última sincronización.
+        changes(cursor) -> (rewards, cursor, reset) como storage._changes.
+        """
+        with self._lock:
+            rewards, cursor, reset = changes(self.cursor)
+            if reset:
+                self.clear()
+            for r in rewards:
+                self.add(r)
+            self.cursor = cursor
+
+    def ids(self, student_id):
+        """Copia del set de video_id completados por el estudiante."""
+        with self._lock:
+            return set(self._ids.get(student_id, ()))
+
+    def has(self, student_id, video):
+        """¿El estudiante ya completó video (por id o, en rewards antiguos, por título)?"""
+        with self._lock:
+            if video.get("id") in self._ids.get(student_id, ()):
+                return True
+            legacy = self._legacy.get(student_id)
+            if not legacy:
+                return False
+            title = video.get("title")
+            return bool(title) and any(title in reason for reason in legacy)
+
+    def legacy_count(self):
+        with self._lock:
+            return sum(len(v) for v in self._legacy.values())
+
+def match_legacy(reward, videos_by_title, videos):
+    """
+    video_id de un reward de video sin video_id, o None si no se puede
+    decidir. Primero el título exacto tras REASON_PREFIX; si no, el único
+    video cuyo título aparece en reason.
+    """
+    reason = reward.get("reason") or ""
+    if reason.startswith(REASON_PREFIX):
+        ids = videos_by_title.get(reason[len(REASON_PREFIX):], ())
+        if len(ids) == 1:
+            return ids[0]
+        if ids:
+            return None
+    found = {v["id"] for v in videos if v.get("title") and v.get("id") and v["title"] in reason}
+    return found.pop() if len(found) == 1 else None
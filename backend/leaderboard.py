@@ -0,0 +1,76 @@
+"""
+Ranking de puntos por curso para EduSmart.
+
+Cada curso es una lista ordenada de (-puntos, student_id): el top-N es un
+slice y el puesto de un estudiante sale con bisect en O(log n). Se alimenta
+de los rewards nuevos (storage._changes), así que incluye lo que escriban
+otros workers, los lotes y cualquier otro camino que otorgue puntos.
+"""
+import bisect, threading
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._courses = {}   # curso -> [(-puntos, student_id)] ordenada
+        self._students = {}  # student_id -> (curso, puntos)
+        self.cursor = None
+
+    def clear(self):
+        with self._lock:
+            self._courses = {}
+            self._students = {}
+            self.cursor = None
+
+    def add(self, student_id, course, points):
+        """Suma points al estudiante (y lo mueve dentro de su curso)."""
+        with self._lock:
+            old_course, total = self._students.get(student_id, (None, 0))
+            if old_course is not None:
+                ranking = self._courses[old_course]
+                del ranking[bisect.bisect_left(ranking, (-total, student_id))]
+                course = old_course
+            total += points
+            self._students[student_id] = (course, total)
+            bisect.insort(self._courses.setdefault(course, []), (-total, student_id))
+
+    def sync(self, changes, course_of):
+        """
+        Aplica los rewards agregados desde la última sincronización.
+        changes(cursor) -> (rewards, cursor, reset) como storage._changes;
+        course_of(student_id) -> curso o None (estudiante desconocido).
+        """
+        with self._lock:
+            rewards, cursor, reset = changes(self.cursor)
+            if reset:
+                self.clear()
+            for r in rewards:
+                sid, points = r.get("student_id"), r.get("points")
+                if not sid or not points:
+                    continue
+                known = self._students.get(sid)
+                course = known[0] if known else course_of(sid)
+                if course:
+                    self.add(sid, course, points)
+            self.cursor = cursor
+
+    def top(self, course, limit):
+        """[(puesto, student_id, puntos)] de los primeros limit del curso."""
+        with self._lock:
+            ranking = self._courses.get(course, [])[:limit]
+            return [(self._rank(course, -neg), sid, -neg) for neg, sid in ranking]
+
+    def _rank(self, course, points):
+        # Puesto de competencia: 1 + cuántos tienen estrictamente más puntos
+        return bisect.bisect_left(self._courses.get(course, []), (-points, "")) + 1
+
+    def rank(self, course, student_id):
+        """(puesto, puntos) del estudiante en su curso; sin puntos, detrás de todos."""
+        with self._lock:
+            known = self._students.get(student_id)
+            if known is None or known[0] != course:
+                return len(self._courses.get(course, [])) + 1, 0
+            return self._rank(course, known[1]), known[1]
+
+    def size(self, course):
+        with self._lock:
+            return len(self._courses.get(course, []))
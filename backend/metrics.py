@@ -0,0 +1,182 @@
+"""
+Métricas del proceso en formato de texto de Prometheus (GET /metrics).
+
+Contadores, gauges e histogramas mínimos, sin dependencias: cada
+observación es un bisect sobre los buckets y un incremento bajo un lock
+propio de la métrica, así que se pueden dejar activas siempre. Son por
+proceso: con varios workers, Prometheus debe scrapear cada uno (o agregarse
+con la etiqueta de instancia).
+
+    REQUEST_LATENCY.observe(0.012, "/api/pregunta", "GET")
+    STORAGE_READ_BYTES.inc(4096, "results")
+"""
+import bisect, os, threading
+
+# EDUSMART_METRICS=0 apaga la instrumentación (y /metrics responde 404)
+ENABLED = os.environ.get("EDUSMART_METRICS", "1").strip().lower() not in ("0", "false", "no")
+
+# Segundos: de medio milisegundo a 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items)
+        return lines
+
+class Gauge(Counter):
+    """
+    Valor que sube y baja. Con fn, se calcula al renderizar: fn() devuelve
+    {tupla de etiquetas: valor}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self.fn is not None:
+            values = self.fn()
+            with self._lock:
+                self._values = dict(values)
+        return super().render()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # [conteo por bucket (sin acumular) ..., +Inf, suma]
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def count(self, *labels):
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(bound))])} {cumulative}")
+            labels = _labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+_REGISTRY = []
+
+def _register(metric):
+    _REGISTRY.append(metric)
+    return metric
+
+def counter(name, help, labels=()):
+    return _register(Counter(name, help, labels))
+
+def gauge(name, help, labels=(), fn=None):
+    return _register(Gauge(name, help, labels, fn))
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, help, labels, buckets))
+
+def render():
+    """Todas las métricas registradas, en el formato de texto 0.0.4."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def reset():
+    """Vacía contadores e histogramas (tests); los gauges son estado actual."""
+    for metric in _REGISTRY:
+        if not isinstance(metric, Gauge):
+            metric.clear()
+
+# --- HTTP ---
+REQUEST_LATENCY = histogram(
+    "edusmart_http_request_duration_seconds", "Latencia de los requests por ruta.", ("route", "method"))
+REQUESTS = counter(
+    "edusmart_http_requests_total", "Requests atendidos por ruta y código de estado.", ("route", "method", "status"))
+IN_FLIGHT = gauge(
+    "edusmart_http_requests_in_flight", "Requests en curso.")
+
+# --- Storage (backend de archivos) ---
+STORAGE_READ_BYTES = counter(
+    "edusmart_storage_read_bytes_total", "Bytes leídos de los archivos de cada colección.", ("collection",))
+STORAGE_WRITTEN_BYTES = counter(
+    "edusmart_storage_written_bytes_total", "Bytes escritos en los archivos de cada colección.", ("collection",))
+STORAGE_PARSE = histogram(
+    "edusmart_storage_parse_seconds", "Lectura y decodificación de un archivo (o de las líneas nuevas de un log).", ("collection",))
+STORAGE_SERIALIZE = histogram(
+    "edusmart_storage_serialize_seconds", "Serialización de registros antes de escribirlos.", ("collection",))
+STORAGE_FSYNC = histogram(
+    "edusmart_storage_fsync_seconds", "Duración de cada fsync.", ("collection",))
+STORAGE_LOCK_WAIT = histogram(
+    "edusmart_storage_lock_wait_seconds", "Espera por el lock de escritura (hilos y procesos).", ("collection",))
@@ -0,0 +1,93 @@
+"""
+Hash y verificación de contraseñas fuera del hilo del request.
+
+generate_password_hash/check_password_hash son CPU puro: se ejecutan en un
+pool de procesos acotado. Si ya hay PASSWORD_MAX_PENDING operaciones en
+curso o en cola se lanza Saturated de inmediato (el endpoint responde 503)
+en vez de dejar que una ráfaga de logins frene al resto de la API.
+
+El método/costo es configurable (EDUSMART_PASSWORD_METHOD, en el formato de
+werkzeug, p. ej. "scrypt:32768:8:1" o "pbkdf2:sha256:600000"); needs_rehash
+indica si un hash guardado se hizo con otros parámetros.
+"""
+import multiprocessing, os, threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Método de werkzeug para hashes nuevos ("" = el default de werkzeug)
+PASSWORD_METHOD = os.environ.get("EDUSMART_PASSWORD_METHOD", "").strip()
+# Procesos del pool (0 = en el mismo hilo, sin pool)
+PASSWORD_WORKERS = int(os.environ.get("EDUSMART_PASSWORD_WORKERS", min(4, os.cpu_count() or 1)))
+# Operaciones en curso + en cola antes de rechazar con Saturated
+PASSWORD_MAX_PENDING = int(os.environ.get("EDUSMART_PASSWORD_MAX_PENDING", 64))
+# Espera máxima por el resultado de una operación (segundos)
+PASSWORD_TIMEOUT = float(os.environ.get("EDUSMART_PASSWORD_TIMEOUT", 30))
+
+class Saturated(Exception):
+    """El pool de hashing tiene la cola llena."""
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_SLOTS = threading.BoundedSemaphore(PASSWORD_MAX_PENDING)
+_PREFIX = {}
+
+def _hash(password, method):
+    if method:
+        return generate_password_hash(password, method)
+    return generate_password_hash(password)
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                # Sin fork: el servidor tiene hilos (flusher, group commit, SSE) y un
+                # hijo forkeado podría heredar uno de sus locks tomado
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _POOL = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS, mp_context=context)
+    return _POOL
+
+def _submit(fn, *args):
+    slots = _SLOTS
+    if not slots.acquire(blocking=False):
+        raise Saturated()
+    if PASSWORD_WORKERS <= 0:
+        try:
+            return fn(*args)
+        finally:
+            slots.release()
+    try:
+        future = _pool().submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # El lugar se libera cuando el trabajo termina o se cancela, no cuando
+    # quien llama deja de esperar: la cola del pool nunca pasa PASSWORD_MAX_PENDING
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=PASSWORD_TIMEOUT)
+    except TimeoutError:
+        # El pool no da abasto: para quien llama es lo mismo que la cola llena.
+        # Si todavía no empezó, se saca de la cola.
+        future.cancel()
+        raise Saturated()
+
+def hash_password(password):
+    return _submit(_hash, password, PASSWORD_METHOD)
+
+def verify_password(pwhash, password):
+    if not pwhash:
+        return False
+    return _submit(check_password_hash, pwhash, password)
+
+def _method_prefix():
+    # "scrypt" se guarda como "scrypt:32768:8:1": se toma del hash de prueba
+    prefix = _PREFIX.get(PASSWORD_METHOD)
+    if prefix is None:
+        prefix = _PREFIX[PASSWORD_METHOD] = _submit(_hash, "", PASSWORD_METHOD).split("$", 1)[0]
+    return prefix
+
+def needs_rehash(pwhash):
+    """True si pwhash se generó con un método/costo distinto del configurado."""
+    return bool(pwhash) and pwhash.split("$", 1)[0] != _method_prefix()
@@ -0,0 +1,102 @@
+"""
+Ventana de rendimiento reciente por estudiante para el nivel sugerido.
+
+Cada estudiante guarda sus últimos PERFORMANCE_WINDOW results (por
+created_at) en un deque acotado junto con la suma de aciertos, así que el
+nivel sugerido sale en O(1) sin ordenar el historial. Se alimenta de los
+results nuevos (storage._changes), como el Leaderboard: incluye lotes,
+otros workers y cualquier otro camino de escritura.
+"""
+import bisect, collections, os, threading
+
+# Results recientes que cuentan para el nivel sugerido
+PERFORMANCE_WINDOW = max(1, int(os.environ.get("EDUSMART_PERFORMANCE_WINDOW", 3)))
+# Promedio de aciertos desde el que se sugiere nivel 3 / nivel 2 (debajo: nivel 1)
+LEVEL_UP_AVG = float(os.environ.get("EDUSMART_LEVEL_UP_AVG", 4))
+LEVEL_KEEP_AVG = float(os.environ.get("EDUSMART_LEVEL_KEEP_AVG", 2.5))
+# Nivel de un estudiante sin results
+DEFAULT_LEVEL = 2
+
+def level_for(avg_correct):
+    if avg_correct >= LEVEL_UP_AVG:
+        return 3
+    if avg_correct >= LEVEL_KEEP_AVG:
+        return 2
+    return 1
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+class _Window:
+    __slots__ = ("items", "total")
+
+    def __init__(self, size):
+        self.items = collections.deque(maxlen=size)  # (created_at, correct) ordenados
+        self.total = 0
+
+    def add(self, created_at, correct):
+        items = self.items
+        if not items or created_at >= items[-1][0]:
+            # Caso común (results en orden): el deque descarta el más viejo
+            if len(items) == items.maxlen:
+                self.total -= items[0][1]
+            items.append((created_at, correct))
+            self.total += correct
+            return
+        # Llegó tarde (p. ej. un lote offline): solo entra si es más nuevo que el más viejo
+        if len(items) == items.maxlen:
+            if created_at < items[0][0]:
+                return
+            self.total -= items.popleft()[1]
+        items.insert(bisect.bisect_right(items, (created_at, correct)), (created_at, correct))
+        self.total += correct
+
+class RecentPerformance:
+    def __init__(self, size=None):
+        self._lock = threading.RLock()
+        self.size = size or PERFORMANCE_WINDOW
+        self._windows = {}  # student_id -> _Window
+        self.cursor = None
+
+    def clear(self):
+        with self._lock:
+            self._windows = {}
+            self.cursor = None
+
+    def add(self, student_id, created_at, correct):
+        with self._lock:
+            window = self._windows.get(student_id)
+            if window is None:
+                window = self._windows[student_id] = _Window(self.size)
+            window.add(created_at or "", correct)
+
+    def sync(self, changes):
+        """
+        Agrega los results nuevos desde la última sincronización.
+        changes(cursor) -> (results, cursor, reset) como storage._changes.
+        """
+        with self._lock:
+            results, cursor, reset = changes(self.cursor)
+            if reset:
+                self.clear()
+            for r in results:
+                sid = r.get("student_id")
+                if sid:
+                    self.add(sid, r.get("created_at"), _int(r.get("correct")))
+            self.cursor = cursor
+
+    def recent(self, student_id):
+        """[(created_at, correct)] de la ventana, del más viejo al más nuevo."""
+        with self._lock:
+            window = self._windows.get(student_id)
+            return list(window.items) if window else []
+
+    def suggested_level(self, student_id):
+        with self._lock:
+            window = self._windows.get(student_id)
+            if not window or not window.items:
+                return DEFAULT_LEVEL
+            return level_for(window.total / len(window.items))
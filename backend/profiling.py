@@ -0,0 +1,134 @@
+"""
+Perfilado opcional de requests individuales (cProfile).
+
+Apagado por defecto. Con EDUSMART_PROFILING=1 se perfila un request si
+trae el header X-Profile (con el token de admin) o si cae en la muestra
+EDUSMART_PROFILE_SAMPLE_RATE. Cada perfil se guarda en PROFILE_DIR como
+<id>.json (las funciones con más tiempo acumulado) y <id>.prof (pstats
+completo, para snakeviz/flameprof u otro visor de flame graphs); solo se
+conservan los PROFILE_MAX más recientes.
+
+Apagado, el costo por request es leer ENABLED.
+"""
+import cProfile, io, os, pstats, random, re, threading, uuid
+from datetime import datetime, timezone
+
+from backend import serializer
+
+ENABLED = os.environ.get("EDUSMART_PROFILING", "").strip().lower() in ("1", "true", "yes")
+# Fracción de requests perfilados sin pedirlo (0 = solo con X-Profile)
+SAMPLE_RATE = float(os.environ.get("EDUSMART_PROFILE_SAMPLE_RATE", 0))
+# Directorio de los perfiles (por defecto <DB_DIR>/profiles)
+PROFILE_DIR = os.environ.get("EDUSMART_PROFILE_DIR")
+# Perfiles guardados como máximo (se borran los más viejos)
+PROFILE_MAX = int(os.environ.get("EDUSMART_PROFILE_MAX", 50))
+# Funciones que se guardan en el resumen
+PROFILE_TOP = int(os.environ.get("EDUSMART_PROFILE_TOP", 40))
+
+_ID = re.compile(r"^[0-9]{20}-[0-9a-f]{8}$")
+_RING_LOCK = threading.Lock()
+
+def profile_dir():
+    if PROFILE_DIR:
+        return PROFILE_DIR
+    from backend.storage import DB_DIR
+    return os.path.join(DB_DIR, "profiles")
+
+def should_profile(requested):
+    """requested: el request pidió perfil con un token de admin válido."""
+    return ENABLED and (requested or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE))
+
+def start():
+    """Un profiler activo, o None si no se pudo (p. ej. ya hay otro en 3.12+)."""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+def _top(stats, limit):
+    rows = []
+    for (filename, line, function), (cc, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": function,
+            "file": filename,
+            "line": line,
+            "ncalls": ncalls,
+            "primitive_calls": cc,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+def finish(profiler, info):
+    """
+    Detiene profiler y guarda el perfil con info (ruta, método, estado,
+    duración...). Devuelve el id.
+    """
+    profiler.disable()
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    now = datetime.now(timezone.utc)
+    profile_id = f"{now:%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    summary = {
+        "id": profile_id,
+        "created_at": now.isoformat().replace("+00:00", "Z"),
+        **info,
+        "total_calls": stats.total_calls,
+        "top": _top(stats, PROFILE_TOP),
+    }
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stats.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+    # El .json aparece completo o no aparece: es lo que lista list_profiles
+    path = os.path.join(directory, f"{profile_id}.json")
+    with open(path + ".tmp", "wb") as f:
+        f.write(serializer.dumps(summary))
+    os.replace(path + ".tmp", path)
+    _trim(directory)
+    return profile_id
+
+def _ids(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    # El id empieza con la fecha: ordenar por nombre es ordenar por antigüedad
+    return sorted(n[:-5] for n in names if n.endswith(".json") and _ID.match(n[:-5]))
+
+def _trim(directory):
+    with _RING_LOCK:
+        ids = _ids(directory)
+        for old in ids[:max(0, len(ids) - PROFILE_MAX)]:
+            for ext in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(directory, old + ext))
+                except FileNotFoundError:
+                    pass
+
+def list_profiles():
+    """Resúmenes (sin el detalle de funciones), del más nuevo al más viejo."""
+    out = []
+    for profile_id in reversed(_ids(profile_dir())):
+        profile = load(profile_id)
+        if profile is not None:
+            profile.pop("top", None)
+            out.append(profile)
+    return out
+
+def load(profile_id):
+    if not _ID.match(profile_id or ""):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), f"{profile_id}.json"), "rb") as f:
+            return serializer.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+def pstats_path(profile_id):
+    """Ruta del .prof de profile_id, o None."""
+    if not _ID.match(profile_id or ""):
+        return None
+    path = os.path.join(profile_dir(), f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
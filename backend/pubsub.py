@@ -0,0 +1,154 @@
+"""
+Pub/sub en proceso para eventos en vivo (Server-Sent Events).
+
+Cada suscriptor tiene una cola acotada (SSE_QUEUE_SIZE). publish nunca
+bloquea: si la cola de un suscriptor está llena, se lo desconecta (el
+EventSource del navegador reconecta solo y vuelve a recibir el estado
+completo). stream() manda un comentario de heartbeat cada
+SSE_HEARTBEAT_SECONDS, que además detecta conexiones muertas, y cierra el
+stream tras SSE_IDLE_TIMEOUT segundos sin eventos.
+
+Es por proceso: con varios workers, cada uno publica lo que ve en su
+storage._changes. Mientras haya suscriptores, un Poller lo consulta cada
+SSE_POLL_SECONDS, así que también llega lo que escriben los otros workers.
+"""
+import os, queue, threading, time
+
+from backend import serializer
+
+# Eventos pendientes por suscriptor antes de desconectarlo
+SSE_QUEUE_SIZE = int(os.environ.get("EDUSMART_SSE_QUEUE_SIZE", 64))
+# Segundos entre heartbeats
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("EDUSMART_SSE_HEARTBEAT_SECONDS", 15))
+# Segundos sin eventos tras los que se cierra el stream (el cliente reconecta)
+SSE_IDLE_TIMEOUT = float(os.environ.get("EDUSMART_SSE_IDLE_TIMEOUT", 300))
+# Conexiones abiertas como máximo (cada una ocupa un hilo del servidor)
+SSE_MAX_SUBSCRIBERS = int(os.environ.get("EDUSMART_SSE_MAX_SUBSCRIBERS", 200))
+# Cada cuánto se buscan escrituras de otros workers mientras haya suscriptores
+SSE_POLL_SECONDS = float(os.environ.get("EDUSMART_SSE_POLL_SECONDS", 0.5))
+# Espera sugerida al navegador antes de reconectar (ms)
+SSE_RETRY_MS = 3000
+
+class TooManySubscribers(Exception):
+    """Se alcanzó SSE_MAX_SUBSCRIBERS."""
+
+class Subscription:
+    __slots__ = ("topic", "queue", "overflowed")
+
+    def __init__(self, topic, maxsize):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}  # topic -> {Subscription}
+        self._count = 0
+        self.dropped = 0
+
+    def subscribe(self, topic):
+        with self._lock:
+            if self._count >= SSE_MAX_SUBSCRIBERS:
+                raise TooManySubscribers()
+            sub = Subscription(topic, SSE_QUEUE_SIZE)
+            self._topics.setdefault(topic, set()).add(sub)
+            self._count += 1
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._topics.get(sub.topic)
+            if subs is None or sub not in subs:
+                return
+            subs.discard(sub)
+            self._count -= 1
+            if not subs:
+                del self._topics[sub.topic]
+
+    def full(self):
+        return self._count >= SSE_MAX_SUBSCRIBERS
+
+    def subscribers(self, topic=None):
+        """Suscriptores de topic (o de todos)."""
+        if topic is None:
+            return self._count
+        return len(self._topics.get(topic, ()))
+
+    def publish(self, topic, event, data):
+        """Encola (event, data) para cada suscriptor de topic; devuelve a cuántos."""
+        with self._lock:
+            subs = list(self._topics.get(topic, ()))
+        for sub in subs:
+            try:
+                sub.queue.put_nowait((event, data))
+            except queue.Full:
+                # Cliente lento: se lo desconecta en vez de frenar a quien publica
+                sub.overflowed = True
+                self.dropped += 1
+                self.unsubscribe(sub)
+        return len(subs)
+
+class Poller:
+    """
+    Llama a poll() cada SSE_POLL_SECONDS en un hilo propio mientras broker
+    tenga suscriptores; el hilo termina con el último y start() lo vuelve a
+    lanzar (también en un worker recién forkeado, que no hereda el hilo).
+    """
+    def __init__(self, broker, poll):
+        self.broker = broker
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._pid = None
+        self.errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="edusmart-sse-poll", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(SSE_POLL_SECONDS)
+            with self._lock:
+                if not self.broker.subscribers():
+                    self._pid = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                self.errors += 1
+
+def format_event(event, data):
+    return f"event: {event}\ndata: ".encode() + serializer.dumps(data) + b"\n\n"
+
+def stream(broker, topic, on_subscribe):
+    """
+    Generador SSE para topic. on_subscribe() corre recién suscripto y
+    devuelve los (event, data) iniciales: lo que se publique desde ahí ya
+    queda en la cola, así que no se pierde nada entre el estado y los
+    eventos. La suscripción se libera al cerrarse el stream.
+    """
+    try:
+        sub = broker.subscribe(topic)
+    except TooManySubscribers:
+        return
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+        for event, data in on_subscribe():
+            yield format_event(event, data)
+        idle_since = time.monotonic()
+        while not sub.overflowed:
+            try:
+                event, data = sub.queue.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                if time.monotonic() - idle_since >= SSE_IDLE_TIMEOUT:
+                    return
+                yield b": ping\n\n"
+                continue
+            idle_since = time.monotonic()
+            yield format_event(event, data)
+    finally:
+        broker.unsubscribe(sub)
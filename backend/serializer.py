@@ -0,0 +1,42 @@
+"""
+Serialización JSON de EduSmart, compartida por storage y las respuestas HTTP.
+
+Siempre compacta (sin indentación ni espacios) y en UTF-8. Si orjson está
+instalado se usa en lugar de json de la biblioteca estándar; es opcional,
+EDUSMART_JSON_ENCODER=json fuerza la estándar.
+"""
+import json, os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# "auto" (orjson si está instalado), "orjson" o "json"
+JSON_ENCODER = os.environ.get("EDUSMART_JSON_ENCODER", "auto").strip().lower()
+
+def _orjson():
+    return orjson is not None and JSON_ENCODER in ("auto", "orjson")
+
+def encoder_name():
+    return "orjson" if _orjson() else "json"
+
+def dumps(obj, default=None, sort_keys=False, indent=False):
+    """obj como JSON en bytes UTF-8. default(obj) convierte tipos no soportados."""
+    if _orjson():
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(
+        obj, default=default, sort_keys=sort_keys, ensure_ascii=False,
+        indent=2 if indent else None, separators=None if indent else (",", ":"),
+    ).encode("utf-8")
+
+def loads(data):
+    """Decodifica JSON desde bytes o str."""
+    if _orjson():
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,308 @@
+"""
+Backend SQLite (modo WAL) para EduSmart.
+
+Cada colección es una tabla con:
+  - pos: orden de inserción (equivale a la posición en la lista JSON),
+  - columnas extraídas para filtrar/ordenar/agregar en SQL (COLUMNS),
+  - data: el registro completo serializado como JSON.
+
+Se activa con EDUSMART_STORAGE=sqlite; storage.py delega aquí sus funciones.
+"""
+import os, sqlite3, threading
+
+from backend import serializer
+from contextlib import contextmanager
+
+# Columnas extraídas por colección (el resto se consulta con json_extract)
+COLUMNS = {
+    "students": ("id", "username", "course"),
+    "videos": ("id", "subject"),
+    "questions": ("id", "level"),
+    "results": ("student_id", "correct", "final_level", "duration_seconds", "created_at"),
+    "rewards": ("student_id", "type", "video_id", "points", "created_at"),
+}
+
+# Índices SQL por colección
+SQL_INDEXES = {
+    "students": [("id",), ("username",), ("course",)],
+    "videos": [("id",), ("subject",)],
+    "questions": [("level",)],
+    "results": [("student_id", "created_at"), ("created_at",)],
+    "rewards": [("student_id", "created_at"), ("student_id", "type"), ("created_at",)],
+}
+
+def _column_value(field, record):
+    value = record.get(field)
+    # username se guarda en minúsculas para que el índice sea case-insensitive
+    if field == "username" and isinstance(value, str):
+        return value.lower()
+    return value
+
+class SqliteStore:
+    def __init__(self, path, synchronous="NORMAL"):
+        self.path = path
+        # PRAGMA synchronous: FULL, NORMAL u OFF (ver storage.DURABILITY)
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._tables = set()
+        self._tables_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # isolation_level=None: autocommit, las transacciones se abren a mano
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Transacción de escritura (BEGIN IMMEDIATE). Si ya hay una abierta en
+        este hilo, las operaciones se suman a ella.
+        """
+        conn = self._conn()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def begin_read(self):
+        """Abre (o anida) una transacción de lectura: en WAL ve un snapshot fijo."""
+        depth = getattr(self._local, "read_depth", 0)
+        conn = self._conn()
+        if depth == 0 and not conn.in_transaction:
+            conn.execute("BEGIN")
+            self._local.read_owner = True
+        elif depth == 0:
+            self._local.read_owner = False
+        self._local.read_depth = depth + 1
+
+    def end_read(self):
+        self._local.read_depth -= 1
+        if self._local.read_depth == 0 and self._local.read_owner:
+            self._conn().execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _table(self, name):
+        if not name.isidentifier():
+            raise ValueError(f"nombre de colección inválido: {name}")
+        if name in self._tables:
+            return
+        with self._tables_lock:
+            if name in self._tables:
+                return
+            conn = self._conn()
+            conn.execute("CREATE TABLE IF NOT EXISTS _versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            cols = "".join(f", {c}" for c in COLUMNS.get(name, ()))
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (pos INTEGER PRIMARY KEY AUTOINCREMENT{cols}, data TEXT NOT NULL)")
+            for fields in SQL_INDEXES.get(name, []):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{'_'.join(fields)} ON {name} ({', '.join(fields)})")
+            self._tables.add(name)
+
+    def _expr(self, name, field):
+        """Expresión SQL para field: columna propia o json_extract sobre data."""
+        if field in COLUMNS.get(name, ()):
+            return field, None
+        if not field.isidentifier():
+            raise ValueError(f"campo inválido: {field}")
+        return "json_extract(data, ?)", f"$.{field}"
+
+    def _where(self, name, where, bounds=None):
+        """
+        WHERE para where (igualdad por campo) y bounds = (campo, since,
+        until, before): since <= campo < until y (campo, pos) < before.
+        """
+        clauses, params = [], []
+        if bounds is not None:
+            field, since, until, before = bounds
+            expr, arg = self._expr(name, field)
+            bind = [arg] if arg is not None else []
+            if since is not None:
+                clauses.append(f"{expr} >= ?")
+                params += bind + [since]
+            if until is not None:
+                clauses.append(f"{expr} < ?")
+                params += bind + [until]
+            if before is not None:
+                clauses.append(f"({expr} < ? OR ({expr} = ? AND pos < ?))")
+                params += bind + [before[0]] + bind + [before[0], before[1]]
+        for field, value in (where or {}).items():
+            expr, arg = self._expr(name, field)
+            if arg is not None:
+                params.append(arg)
+            if value is None:
+                clauses.append(f"{expr} IS NULL")
+                continue
+            clauses.append(f"{expr} = ?")
+            params.append(value.lower() if field == "username" and isinstance(value, str) else value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _row(self, name, record):
+        cols = COLUMNS.get(name, ())
+        return [_column_value(c, record) for c in cols] + [serializer.dumps(record).decode("utf-8")]
+
+    def _insert_many(self, conn, name, records):
+        cols = COLUMNS.get(name, ()) + ("data",)
+        marks = ", ".join("?" for _ in cols)
+        conn.executemany(
+            f"INSERT INTO {name} ({', '.join(cols)}) VALUES ({marks})",
+            (self._row(name, r) for r in records),
+        )
+        self._bump(conn, name)
+
+    def _bump(self, conn, name):
+        # Contador por tabla: sirve de ETag (data_version es por conexión)
+        conn.execute(
+            "INSERT INTO _versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            [name],
+        )
+
+    # --- API equivalente a la de storage.py ---
+    def read(self, name):
+        self._table(name)
+        rows = self._conn().execute(f"SELECT data FROM {name} ORDER BY pos")
+        return [serializer.loads(d) for (d,) in rows]
+
+    def write(self, name, records):
+        self._table(name)
+        with self.transaction() as conn:
+            conn.execute(f"DELETE FROM {name}")
+            self._insert_many(conn, name, records)
+
+    def append(self, name, record):
+        self._table(name)
+        with self.transaction() as conn:
+            self._insert_many(conn, name, [record])
+
+    def count(self, name):
+        self._table(name)
+        return self._conn().execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    def query(self, name, where=None, order_by=None, desc=False, limit=None):
+        self._table(name)
+        sql_where, params = self._where(name, where)
+        sql = f"SELECT data FROM {name}{sql_where}"
+        if order_by:
+            expr, arg = self._expr(name, order_by)
+            if arg is not None:
+                params.append(arg)
+            # Empates en el mismo orden que sorted() estable sobre la lista
+            sql += f" ORDER BY {expr} {'DESC' if desc else 'ASC'}, pos ASC"
+        else:
+            sql += f" ORDER BY pos {'DESC' if desc else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [serializer.loads(d) for (d,) in self._conn().execute(sql, params)]
+
+    def update_one(self, name, field, value, changes):
+        self._table(name)
+        sql_where, params = self._where(name, {field: value})
+        with self.transaction() as conn:
+            row = conn.execute(f"SELECT pos, data FROM {name}{sql_where} ORDER BY pos LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            updated = {**serializer.loads(row[1]), **changes}
+            cols = COLUMNS.get(name, ()) + ("data",)
+            conn.execute(
+                f"UPDATE {name} SET {', '.join(f'{c} = ?' for c in cols)} WHERE pos = ?",
+                self._row(name, updated) + [row[0]],
+            )
+            self._bump(conn, name)
+            return updated
+
+    def page(self, name, where, bounds, limit):
+        """[(pos, registro)] que cumplen where y bounds, del más nuevo al más viejo por bounds[0]."""
+        self._table(name)
+        sql_where, params = self._where(name, where, bounds)
+        expr, arg = self._expr(name, bounds[0])
+        if arg is not None:
+            params.append(arg)
+        sql = f"SELECT pos, data FROM {name}{sql_where} ORDER BY {expr} DESC, pos DESC LIMIT ?"
+        rows = self._conn().execute(sql, params + [int(limit)])
+        return [(pos, serializer.loads(d)) for pos, d in rows]
+
+    def version(self, name):
+        """Cantidad de escrituras confirmadas sobre la tabla."""
+        self._table(name)
+        row = self._conn().execute("SELECT version FROM _versions WHERE name = ?", [name]).fetchone()
+        return row[0] if row else 0
+
+    def bounds(self, name):
+        """(primera, última) pos de la tabla; (None, None) si está vacía."""
+        self._table(name)
+        return tuple(self._conn().execute(f"SELECT MIN(pos), MAX(pos) FROM {name}").fetchone())
+
+    def rows_after(self, name, pos):
+        """[(pos, registro)] con pos mayor a la dada, en orden de inserción."""
+        self._table(name)
+        rows = self._conn().execute(f"SELECT pos, data FROM {name} WHERE pos > ? ORDER BY pos", [pos])
+        return [(p, serializer.loads(d)) for p, d in rows]
+
+    def stats(self, name, where=None, fields=(), group_by=None, bounds=None):
+        self._table(name)
+        select, params = [], []
+        if group_by:
+            expr, arg = self._expr(name, group_by)
+            select.append(expr)
+            if arg is not None:
+                params.append(arg)
+        select.append("COUNT(*)")
+        for f in fields:
+            expr, arg = self._expr(name, f)
+            select += [f"COALESCE(SUM({expr}), 0)", f"MAX({expr})"]
+            if arg is not None:
+                params += [arg, arg]
+        sql_where, where_params = self._where(name, where, bounds)
+        sql = f"SELECT {', '.join(select)} FROM {name}{sql_where}"
+        params += where_params
+        if group_by:
+            sql += " GROUP BY 1"
+        groups = {}
+        for row in self._conn().execute(sql, params):
+            row = list(row)
+            key = row.pop(0) if group_by else None
+            groups[key] = {
+                "count": row[0],
+                "sum": {f: row[1 + 2 * i] for i, f in enumerate(fields)},
+                "max": {f: row[2 + 2 * i] for i, f in enumerate(fields)},
+            }
+        return groups
+
+    def distinct(self, name, field):
+        self._table(name)
+        expr, arg = self._expr(name, field)
+        rows = self._conn().execute(
+            f"SELECT DISTINCT {expr} FROM {name} WHERE {expr} IS NOT NULL ORDER BY 1",
+            [arg, arg] if arg is not None else [],
+        )
+        return [v for (v,) in rows if v]
+
+def migrate_from_json(store, loader, names):
+    """
+    Copia las colecciones JSON a la base SQLite (migración de una sola vez).
+    loader(name) devuelve la lista de registros guardada en archivos.
+    Devuelve {colección: registros copiados}.
+    """
+    copied = {}
+    for name in names:
+        records = loader(name)
+        store.write(name, records)
+        copied[name] = len(records)
+    return copied
@@ -0,0 +1,66 @@
+"""
+Archivos de frontend/ con fingerprint y precomprimidos (gzip).
+
+Con EDUSMART_STATIC_FINGERPRINT=1, al arrancar se arma un manifiesto:
+cada recurso (css, js, imágenes...) se publica además como
+nombre.<hash>.ext, inmutable y cacheable por un año; las páginas HTML se
+reescriben para apuntar a esos nombres y se sirven con revalidación (ETag).
+Todo lo que es texto se guarda también comprimido con gzip, así que no se
+comprime en cada request.
+"""
+import gzip, hashlib, mimetypes, os, re
+
+# Extensiones que vale la pena comprimir
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg", ".txt", ".map"}
+
+# href="x" / src="x" relativos dentro de las páginas
+_REF = re.compile(r'''(?P<attr>\b(?:href|src)=)(?P<q>["'])(?P<ref>[^"'#?:]+)(?P=q)''')
+
+class Asset:
+    __slots__ = ("body", "gzip_body", "etag", "mimetype")
+
+    def __init__(self, body, mimetype, compress):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.gzip_body = None
+        if compress:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+
+def _fingerprinted(path, body):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:10]}{ext}"
+
+def build_manifest(root):
+    """
+    Devuelve ({ruta pedida: Asset}, {ruta original: ruta con fingerprint}).
+    Los recursos quedan tanto con su nombre original (revalidable) como con
+    el fingerprint (inmutable, los valores del segundo dict).
+    """
+    files = {}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            full = os.path.join(dirpath, name)
+            with open(full, "rb") as f:
+                files[os.path.relpath(full, root).replace(os.sep, "/")] = f.read()
+
+    renamed = {p: _fingerprinted(p, body) for p, body in files.items() if not p.endswith(".html")}
+    assets = {}
+    for path, body in files.items():
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        compress = os.path.splitext(path)[1].lower() in COMPRESSIBLE
+        if path.endswith(".html"):
+            base = os.path.dirname(path)
+            def swap(m):
+                target = os.path.normpath(os.path.join(base, m.group("ref"))).replace(os.sep, "/")
+                if target not in renamed:
+                    return m.group(0)
+                ref = os.path.relpath(renamed[target], base or ".").replace(os.sep, "/")
+                return f"{m.group('attr')}{m.group('q')}{ref}{m.group('q')}"
+            body = _REF.sub(swap, body.decode("utf-8")).encode("utf-8")
+            assets[path] = Asset(body, mimetype, compress)
+            continue
+        assets[path] = assets[renamed[path]] = Asset(body, mimetype, compress)
+    return assets, renamed
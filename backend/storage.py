@@ -0,0 +1,1831 @@
+"""
+Persistencia en archivos para EduSmart.
+
+Las colecciones de catálogo (students, videos, questions) se guardan como
+listas JSON. Las colecciones de historial (results, rewards) se guardan como
+logs NDJSON (un registro por línea): insertar es un append y no reescribe
+el archivo completo, así que el costo se mantiene plano aunque crezca el
+historial. Para quien lee, ambas siguen siendo una lista de dicts.
+
+Las colecciones se sirven desde memoria. El estado publicado (_STATE) es un
+dict inmutable colección -> _View que se reemplaza entero en cada escritura:
+quien lee nunca toma un lock y, con _snapshot, ve un estado consistente de
+varias colecciones a la vez. Las escrituras de otros procesos se detectan
+comparando inodo/mtime/tamaño del archivo, como máximo una vez cada
+CACHE_REVALIDATE_SECONDS; si otro proceso solo agregó líneas a un log, se
+leen únicamente esas líneas nuevas. Los logs, una vez cargados, quedan
+residentes: se extienden con cada append en vez de volver a parsearse, así
+que CATALOG_CACHE_MAX_BYTES acota solo las colecciones JSON (la memoria de
+los logs se informa en _cache_stats).
+
+Es seguro entre procesos (p. ej. gunicorn con varios workers): cada
+escritura toma, además del lock del hilo, un flock sobre <name>.lock, y las
+reescrituras completas van a un archivo temporal que luego se renombra
+(os.replace), así que nadie lee nunca un archivo a medio escribir.
+
+Cada colección en memoria mantiene además índices hash por los campos de
+INDEXES (se construyen la primera vez que se usan y se actualizan en cada
+append), de modo que _find/_find_one no recorren la colección completa.
+Del mismo modo, SUMMARIES define agregados por clave (p. ej. puntos y
+conteos por estudiante) que cada append actualiza en O(1); _stats los usa
+cuando el filtro es justamente esa clave. SORTED mantiene un orden
+cronológico (por colección y por clave) para paginar con _page y acotar
+_stats a un rango de fechas sin ordenar la colección.
+
+Las escrituras que dependen de lo leído van por _transaction: se ejecutan
+sobre un snapshot y se confirman con compare-and-swap sobre la versión de
+cada colección leída (lock por colección, no global); si otro escritor
+ganó, se reintenta. Las que solo agregan a logs sin leer nada (p. ej. un
+resultado de test y su recompensa) se agrupan (group commit): los appends
+que llegan dentro de GROUP_COMMIT_MAX_DELAY_MS se escriben con un solo
+write + fsync por colección, y cada llamada vuelve recién cuando el suyo
+está en disco.
+
+DURABILITY elige cuándo llega cada escritura al disco: "always" hace fsync
+antes de volver (appends, reescrituras y el directorio tras el rename),
+"batched" deja los appends y los renames a un hilo que hace fsync cada
+FSYNC_INTERVAL_MS y "none" nunca hace fsync. En todos los modos una caída
+del proceso no pierde lo escrito; los modos solo difieren ante un corte de
+energía. Al arrancar, _recover borra los temporales y las líneas
+incompletas que deja un proceso muerto a mitad de una escritura.
+
+Los logs se compactan (_compact, en segundo plano cuando la cola supera
+COMPACT_TAIL_BYTES, o con flask compact): el historial pasa a
+<name>.snapshot (un array JSON comprimido con zlib, más los agregados de
+SUMMARIES ya calculados) y el .ndjson queda con una línea de marca y la
+cola. Cargar es leer el snapshot de una vez y parsear solo la cola.
+
+Con EDUSMART_STORAGE=sqlite todas estas funciones delegan en
+sqlite_store.SqliteStore; _query/_stats/_distinct permiten a los handlers
+empujar filtros, orden y agregados a SQL sin saber qué backend está activo.
+"""
+import atexit, base64, bisect, collections, hashlib, heapq, itertools, json, os, threading, time, uuid, zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from backend import metrics, serializer
+from backend.sqlite_store import SqliteStore, migrate_from_json
+
+DB_DIR = os.environ.get("EDUSMART_DB_DIR") or os.path.join(os.path.dirname(__file__), "db")
+
+COLLECTIONS = ["students", "videos", "questions", "results", "rewards"]
+
+# "json" (archivos en DB_DIR) o "sqlite"
+STORAGE_BACKEND = os.environ.get("EDUSMART_STORAGE", "json").strip().lower()
+# Ruta de la base SQLite (por defecto DB_DIR/edusmart.sqlite3)
+SQLITE_PATH = os.environ.get("EDUSMART_SQLITE_PATH")
+
+# Indentar los .json (legibles a mano, pero más grandes y lentos); por defecto compactos
+JSON_PRETTY = os.environ.get("EDUSMART_JSON_PRETTY", "").strip().lower() in ("1", "true", "yes")
+
+# Colecciones guardadas como log append-only ("" = todas en JSON plano)
+LOG_COLLECTIONS = frozenset(
+    n.strip() for n in os.environ.get("EDUSMART_LOG_COLLECTIONS", "results,rewards").split(",") if n.strip()
+)
+
+# Tope de la caché de las colecciones JSON (catálogo), en memoria estimada
+# (0 = sin caché). Los logs no cuentan ni se desalojan: desalojarlos
+# obligaría a parsear todo el historial en la próxima escritura.
+# EDUSMART_CACHE_MAX_BYTES es el nombre anterior de la variable.
+CATALOG_CACHE_MAX_BYTES = int(
+    os.environ.get("EDUSMART_CATALOG_CACHE_MAX_BYTES") or os.environ.get("EDUSMART_CACHE_MAX_BYTES") or 64 * 1024 * 1024
+)
+# Memoria de una colección parseada (registros, índices, agregados y orden)
+# por byte de JSON: medido con tracemalloc, entre 3 y 6 según la colección
+PARSED_BYTES_PER_BYTE = 5
+# Cada cuánto se revisa el archivo para ver si otro proceso lo cambió
+CACHE_REVALIDATE_SECONDS = float(os.environ.get("EDUSMART_CACHE_REVALIDATE_SECONDS", 1.0))
+# Reintentos optimistas de una transacción antes de tomar los locks de entrada
+TXN_MAX_RETRIES = int(os.environ.get("EDUSMART_TXN_MAX_RETRIES", 20))
+# Group commit: máximo de registros por escritura y espera máxima por más appends
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("EDUSMART_GROUP_COMMIT_MAX_BATCH", 256))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.environ.get("EDUSMART_GROUP_COMMIT_MAX_DELAY_MS", 2.0))
+
+# Política de fsync: "always", "batched" (cada FSYNC_INTERVAL_MS) o "none" (tests, benchmarks)
+DURABILITY_MODES = ("always", "batched", "none")
+DURABILITY = os.environ.get("EDUSMART_DURABILITY", "always").strip().lower()
+if DURABILITY not in DURABILITY_MODES:
+    raise ValueError(f"EDUSMART_DURABILITY debe ser uno de {', '.join(DURABILITY_MODES)}: {DURABILITY!r}")
+FSYNC_INTERVAL_MS = float(os.environ.get("EDUSMART_FSYNC_INTERVAL_MS", 100))
+# Equivalente en SQLite (modo WAL): NORMAL confirma sin fsync hasta el checkpoint
+SQLITE_SYNCHRONOUS = {"always": "FULL", "batched": "NORMAL", "none": "OFF"}
+
+# Compacta un log en segundo plano cuando su cola (el .ndjson) supera estos bytes (0 = nunca)
+COMPACT_TAIL_BYTES = int(os.environ.get("EDUSMART_COMPACT_TAIL_BYTES", 32 * 1024 * 1024))
+# Nivel zlib de los snapshots: 1 ya reduce ~10x el NDJSON y descomprime rápido
+SNAPSHOT_COMPRESS_LEVEL = int(os.environ.get("EDUSMART_SNAPSHOT_COMPRESS_LEVEL", 1))
+SNAPSHOT_FORMAT = 1
+
+# Índices secundarios por colección: campo -> único (True) o lista de posiciones (False)
+INDEXES = {
+    "students": {"id": True, "username": True},
+    "videos": {"id": True},
+    "questions": {"id": True, "level": False},
+    "results": {"student_id": False},
+    "rewards": {"student_id": False},
+}
+
+# Agregados materializados: colección -> (campo clave, campos sumados, subgrupo)
+SUMMARIES = {
+    "results": ("student_id", ("correct", "final_level"), None),
+    "rewards": ("student_id", ("points",), "type"),
+}
+
+# Orden mantenido por colección: campo de orden y campo de partición
+SORTED = {
+    "results": ("created_at", "student_id"),
+    "rewards": ("created_at", "student_id"),
+}
+
+_EPOCHS = itertools.count(1)
+
+class Conflict(Exception):
+    """Otro escritor confirmó cambios sobre una colección leída (CAS fallido)."""
+
+class _Entry:
+    """Registros de una colección en memoria. Solo crece (append) o se reemplaza entero."""
+    __slots__ = ("records", "indexes", "summaries", "sorted", "lock", "last_used", "epoch", "lineage", "base_bytes")
+
+    def __init__(self, records, lineage=None):
+        self.records = records
+        # Identifica la entrada en los cursores de _changes
+        self.epoch = next(_EPOCHS)
+        # Identifica el contenido de un log entre recargas: cambia solo si se
+        # reescribe entero (ver _read_history); None en colecciones JSON
+        self.lineage = lineage
+        self.indexes = {}
+        self.summaries = None
+        self.sorted = None
+        # Bytes del JSON (descomprimido) del snapshot del que salió el
+        # principio de records: cuentan para la memoria como los del log
+        self.base_bytes = 0
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+
+class _View:
+    """Estado publicado de una colección: los primeros length registros de entry."""
+    __slots__ = ("entry", "length", "version", "signature", "checked_at")
+
+    def __init__(self, entry, length, version, signature):
+        self.entry = entry
+        self.length = length
+        self.version = version
+        self.signature = signature
+        self.checked_at = time.monotonic()
+
+    @property
+    def size(self):
+        """Memoria estimada de la colección parseada."""
+        return ((self.signature[2] if self.signature else 0) + self.entry.base_bytes) * PARSED_BYTES_PER_BYTE
+
+    def records(self):
+        return self.entry.records[:self.length]
+
+_STATE = {}
+_PUBLISH_LOCK = threading.Lock()
+_VERSIONS = itertools.count(1)
+# Última (firma, versión) conocida por colección: la versión no cambia si
+# la colección sale de la caché y se vuelve a cargar sin cambios en disco.
+_KNOWN = {}
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+_LOCAL = threading.local()
+
+_SQLITE = {}
+_SQLITE_LOCK = threading.Lock()
+
+def _sqlite_path():
+    return SQLITE_PATH or os.path.join(DB_DIR, "edusmart.sqlite3")
+
+def _sqlite():
+    """Devuelve el SqliteStore si el backend activo es sqlite, si no None."""
+    if STORAGE_BACKEND != "sqlite":
+        return None
+    path = _sqlite_path()
+    store = _SQLITE.get(path)
+    if store is None:
+        with _SQLITE_LOCK:
+            store = _SQLITE.setdefault(path, SqliteStore(path, SQLITE_SYNCHRONOUS[DURABILITY]))
+    return store
+
+class _CollectionLock:
+    """
+    Lock de escritura de una colección, reentrante dentro del hilo y
+    exclusivo entre procesos (flock sobre DB_DIR/<name>.lock).
+    """
+    def __init__(self, name):
+        self.name = name
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._fd = _lock_file(os.path.join(DB_DIR, f"{self.name}.lock"))
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            metrics.STORAGE_LOCK_WAIT.observe(time.perf_counter() - started, self.name)
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def _lock_file(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK se rinde tras ~10 s; se sigue esperando
+                    continue
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+def _unlock_file(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+def _lock(name):
+    """Lock de escritura de una colección (hilos y procesos)."""
+    lock = _LOCKS.get(name)
+    if lock is None:
+        with _LOCKS_GUARD:
+            lock = _LOCKS.setdefault(name, _CollectionLock(name))
+    return lock
+
+def _tmp_path(path):
+    # Único por proceso e hilo: dos workers nunca comparten el temporal
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+# --- Durabilidad ---
+def _fsync(fd, name):
+    started = time.perf_counter()
+    os.fsync(fd)
+    metrics.STORAGE_FSYNC.observe(time.perf_counter() - started, name)
+
+def _fsync_path(path, name):
+    """fsync de un archivo o directorio por ruta (los directorios, solo en POSIX)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (FileNotFoundError, PermissionError):
+        # Windows no abre directorios; el archivo pudo reemplazarse después
+        return
+    try:
+        _fsync(fd, name)
+    finally:
+        os.close(fd)
+
+class _Flusher:
+    """
+    Modo batched: junta las rutas escritas sin fsync y un hilo las
+    sincroniza cada FSYNC_INTERVAL_MS (y al terminar el proceso).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirty = {}  # ruta -> colección (para las métricas)
+        self.pid = None
+        self.flushes = 0
+        atexit.register(self.flush)
+
+    def mark(self, path, name):
+        with self.lock:
+            self.dirty[path] = name
+            if self.pid != os.getpid():
+                # Primer uso, o un worker recién forkeado (el hilo no se hereda)
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name="edusmart-fsync", daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(FSYNC_INTERVAL_MS / 1000)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+        for path, name in dirty.items():
+            _fsync_path(path, name)
+        if dirty:
+            with self.lock:
+                self.flushes += 1
+
+_FLUSHER = _Flusher()
+
+def _sync_written(f, path, name):
+    """Aplica DURABILITY a f, recién escrito en path."""
+    if DURABILITY == "always":
+        f.flush()
+        _fsync(f.fileno(), name)
+    elif DURABILITY == "batched":
+        _FLUSHER.mark(path, name)
+
+def _replace_file(path, write, name):
+    """
+    Escribe path de forma atómica: write(f) sobre un temporal y os.replace.
+    Salvo con DURABILITY "none", el temporal llega al disco antes del
+    rename: tras un corte de energía se ve el archivo viejo o el nuevo,
+    nunca uno truncado.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp = _tmp_path(path)
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+            if DURABILITY != "none":
+                f.flush()
+                _fsync(f.fileno(), name)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # El rename queda en disco con el fsync del directorio
+    if DURABILITY == "always":
+        _fsync_path(directory, name)
+    elif DURABILITY == "batched":
+        _FLUSHER.mark(directory, name)
+
+def _truncate_torn_tail(path, name):
+    """
+    Corta una última línea sin "\n" del log (un append que no terminó).
+    Devuelve los bytes descartados.
+    """
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        return 0
+    with f:
+        size = end = f.seek(0, os.SEEK_END)
+        # Busca el último "\n" leyendo hacia atrás de a bloques
+        while end > 0:
+            start = max(0, end - 64 * 1024)
+            f.seek(start)
+            chunk = f.read(end - start)
+            i = chunk.rfind(b"\n")
+            if i >= 0:
+                end = start + i + 1
+                break
+            end = start
+        if end == size:
+            return 0
+        f.truncate(end)
+        _sync_written(f, path, name)
+        return size - end
+
+def _recover():
+    """
+    Repara lo que deja un proceso muerto a mitad de una escritura: los
+    temporales de reescrituras que no llegaron al rename y una última línea
+    incompleta en los logs (el próximo append quedaría pegado a ella y el
+    log dejaría de poder leerse). Cada colección se revisa con su lock, así
+    que no toca escrituras en curso de otros workers. También termina una
+    compactación cortada entre los dos renames (ver _recover_snapshot).
+    Devuelve {colección: {"tmp_removed": n, "truncated_bytes": n,
+    "snapshot": ...}} con lo reparado.
+    """
+    if _sqlite() is not None or not os.path.isdir(DB_DIR):
+        return {}
+    report = {}
+    for name in COLLECTIONS:
+        fixed = {}
+        with _lock(name):
+            prefixes = (f"{name}.json.", f"{name}.ndjson.", f"{name}.snapshot.")
+            stale = [n for n in os.listdir(DB_DIR) if n.startswith(prefixes) and n.endswith(".tmp")]
+            for n in stale:
+                try:
+                    os.remove(os.path.join(DB_DIR, n))
+                except FileNotFoundError:
+                    pass
+            if stale:
+                fixed["tmp_removed"] = len(stale)
+            if _is_log(name):
+                truncated = _truncate_torn_tail(_log_path(name), name)
+                if truncated:
+                    fixed["truncated_bytes"] = truncated
+                snapshot = _recover_snapshot(name)
+                if snapshot:
+                    fixed["snapshot"] = snapshot
+        if fixed:
+            report[name] = fixed
+    return report
+
+def _db_path(name):
+    return os.path.join(DB_DIR, f"{name}.json")
+
+def _log_path(name):
+    return os.path.join(DB_DIR, f"{name}.ndjson")
+
+def _is_log(name):
+    return name in LOG_COLLECTIONS
+
+def _collection_path(name):
+    return _log_path(name) if _is_log(name) else _db_path(name)
+
+def _dump_line(record):
+    return serializer.dumps(record) + b"\n"
+
+def _ensure_log(name):
+    """Crea <name>.ndjson; si existe un <name>.json heredado, migra su contenido."""
+    path = _log_path(name)
+    if os.path.exists(path):
+        return
+    with _lock(name):
+        if os.path.exists(path):
+            return
+        os.makedirs(DB_DIR, exist_ok=True)
+        legacy = _db_path(name)
+        records = []
+        if os.path.exists(legacy):
+            with open(legacy, "rb") as f:
+                records = serializer.loads(f.read())
+        _replace_file(path, lambda f: f.writelines(_dump_line(r) for r in records), name)
+        if os.path.exists(legacy):
+            # Se conserva como respaldo, pero ya no se vuelve a leer
+            os.replace(legacy, legacy + ".migrated")
+
+def _read_log(name, offset=0):
+    """
+    Lee los registros del log desde offset (en bytes). Devuelve
+    (registros, firma), donde el tamaño de la firma es el offset leído.
+    Una última línea sin "\n" es un append de otro proceso todavía en
+    curso: se deja para la próxima lectura.
+    """
+    with open(_log_path(name), "rb") as f:
+        return _read_log_file(f, name, offset)
+
+def _read_log_file(f, name, offset):
+    started, start_offset = time.perf_counter(), offset
+    records = []
+    st = os.fstat(f.fileno())
+    f.seek(offset)
+    for raw in f:
+        if not raw.endswith(b"\n"):
+            break
+        offset += len(raw)
+        line = raw.strip()
+        if line and not line.startswith(_MARKER_PREFIX):
+            records.append(serializer.loads(line))
+    metrics.STORAGE_PARSE.observe(time.perf_counter() - started, name)
+    metrics.STORAGE_READ_BYTES.inc(offset - start_offset, name)
+    return records, (st.st_ino, st.st_mtime_ns, offset)
+
+def _ensure_json(name):
+    path = _db_path(name)
+    if not os.path.exists(path):
+        with _lock(name):
+            if not os.path.exists(path):
+                _replace_file(path, lambda f: f.write(serializer.dumps([])), name)
+
+def _read_json(name):
+    """Devuelve (registros, firma) del archivo JSON efectivamente leído."""
+    started = time.perf_counter()
+    with open(_db_path(name), "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    records = serializer.loads(data)
+    metrics.STORAGE_PARSE.observe(time.perf_counter() - started, name)
+    metrics.STORAGE_READ_BYTES.inc(len(data), name)
+    return records, (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _load_files(name):
+    """Lee la colección directamente de los archivos JSON/NDJSON, sin caché."""
+    if _is_log(name):
+        _ensure_log(name)
+        return _read_history(name)[0]
+    _ensure_json(name)
+    return _read_json(name)[0]
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+# --- Estado publicado ---
+def _version_for(name, signature):
+    known = _KNOWN.get(name)
+    if known is not None and signature is not None and known[0] == signature:
+        return known[1]
+    version = next(_VERSIONS)
+    _KNOWN[name] = (signature, version)
+    return version
+
+def _new_view(name, entry, signature):
+    version = next(_VERSIONS)
+    _KNOWN[name] = (signature, version)
+    return _View(entry, len(entry.records), version, signature)
+
+def _publish(views):
+    """
+    Publica de una sola vez las vistas nuevas de una o varias colecciones.
+    Los logs nunca se desalojan (ver CATALOG_CACHE_MAX_BYTES).
+    """
+    global _STATE
+    with _PUBLISH_LOCK:
+        state = dict(_STATE)
+        for name, view in views.items():
+            if view is None or view.signature is None or (not _is_log(name) and view.size > CATALOG_CACHE_MAX_BYTES):
+                state.pop(name, None)
+            else:
+                state[name] = view
+        evictable = [n for n in state if not _is_log(n)]
+        total = sum(state[n].size for n in evictable)
+        if total > CATALOG_CACHE_MAX_BYTES:
+            # Desaloja las menos usadas recientemente, salvo las recién publicadas
+            for name in sorted((n for n in evictable if n not in views), key=lambda n: state[n].entry.last_used):
+                if total <= CATALOG_CACHE_MAX_BYTES:
+                    break
+                total -= state.pop(name).size
+        _STATE = state
+
+def _cache_stats():
+    """
+    Memoria estimada (bytes) de las colecciones en caché, por colección, y
+    el total de las JSON frente a CATALOG_CACHE_MAX_BYTES.
+    """
+    state = _STATE
+    sizes = {name: view.size for name, view in state.items()}
+    return {
+        "collections": sizes,
+        "catalog_bytes": sum(size for name, size in sizes.items() if not _is_log(name)),
+        "catalog_max_bytes": CATALOG_CACHE_MAX_BYTES,
+        "log_bytes": sum(size for name, size in sizes.items() if _is_log(name)),
+    }
+
+def _cache_clear():
+    global _STATE
+    with _PUBLISH_LOCK:
+        _STATE = {}
+        _KNOWN.clear()
+
+def _load(name):
+    """Carga la colección desde disco y la publica."""
+    if _is_log(name):
+        _ensure_log(name)
+        records, signature, base_bytes, summaries, lineage = _read_history(name)
+        entry = _Entry(records, lineage)
+        entry.base_bytes = base_bytes
+        entry.summaries = summaries
+    else:
+        _ensure_json(name)
+        records, signature = _read_json(name)
+        entry = _Entry(records)
+    view = _View(entry, len(records), _version_for(name, signature), signature)
+    _publish({name: view})
+    return view
+
+def _catch_up(name, view):
+    """Lee solo las líneas que otro proceso agregó al log después de view."""
+    entry = view.entry
+    with entry.lock:
+        if len(entry.records) != view.length:
+            # Otro hilo ya extendió la entrada mientras esperábamos
+            return _STATE.get(name) or _load(name)
+        records, signature = _read_log(name, view.signature[2])
+        if signature[0] != view.signature[0]:
+            return _load(name)
+        if not records:
+            fresh = _View(entry, view.length, view.version, signature)
+            _KNOWN[name] = (signature, view.version)
+        else:
+            _extend_entry(name, entry, records)
+            fresh = _new_view(name, entry, signature)
+    _publish({name: fresh})
+    return fresh
+
+def _current(name, revalidate=False):
+    """Vista vigente de la colección (recargándola si otro proceso la cambió)."""
+    view = _STATE.get(name)
+    if view is not None:
+        now = time.monotonic()
+        view.entry.last_used = now
+        if not revalidate and now - view.checked_at < CACHE_REVALIDATE_SECONDS:
+            return view
+        signature = _signature(_collection_path(name))
+        if signature == view.signature:
+            view.checked_at = now
+            return view
+        if (_is_log(name) and signature is not None and view.signature is not None
+                and signature[0] == view.signature[0] and signature[2] >= view.signature[2]):
+            # Mismo archivo y más largo: otro proceso solo agregó líneas
+            return _catch_up(name, view)
+    return _load(name)
+
+def _view(name):
+    """Vista que ve este hilo: la del snapshot activo, o la vigente."""
+    pinned = getattr(_LOCAL, "pinned", None)
+    if pinned is not None and name in pinned:
+        return pinned[name]
+    return _current(name)
+
+class _Snapshot:
+    """
+    Vista consistente de varias colecciones. Como context manager, fija ese
+    estado para las lecturas (_read, _find, _query...) de este hilo.
+    """
+    def __init__(self, names, inherit=True):
+        self.names = list(names)
+        self.inherit = inherit
+        self.views = {}
+        self._db = _sqlite()
+        self._saved = None
+
+    def __enter__(self):
+        if self._db is not None:
+            self._db.begin_read()
+            return self
+        self._saved = getattr(_LOCAL, "pinned", None)
+        outer = self._saved or {}
+        pinned = outer if self.inherit else {}
+        loaded = {n: _current(n) for n in self.names if n not in pinned}
+        # Una sola lectura de _STATE: las colecciones confirmadas juntas se ven juntas
+        state = _STATE
+        for name in self.names:
+            self.views[name] = pinned.get(name) or state.get(name) or loaded[name]
+        _LOCAL.pinned = {**outer, **self.views}
+        return self
+
+    def __exit__(self, *exc):
+        if self._db is not None:
+            self._db.end_read()
+            return
+        _LOCAL.pinned = self._saved
+
+    @property
+    def versions(self):
+        return {name: view.version for name, view in self.views.items()}
+
+def _snapshot(*names):
+    return _Snapshot(names)
+
+# --- Índices ---
+def _index_key(field, value):
+    # username se compara sin distinguir mayúsculas
+    if field == "username" and isinstance(value, str):
+        return value.lower()
+    return value
+
+def _index_add(index, unique, field, record, pos):
+    key = _index_key(field, record.get(field))
+    if key is None:
+        return
+    if unique:
+        index.setdefault(key, pos)
+    else:
+        index.setdefault(key, []).append(pos)
+
+def _entry_index(name, entry, field):
+    """Devuelve (construyendo si hace falta) el índice de la entrada por field."""
+    index = entry.indexes.get(field)
+    if index is not None:
+        return index
+    unique = INDEXES[name][field]
+    with entry.lock:
+        index = entry.indexes.get(field)
+        if index is None:
+            index = {}
+            for pos, record in enumerate(entry.records):
+                _index_add(index, unique, field, record, pos)
+            entry.indexes[field] = index
+    return index
+
+def _extend_entry(name, entry, records):
+    with entry.lock:
+        for record in records:
+            entry.records.append(record)
+            pos = len(entry.records) - 1
+            for field, index in entry.indexes.items():
+                _index_add(index, INDEXES[name][field], field, record, pos)
+            if entry.summaries is not None:
+                _summary_add(name, entry.summaries, record)
+            if entry.sorted is not None:
+                _sorted_add(name, entry.sorted, record, pos)
+
+def _positions(name, field, value):
+    """Posiciones (dentro de la vista de este hilo) con record[field] == value."""
+    view = _view(name)
+    hit = _entry_index(name, view.entry, field).get(_index_key(field, value))
+    if hit is None:
+        return view, []
+    # Posiciones >= length son appends posteriores a esta vista
+    if isinstance(hit, int):
+        return view, [hit] if hit < view.length else []
+    return view, [i for i in list(hit) if i < view.length]
+
+# --- Orden cronológico ---
+def _sorted_insert(items, item):
+    # Casi siempre llega en orden: append; si no (p. ej. importación), insort
+    if not items or item >= items[-1]:
+        items.append(item)
+    else:
+        bisect.insort(items, item)
+
+def _sorted_add(name, sorted_, record, pos):
+    order, part = SORTED[name]
+    every, by_key = sorted_
+    item = (record.get(order) or "", pos)
+    _sorted_insert(every, item)
+    key = record.get(part)
+    if key is not None:
+        _sorted_insert(by_key.setdefault(key, []), item)
+
+def _entry_sorted(name, entry):
+    """Devuelve (construyendo si hace falta) ([(orden, pos)], {clave: [(orden, pos)]})."""
+    if entry.sorted is None:
+        with entry.lock:
+            if entry.sorted is None:
+                entry.sorted = _build_sorted(name, entry.records)
+    return entry.sorted
+
+def _build_sorted(name, records):
+    """
+    Orden completo de una vez (un sort, no un insort por registro: con
+    registros desordenados eso sería O(n²)). Los appends siguen por _sorted_add.
+    """
+    order, part = SORTED[name]
+    every = sorted((record.get(order) or "", pos) for pos, record in enumerate(records))
+    by_key = {}
+    for item in every:
+        key = records[item[1]].get(part)
+        if key is not None:
+            # every ya está ordenada: cada lista por clave sale ordenada
+            items = by_key.get(key)
+            if items is None:
+                by_key[key] = [item]
+            else:
+                items.append(item)
+    return every, by_key
+
+def _encode_cursor(value, pos):
+    raw = json.dumps([value, pos], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor):
+    """(valor de orden, pos) de un cursor de _page; ValueError si no es válido."""
+    try:
+        value, pos = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(value, str) or not isinstance(pos, int):
+        raise ValueError("cursor inválido")
+    return value, pos
+
+def _walk_sorted(name, where=None, since=None, until=None, before=None, chunk=256):
+    """
+    Recorre, del más nuevo al más viejo según SORTED, los (orden, pos,
+    registro) de la vista de este hilo que cumplen where, con
+    since <= orden < until y (orden, pos) < before. Lee la lista ordenada
+    de a tramos, sin copiarla ni ordenar la colección.
+    """
+    order, part = SORTED[name]
+    where = dict(where or {})
+    view = _view(name)
+    entry = view.entry
+    every, by_key = _entry_sorted(name, entry)
+    items = by_key.get(where.pop(part), []) if part in where else every
+    upper = min((k for k in (before, (until,) if until is not None else None) if k is not None), default=None)
+    lower = (since,) if since is not None else None
+    while True:
+        with entry.lock:
+            hi = bisect.bisect_left(items, upper) if upper is not None else len(items)
+            lo = bisect.bisect_left(items, lower) if lower is not None else 0
+            part_items = items[max(lo, hi - chunk):hi]
+        if not part_items:
+            return
+        for value, pos in reversed(part_items):
+            if pos >= view.length:
+                continue
+            record = entry.records[pos]
+            if all(record.get(f) == v for f, v in where.items()):
+                yield value, pos, record
+        # Se retoma por clave: un insort concurrente no hace saltear ni repetir
+        upper = part_items[0]
+
+# --- Agregados por clave ---
+class _Summary:
+    """Conteo, suma y máximo por campo, actualizados registro a registro."""
+    __slots__ = ("count", "sum", "max")
+
+    def __init__(self, fields):
+        self.count = 0
+        self.sum = {f: 0 for f in fields}
+        self.max = {f: None for f in fields}
+
+    def add(self, record):
+        self.count += 1
+        for f in self.sum:
+            v = record.get(f)
+            if v is None:
+                continue
+            self.sum[f] += v
+            self.max[f] = v if self.max[f] is None else max(self.max[f], v)
+
+    def as_dict(self):
+        return {"count": self.count, "sum": dict(self.sum), "max": dict(self.max)}
+
+def _summary_add(name, summaries, record):
+    """Suma record al agregado de su clave y al de la colección completa (clave None)."""
+    field, fields, group_by = SUMMARIES[name]
+    key = record.get(field)
+    for k in (None, key) if key is not None else (None,):
+        total, groups = summaries.get(k) or summaries.setdefault(k, (_Summary(fields), {}))
+        total.add(record)
+        if group_by:
+            group = record.get(group_by)
+            (groups.get(group) or groups.setdefault(group, _Summary(fields))).add(record)
+
+def _build_summaries(name, records):
+    summaries = {}
+    for record in records:
+        _summary_add(name, summaries, record)
+    return summaries
+
+def _entry_summaries(name, entry):
+    """Devuelve (construyendo si hace falta) los agregados de la entrada."""
+    if entry.summaries is None:
+        with entry.lock:
+            if entry.summaries is None:
+                entry.summaries = _build_summaries(name, entry.records)
+    return entry.summaries
+
+def _summary_stats(name, where, fields, group_by):
+    """
+    Resultado de _stats servido desde SUMMARIES (sin where: el agregado de
+    toda la colección), o None si la consulta no encaja (otro filtro, otros
+    campos) o la vista de este hilo es anterior a appends de esa clave.
+    """
+    spec = SUMMARIES.get(name)
+    if spec is None or (where and list(where) != [spec[0]]):
+        return None
+    field, summed, summary_group = spec
+    if not set(fields) <= set(summed) or group_by not in (None, summary_group):
+        return None
+    value = where[field] if where else None
+    if where and value is None:
+        return None
+    view = _view(name)
+    entry = view.entry
+    index = _entry_index(name, entry, field)
+    summaries = _entry_summaries(name, entry)
+    with entry.lock:
+        if value is None:
+            if len(entry.records) > view.length:
+                return None
+        else:
+            positions = index.get(_index_key(field, value)) or []
+            if positions and positions[-1] >= view.length:
+                return None
+        total, groups = summaries.get(value) or (_Summary(summed), {})
+        pick = lambda s: {"count": s.count, "sum": {f: s.sum[f] for f in fields}, "max": {f: s.max[f] for f in fields}}
+        if group_by:
+            return {g: pick(s) for g, s in groups.items()}
+        return pick(total)
+
+def _rebuild_summaries(name):
+    """
+    Recalcula los agregados de name desde el archivo en disco y los instala
+    en la caché. Devuelve {clave: (agregado en memoria, recalculado)} de las
+    claves que no coincidían (vacío si no había agregados construidos).
+    """
+    if name not in SUMMARIES or _sqlite() is not None:
+        return {}
+    with _lock(name):
+        view = _current(name, revalidate=True)
+        entry = view.entry
+        with entry.lock:
+            rebuilt = _build_summaries(name, _load_files(name))
+            current = entry.summaries
+            entry.summaries = _build_summaries(name, entry.records)
+    if current is None:
+        return {}
+    flat = lambda item: (item[0].as_dict(), {g: s.as_dict() for g, s in item[1].items()}) if item else None
+    drift = {}
+    for key in set(current) | set(rebuilt):
+        before, after = flat(current.get(key)), flat(rebuilt.get(key))
+        if before != after:
+            drift[key] = (before, after)
+    return drift
+
+# --- Lectura ---
+def _read(name):
+    """
+    Devuelve la colección como lista. La lista es una copia, pero los dicts
+    se comparten con la caché: no modificarlos in situ.
+    """
+    db = _sqlite()
+    if db is not None:
+        return db.read(name)
+    return _view(name).records()
+
+def _find(name, field, value):
+    """Registros con record[field] == value, en orden de inserción."""
+    db = _sqlite()
+    if db is not None:
+        return db.query(name, {field: value})
+    if field in INDEXES.get(name, {}):
+        view, positions = _positions(name, field, value)
+        return [view.entry.records[i] for i in positions]
+    key = _index_key(field, value)
+    return [r for r in _read(name) if _index_key(field, r.get(field)) == key]
+
+def _find_one(name, field, value):
+    """Primer registro con record[field] == value, o None."""
+    db = _sqlite()
+    if db is not None:
+        found = db.query(name, {field: value}, limit=1)
+        return found[0] if found else None
+    found = _find(name, field, value)
+    return found[0] if found else None
+
+def _query(name, where=None, order_by=None, desc=False, limit=None):
+    """
+    Registros que cumplen where (igualdad por campo), opcionalmente
+    ordenados por order_by y recortados a limit.
+    """
+    db = _sqlite()
+    if db is not None:
+        return db.query(name, where, order_by, desc, limit)
+    where = dict(where or {})
+    indexed = next((f for f in where if f in INDEXES.get(name, {})), None)
+    records = _find(name, indexed, where.pop(indexed)) if indexed else _read(name)
+    if where:
+        records = [r for r in records if all(r.get(f) == v for f, v in where.items())]
+    if order_by:
+        key = lambda r: r.get(order_by, "")
+        if limit is not None:
+            pick = heapq.nlargest if desc else heapq.nsmallest
+            return pick(limit, records, key=key)
+        records = sorted(records, key=key, reverse=desc)
+    elif desc:
+        # Sin order_by, desc es orden de inserción inverso (como en SQLite)
+        records = records[::-1]
+    return records if limit is None else records[:limit]
+
+def _stats(name, where=None, fields=(), group_by=None, since=None, until=None):
+    """
+    Conteo, suma y máximo de fields sobre los registros que cumplen where
+    (y, con since/until, since <= campo de orden de SORTED < until).
+    Devuelve {"count", "sum": {campo: ...}, "max": {campo: ...}}; con
+    group_by, un dict de esos resúmenes por valor del campo.
+    """
+    ranged = since is not None or until is not None
+    db = _sqlite()
+    if db is not None:
+        groups = db.stats(name, where, fields, group_by, (SORTED[name][0], since, until, None) if ranged else None)
+    else:
+        # Filtro por la clave de SUMMARIES: sin recorrer registros
+        summary = None if ranged else _summary_stats(name, where, fields, group_by)
+        if summary is not None:
+            return summary
+        if ranged:
+            records = (r for _, _, r in _walk_sorted(name, where, since, until))
+        else:
+            records = _query(name, where)
+        groups = {}
+        for r in records:
+            key = r.get(group_by) if group_by else None
+            g = groups.get(key)
+            if g is None:
+                g = groups[key] = {"count": 0, "sum": {f: 0 for f in fields}, "max": {f: None for f in fields}}
+            g["count"] += 1
+            for f in fields:
+                v = r.get(f)
+                if v is None:
+                    continue
+                g["sum"][f] += v
+                g["max"][f] = v if g["max"][f] is None else max(g["max"][f], v)
+    if group_by:
+        return groups
+    return groups.get(None) or {"count": 0, "sum": {f: 0 for f in fields}, "max": {f: None for f in fields}}
+
+def _page(name, where=None, since=None, until=None, limit=50, cursor=None):
+    """
+    Una página de registros que cumplen where, del más nuevo al más viejo
+    según el campo de orden de SORTED (desempate por posición), con
+    since <= orden < until. Devuelve (registros, cursor de la página
+    siguiente o None). Un cursor inválido lanza ValueError.
+    """
+    before = _decode_cursor(cursor) if cursor else None
+    db = _sqlite()
+    if db is not None:
+        order = SORTED[name][0]
+        rows = db.page(name, where, (order, since, until, before), limit + 1)
+        keyed = [(r.get(order) or "", pos, r) for pos, r in rows]
+    else:
+        keyed = list(itertools.islice(_walk_sorted(name, where, since, until, before), limit + 1))
+    if len(keyed) <= limit:
+        return [r for _, _, r in keyed], None
+    value, pos, _ = keyed[limit - 1]
+    return [r for _, _, r in keyed[:limit]], _encode_cursor(value, pos)
+
+def _iter_sorted(name, where=None, since=None, until=None, chunk=500):
+    """
+    Todos los registros que cumplen where con since <= orden < until, en el
+    orden de _page, leídos de a chunk: la memoria no depende de cuántos
+    sean. Con archivos se recorre la vista del momento en que empieza la
+    iteración; con SQLite, páginas por clave (orden, pos).
+    """
+    db = _sqlite()
+    if db is None:
+        for _, _, record in _walk_sorted(name, where, since, until, chunk=chunk):
+            yield record
+        return
+    order = SORTED[name][0]
+    before = None
+    while True:
+        rows = db.page(name, where, (order, since, until, before), chunk)
+        for _, record in rows:
+            yield record
+        if len(rows) < chunk:
+            return
+        pos, record = rows[-1]
+        before = (record.get(order) or "", pos)
+
+def _latest(name, where, limit):
+    """
+    Últimos limit registros insertados que cumplen where, del más nuevo al
+    más viejo. Con un campo indexado en where recorre solo el final de su
+    índice.
+    """
+    db = _sqlite()
+    if db is not None:
+        return db.query(name, where, desc=True, limit=limit)
+    where = dict(where or {})
+    indexed = next((f for f in where if INDEXES.get(name, {}).get(f) is False), None)
+    view = _view(name)
+    if indexed:
+        positions = _entry_index(name, view.entry, indexed).get(_index_key(indexed, where.pop(indexed))) or []
+    else:
+        positions = range(view.length)
+    found = []
+    for pos in reversed(positions):
+        if len(found) >= limit:
+            break
+        if pos >= view.length:
+            continue
+        record = view.entry.records[pos]
+        if all(record.get(f) == v for f, v in where.items()):
+            found.append(record)
+    return found
+
+class _IndexedRecords:
+    """Secuencia de solo lectura sobre las posiciones de un índice: len e [i] en O(1)."""
+    __slots__ = ("_records", "_positions", "_length")
+
+    def __init__(self, records, positions, length):
+        self._records = records
+        self._positions = positions
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return self._records[self._positions[i]]
+
+def _indexed(name, field, value):
+    """
+    Registros con record[field] == value (field en INDEXES, no único) como
+    secuencia indexable, sin copiar los registros: sirve para elegir uno al
+    azar en O(1).
+    """
+    db = _sqlite()
+    if db is not None:
+        return db.query(name, {field: value})
+    view = _view(name)
+    hit = _entry_index(name, view.entry, field).get(_index_key(field, value)) or []
+    # Las posiciones crecen: las >= length (appends posteriores) quedan al final
+    return _IndexedRecords(view.entry.records, hit, bisect.bisect_left(hit, view.length))
+
+def _view_cursor(view):
+    entry, length = view.entry, view.length
+    return (entry.epoch, length, entry.lineage, entry.records[length - 1] if length else None)
+
+def _changes(name, cursor=None, revalidate=False):
+    """
+    Registros agregados a name desde cursor (None: desde el principio),
+    para mantener estructuras derivadas fuera de storage. Devuelve
+    (registros, cursor nuevo, reset); con reset=True la colección se
+    reescribió y registros es la colección completa. Si un log solo se
+    recargó (desalojo, compactación de otro proceso, _cache_clear) se sigue
+    desde la cantidad de registros del cursor. Con revalidate se mira el
+    archivo ya, sin esperar CACHE_REVALIDATE_SECONDS.
+    """
+    db = _sqlite()
+    if db is not None:
+        db.begin_read()
+        try:
+            first, _ = db.bounds(name)
+            # Tabla vacía en el cursor (first None): todo lo que haya es nuevo
+            # (pos es AUTOINCREMENT, nunca se reusa)
+            reset = cursor is None or (cursor[0] is not None and cursor[0] != first)
+            after = 0 if reset else cursor[1]
+            rows = db.rows_after(name, after)
+        finally:
+            db.end_read()
+        return [r for _, r in rows], (first, rows[-1][0] if rows else after), reset
+    view = _current(name, revalidate)
+    entry = view.entry
+    length = view.length
+    new_cursor = _view_cursor(view)
+    if cursor is not None:
+        epoch, count, lineage, last = cursor
+        # Otra entrada del mismo log: vale si conserva el registro donde quedó el cursor
+        same = epoch == entry.epoch or (
+            lineage is not None and lineage == entry.lineage
+            and count <= length and (count == 0 or entry.records[count - 1] == last))
+        if same and count <= length:
+            return entry.records[count:length], new_cursor, False
+    return entry.records[:length], new_cursor, True
+
+def _changes_cursor(name):
+    """Cursor de _changes en el final actual de name, sin copiar registros."""
+    db = _sqlite()
+    if db is not None:
+        first, last = db.bounds(name)
+        return first, last or 0
+    return _view_cursor(_current(name))
+
+def _etag(*names):
+    """
+    ETag fuerte del estado de names: cambia con cualquier escritura. Con
+    archivos sale de inodo/mtime/tamaño, así que coincide entre workers.
+    """
+    db = _sqlite()
+    if db is not None:
+        state = [db.version(n) for n in names]
+    else:
+        state = [_view(n).signature for n in names]
+    return hashlib.sha1(repr((names, state)).encode("utf-8")).hexdigest()[:20]
+
+def _distinct(name, field):
+    """Valores distintos (no vacíos) de field, ordenados."""
+    db = _sqlite()
+    if db is not None:
+        return db.distinct(name, field)
+    if INDEXES.get(name, {}).get(field) is False:
+        # Las claves del índice ya son los valores distintos
+        view = _view(name)
+        index = _entry_index(name, view.entry, field)
+        return sorted(k for k, hit in list(index.items()) if k and hit[0] < view.length)
+    return sorted({r.get(field) for r in _read(name) if r.get(field)})
+
+# --- Escritura ---
+def _write_file(name, records):
+    """
+    Reescribe la colección completa (temporal + rename) y devuelve su vista
+    nueva, sin publicar. Quien llama tiene el lock de la colección.
+    """
+    path = _collection_path(name)
+    started = time.perf_counter()
+    snapshot = _is_log(name) and os.path.exists(_snapshot_path(name))
+    if _is_log(name):
+        data = b"".join(_dump_line(r) for r in records)
+        if snapshot:
+            # Marca nueva: el snapshot ya no corresponde al log aunque no se llegue a borrar
+            data = _marker_line(_new_gen()) + data
+    else:
+        data = serializer.dumps(records, indent=JSON_PRETTY)
+    metrics.STORAGE_SERIALIZE.observe(time.perf_counter() - started, name)
+    _replace_file(path, lambda f: f.write(data), name)
+    metrics.STORAGE_WRITTEN_BYTES.inc(len(data), name)
+    if snapshot:
+        try:
+            os.remove(_snapshot_path(name))
+        except FileNotFoundError:
+            pass
+    signature = _signature(path)
+    # Un log reescrito es otro contenido: los cursores de _changes vuelven a empezar
+    entry = _Entry(list(records), signature[0] if _is_log(name) and signature else None)
+    return _new_view(name, entry, signature)
+
+def _write_log(name, data):
+    path = _log_path(name)
+    with open(path, "ab") as f:
+        f.write(data)
+        _sync_written(f, path, name)
+    metrics.STORAGE_WRITTEN_BYTES.inc(len(data), name)
+
+def _append_file(name, records):
+    """
+    Agrega records al log (con fsync según DURABILITY). Si la colección
+    está en memoria, la pone al día y extiende su vista; si no, devuelve
+    None y se cargará al leerla. Quien llama tiene el lock de la colección.
+    """
+    _ensure_log(name)
+    path = _log_path(name)
+    started = time.perf_counter()
+    data = b"".join(_dump_line(r) for r in records)
+    metrics.STORAGE_SERIALIZE.observe(time.perf_counter() - started, name)
+    view = _current(name, revalidate=True) if name in _STATE else None
+    if view is None:
+        _write_log(name, data)
+        return None
+    # Escritura y extensión juntas bajo el lock de la entrada: un lector que
+    # se pone al día no puede leer estas líneas del disco y duplicarlas
+    with view.entry.lock:
+        before = _signature(path)
+        _write_log(name, data)
+        current = before == view.signature and view.length == len(view.entry.records)
+        if current:
+            _extend_entry(name, view.entry, records)
+    if COMPACT_TAIL_BYTES and before is not None and before[2] + len(data) >= COMPACT_TAIL_BYTES:
+        _COMPACTOR.request(name)
+    if not current:
+        # La vista quedó atrás: se pone al día leyendo solo lo nuevo del log
+        # (o se recarga si el archivo cambió de inodo), sin desalojarla
+        return _current(name, revalidate=True)
+    return _new_view(name, view.entry, (before[0], _signature(path)[1], before[2] + len(data)))
+
+def _write(name, data):
+    db = _sqlite()
+    if db is not None:
+        return db.write(name, data)
+    with _lock(name):
+        _publish({name: _write_file(name, data)})
+
+def _append(name, record):
+    """Agrega un registro al final de la colección."""
+    db = _sqlite()
+    if db is not None:
+        return db.append(name, record)
+    _transaction([], lambda tx: tx.append(name, record))
+
+class _Tx:
+    """
+    Escrituras de una transacción. Con SQLite se aplican en el acto dentro
+    de la transacción abierta; con archivos se acumulan hasta el commit.
+    """
+    def __init__(self, db=None):
+        self._db = db
+        self.replaced = {}
+        self.appended = {}
+
+    @property
+    def names(self):
+        return set(self.replaced) | set(self.appended)
+
+    def append(self, name, record):
+        if self._db is not None:
+            return self._db.append(name, record)
+        self.appended.setdefault(name, []).append(record)
+
+    def write(self, name, records):
+        if self._db is not None:
+            return self._db.write(name, records)
+        self.replaced[name] = list(records)
+        self.appended.pop(name, None)
+
+    def update_one(self, name, field, value, changes):
+        """Como _update_one, dentro de la transacción. Devuelve el registro nuevo o None."""
+        if self._db is not None:
+            return self._db.update_one(name, field, value, changes)
+        records = self.replaced.get(name)
+        pos = None
+        if records is None:
+            if field in INDEXES.get(name, {}):
+                _, positions = _positions(name, field, value)
+                pos = positions[0] if positions else None
+            records = _read(name) + self.appended.pop(name, [])
+        if pos is None:
+            key = _index_key(field, value)
+            pos = next((i for i, r in enumerate(records) if _index_key(field, r.get(field)) == key), None)
+            if pos is None:
+                return None
+        records[pos] = {**records[pos], **changes}
+        self.replaced[name] = records
+        return records[pos]
+
+def _commit(snapshot, tx):
+    """
+    Confirma las escrituras de tx si ninguna colección leída en snapshot
+    cambió desde entonces (compare-and-swap por versión); si no, Conflict.
+    Quien llama debe tener tomados los locks de todas las colecciones.
+    """
+    for name, version in snapshot.versions.items():
+        if _current(name, revalidate=True).version != version:
+            raise Conflict(name)
+    views = {}
+    for name in tx.names:
+        if name in tx.replaced:
+            views[name] = _write_file(name, tx.replaced[name] + tx.appended.get(name, []))
+        elif _is_log(name):
+            views[name] = _append_file(name, tx.appended[name])
+        else:
+            views[name] = _write_file(name, _current(name, revalidate=True).records() + tx.appended[name])
+    _publish(views)
+
+class _Locked:
+    """Toma los locks de varias colecciones en orden fijo (sin deadlocks)."""
+    def __init__(self, names):
+        self.locks = [_lock(n) for n in sorted(set(names))]
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        for lock in reversed(self.locks):
+            lock.release()
+
+class _Pending:
+    __slots__ = ("appended", "size", "done", "error")
+
+    def __init__(self, appended):
+        self.appended = appended
+        self.size = sum(len(r) for r in appended.values())
+        self.done = False
+        self.error = None
+
+class _GroupCommit:
+    """
+    Agrupa transacciones que solo agregan a logs. El primer hilo que
+    encuentra la cola libre hace de líder: espera hasta max_delay (o hasta
+    juntar max_batch registros), escribe el lote con un append + fsync por
+    colección y despierta a los demás. Nadie vuelve antes de que su
+    registro esté en disco. Sin fsync por escritura (DURABILITY "batched"
+    o "none") no hay nada que amortizar: el líder no espera.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.flushing = False
+        self.flushes = 0
+        self.records = 0
+        # registros por flush -> cantidad de flushes
+        self.batches = collections.Counter()
+
+    def submit(self, appended):
+        item = _Pending(appended)
+        with self.cond:
+            self.queue.append(item)
+            self.cond.notify_all()
+            while not item.done:
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+                self.flushing = True
+                try:
+                    batch = self._collect()
+                    self.cond.release()
+                    try:
+                        self._flush(batch)
+                    finally:
+                        self.cond.acquire()
+                finally:
+                    self.flushing = False
+                    self.cond.notify_all()
+        if item.error is not None:
+            raise item.error
+
+    def _pending_size(self):
+        return sum(p.size for p in self.queue)
+
+    def _collect(self):
+        """Espera la ventana del lote y saca de la cola lo que entra en él."""
+        delay = GROUP_COMMIT_MAX_DELAY_MS if DURABILITY == "always" else 0
+        deadline = time.monotonic() + delay / 1000
+        while self._pending_size() < GROUP_COMMIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.cond.wait(remaining)
+        batch, size = [], 0
+        while self.queue and (not batch or size + self.queue[0].size <= GROUP_COMMIT_MAX_BATCH):
+            size += self.queue[0].size
+            batch.append(self.queue.pop(0))
+        return batch
+
+    def _flush(self, batch):
+        merged = {}
+        for item in batch:
+            for name, records in item.appended.items():
+                merged.setdefault(name, []).extend(records)
+        error = None
+        try:
+            with _Locked(merged):
+                _publish({name: _append_file(name, records) for name, records in merged.items()})
+        except Exception as e:
+            error = e
+        size = sum(item.size for item in batch)
+        with self.cond:
+            self.flushes += 1
+            self.records += size
+            self.batches[size] += 1
+            for item in batch:
+                item.error = error
+                item.done = True
+
+    def stats(self):
+        with self.cond:
+            return {
+                "flushes": self.flushes,
+                "records": self.records,
+                "avg_batch": round(self.records / self.flushes, 2) if self.flushes else 0,
+                "max_batch": max(self.batches, default=0),
+                "batches": dict(sorted(self.batches.items())),
+            }
+
+_GROUP_COMMIT = _GroupCommit()
+
+def _group_commit_stats():
+    """Contadores del group commit: flushes, registros y registros por flush."""
+    return _GROUP_COMMIT.stats()
+
+def _run(names, fn):
+    tx = _Tx()
+    # Siempre sobre el estado vigente, aunque se llame dentro de otro snapshot
+    with _Snapshot(names, inherit=False) as snap:
+        result = fn(tx)
+    return tx, snap, result
+
+def _transaction(names, fn):
+    """
+    Ejecuta fn(tx) sobre un snapshot de names y confirma sus escrituras con
+    CAS sobre las versiones leídas; si otro escritor ganó, reintenta. Tras
+    TXN_MAX_RETRIES intentos toma los locks antes de leer, para asegurar
+    progreso. Devuelve lo que devuelva fn.
+    """
+    db = _sqlite()
+    if db is not None:
+        with db.transaction():
+            return fn(_Tx(db))
+    written = set()
+    for _ in range(TXN_MAX_RETRIES):
+        tx, snap, result = _run(names, fn)
+        if not tx.names:
+            return result
+        if not snap.versions and not tx.replaced and all(_is_log(n) for n in tx.appended):
+            # Nada que validar: solo appends a logs, van por el group commit
+            _GROUP_COMMIT.submit(tx.appended)
+            return result
+        try:
+            with _Locked(set(names) | tx.names):
+                _commit(snap, tx)
+            return result
+        except Conflict:
+            written = tx.names
+    # Camino pesimista: con los locks tomados de entrada nadie más confirma
+    held = set(names) | written
+    with _Locked(held):
+        tx, snap, result = _run(names, fn)
+        if tx.names <= held:
+            _commit(snap, tx)
+            return result
+    # fn escribió en colecciones no previstas: último intento optimista
+    with _Locked(set(names) | tx.names):
+        _commit(snap, tx)
+    return result
+
+def _update_one(name, field, value, changes):
+    """
+    Aplica changes al primer registro con record[field] == value y guarda.
+    Devuelve el registro actualizado (una copia nueva), o None si no existe.
+    """
+    return _transaction([name], lambda tx: tx.update_one(name, field, value, changes))
+
+# --- Snapshots y compactación ---
+# Primera línea de un log compactado: {"_snapshot": gen} del snapshot que le corresponde
+_MARKER_PREFIX = b'{"_snapshot":'
+
+def _snapshot_path(name):
+    return os.path.join(DB_DIR, f"{name}.snapshot")
+
+def _new_gen():
+    return uuid.uuid4().hex
+
+def _marker_line(gen):
+    return serializer.dumps({"_snapshot": gen}) + b"\n"
+
+def _parse_marker(line):
+    return serializer.loads(line)["_snapshot"] if line.startswith(_MARKER_PREFIX) else None
+
+def _summary_spec(name):
+    spec = SUMMARIES.get(name)
+    return [spec[0], list(spec[1]), spec[2]] if spec else None
+
+def _encode_summaries(summaries):
+    enc = lambda s: [s.count, s.sum, s.max]
+    return [[key, enc(total), [[g, enc(s)] for g, s in groups.items()]] for key, (total, groups) in summaries.items()]
+
+def _decode_summaries(name, rows):
+    fields = SUMMARIES[name][1]
+    def dec(row):
+        summary = _Summary(fields)
+        summary.count, summary.sum, summary.max = row
+        return summary
+    return {key: (dec(total), {g: dec(s) for g, s in groups}) for key, total, groups in rows}
+
+def _snapshot_header(name):
+    """Cabecera del snapshot de name (sin leer los registros), o None."""
+    try:
+        with open(_snapshot_path(name), "rb") as f:
+            return serializer.loads(f.readline())
+    except FileNotFoundError:
+        return None
+
+def _read_snapshot(name):
+    """
+    (cabecera, registros, agregados o None, bytes del JSON descomprimido)
+    del snapshot de name, o None.
+    """
+    started = time.perf_counter()
+    try:
+        with open(_snapshot_path(name), "rb") as f:
+            head = f.readline()
+            body = f.read()
+    except FileNotFoundError:
+        return None
+    header = serializer.loads(head)
+    raw = zlib.decompress(body)
+    payload = serializer.loads(raw)
+    summaries = None
+    # Agregados guardados con otra definición de SUMMARIES: se recalculan al usarlos
+    if payload.get("summaries") is not None and header.get("summary_spec") == _summary_spec(name):
+        summaries = _decode_summaries(name, payload["summaries"])
+    metrics.STORAGE_PARSE.observe(time.perf_counter() - started, name)
+    metrics.STORAGE_READ_BYTES.inc(len(head) + len(body), name)
+    return header, payload["records"], summaries, len(raw)
+
+def _tail_offset(header, marker):
+    """
+    Desde qué byte del log (cuya marca es marker) siguen los registros que
+    no están en el snapshot, o None si el snapshot no corresponde al log.
+    """
+    if marker == header["gen"]:
+        return 0
+    if marker == header.get("prev_gen"):
+        # Compactación cortada antes de reemplazar el log: lo anterior a
+        # prev_bytes ya está en el snapshot
+        return header["prev_bytes"]
+    return None
+
+def _read_history(name):
+    """
+    Registros de un log: los de su snapshot (si corresponde al log) más la
+    cola. Devuelve (registros, firma del log, bytes del snapshot
+    descomprimido, agregados o None, linaje). El linaje es el inodo del log, o el que guardó el
+    snapshot: compactar no lo cambia, reescribir el log entero sí. Si el
+    snapshot cambia mientras se lee (otro proceso compactó), vuelve a
+    empezar.
+    """
+    path = _snapshot_path(name)
+    for _ in range(10):
+        before = _signature(path)
+        snapshot = _read_snapshot(name) if before is not None else None
+        with open(_log_path(name), "rb") as f:
+            offset = 0
+            if snapshot is not None:
+                offset = _tail_offset(snapshot[0], _parse_marker(f.readline()))
+                if offset is None:
+                    # Snapshot de un log ya reescrito entero (_recover lo aparta)
+                    snapshot, offset = None, 0
+            tail, signature = _read_log_file(f, name, offset)
+        if _signature(path) == before:
+            break
+    if snapshot is None:
+        return tail, signature, 0, None, signature[0]
+    header, records, summaries, size = snapshot
+    records.extend(tail)
+    if summaries is not None:
+        for record in tail:
+            _summary_add(name, summaries, record)
+    # Snapshots sin linaje (anteriores a guardarlo): su gen, que se hereda al recompactar
+    return records, signature, size, summaries, header.get("lineage", header["gen"])
+
+def _compact(name, min_tail_bytes=0):
+    """
+    Pasa el historial de un log a <name>.snapshot y deja en el log solo la
+    marca y la cola (lo agregado mientras se compactaba). La serialización
+    va sin el lock; con el lock solo se escriben los dos archivos (primero
+    el snapshot: cortado entre ambos, el log viejo sigue siendo válido con
+    prev_bytes) y se publica la vista, con la misma entrada: los registros
+    no cambian y los cursores de _changes siguen valiendo. Devuelve
+    {"records", "before_bytes", "snapshot_bytes", "tail_bytes"}, o None si
+    no hizo nada (otro backend, cola menor a min_tail_bytes, o el log se
+    reescribió mientras tanto).
+    """
+    if not _is_log(name) or _sqlite() is not None:
+        return None
+    _ensure_log(name)
+    log_path, snapshot_path = _log_path(name), _snapshot_path(name)
+    view = _current(name, revalidate=True)
+    covered = view.signature
+    if covered is None or covered[2] < max(min_tail_bytes, 1):
+        return None
+    records = view.records()
+    with open(log_path, "rb") as f:
+        if os.fstat(f.fileno()).st_ino != covered[0]:
+            return None
+        prev_gen = _parse_marker(f.readline())
+    if prev_gen is not None and covered[2] <= len(_marker_line(prev_gen)):
+        # Solo la marca: la cola está vacía
+        return None
+    snapshot = _signature(snapshot_path) if view.entry.base_bytes else None
+    before_bytes = covered[2] + (snapshot[2] if snapshot else 0)
+
+    started = time.perf_counter()
+    gen = _new_gen()
+    summaries = _encode_summaries(_build_summaries(name, records)) if name in SUMMARIES else None
+    raw = serializer.dumps({"records": records, "summaries": summaries})
+    body = zlib.compress(raw, SNAPSHOT_COMPRESS_LEVEL)
+    head = serializer.dumps({
+        "format": SNAPSHOT_FORMAT,
+        "collection": name,
+        "gen": gen,
+        "prev_gen": prev_gen,
+        "prev_bytes": covered[2],
+        "lineage": view.entry.lineage or gen,
+        "records": len(records),
+        "summary_spec": _summary_spec(name),
+    }) + b"\n"
+    metrics.STORAGE_SERIALIZE.observe(time.perf_counter() - started, name)
+
+    with _lock(name):
+        current = _current(name, revalidate=True)
+        if current.signature is None or current.signature[0] != covered[0] or current.signature[2] < covered[2]:
+            return None
+        with open(log_path, "rb") as f:
+            f.seek(covered[2])
+            tail = f.read(current.signature[2] - covered[2])
+        marker = _marker_line(gen)
+        _replace_file(snapshot_path, lambda f: (f.write(head), f.write(body)), name)
+        _replace_file(log_path, lambda f: (f.write(marker), f.write(tail)), name)
+        metrics.STORAGE_WRITTEN_BYTES.inc(len(head) + len(body) + len(marker) + len(tail), name)
+        entry = current.entry
+        entry.base_bytes = len(raw)
+        _publish({name: _new_view(name, entry, _signature(log_path))})
+    return {
+        "records": len(records),
+        "before_bytes": before_bytes,
+        "snapshot_bytes": len(head) + len(body),
+        "tail_bytes": len(marker) + len(tail),
+    }
+
+def _recover_snapshot(name):
+    """
+    Con el lock de name: si una compactación se cortó entre los dos renames,
+    la termina ("finished"); si el snapshot no corresponde al log (una
+    reescritura completa se cortó antes de borrarlo), lo aparta como
+    <name>.snapshot.stale ("stale"). None si no había nada que hacer.
+    """
+    header = _snapshot_header(name)
+    if header is None:
+        return None
+    log_path = _log_path(name)
+    try:
+        with open(log_path, "rb") as f:
+            offset = _tail_offset(header, _parse_marker(f.readline()))
+            if offset:
+                f.seek(offset)
+                tail = f.read()
+    except FileNotFoundError:
+        # Sin log el snapshot es lo único que queda: no se toca
+        return None
+    if offset == 0:
+        return None
+    if offset is None:
+        path = _snapshot_path(name)
+        os.replace(path, path + ".stale")
+        return "stale"
+    _replace_file(log_path, lambda f: (f.write(_marker_line(header["gen"])), f.write(tail)), name)
+    return "finished"
+
+def _history_cost(name):
+    """
+    (segundos, bytes en disco) de cargar el historial de name desde cero,
+    agregados de SUMMARIES incluidos (los que el primer _stats tendría que
+    calcular si no vienen del snapshot).
+    """
+    started = time.perf_counter()
+    records, signature, base_bytes, summaries, _ = _read_history(name)
+    if summaries is None and name in SUMMARIES:
+        _build_summaries(name, records)
+    elapsed = time.perf_counter() - started
+    snapshot = _signature(_snapshot_path(name)) if base_bytes else None
+    return elapsed, signature[2] + (snapshot[2] if snapshot else 0)
+
+class _Compactor:
+    """Compacta en un hilo aparte los logs cuya cola pasó COMPACT_TAIL_BYTES (uno a la vez por log)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = set()
+        self.runs = 0
+        self.errors = 0
+        self.last = {}  # colección -> informe de _compact
+
+    def request(self, name):
+        with self.lock:
+            if name in self.running:
+                return
+            self.running.add(name)
+        threading.Thread(target=self._run, args=(name,), name=f"edusmart-compact-{name}", daemon=True).start()
+
+    def _run(self, name):
+        try:
+            report = _compact(name, COMPACT_TAIL_BYTES)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            return
+        finally:
+            with self.lock:
+                self.running.discard(name)
+        if report is not None:
+            with self.lock:
+                self.runs += 1
+                self.last[name] = report
+
+    def stats(self):
+        with self.lock:
+            return {"runs": self.runs, "errors": self.errors, "running": sorted(self.running), "last": dict(self.last)}
+
+_COMPACTOR = _Compactor()
+
+def _compaction_stats():
+    """Compactaciones en segundo plano: cuántas, errores y el último informe por log."""
+    return _COMPACTOR.stats()
+
+# --- Mantenimiento ---
+def _shared_secret(name="secret"):
+    """
+    Clave aleatoria guardada en DB_DIR/<name>.key: el primer proceso la crea
+    (con el lock de name, temporal + rename) y los demás workers leen la misma.
+    """
+    path = os.path.join(DB_DIR, f"{name}.key")
+    if not os.path.exists(path):
+        with _lock(name):
+            if not os.path.exists(path):
+                key = os.urandom(32).hex().encode("ascii")
+
+                def write(f):
+                    if hasattr(os, "fchmod"):
+                        os.fchmod(f.fileno(), 0o600)
+                    f.write(key)
+
+                _replace_file(path, write, name)
+    with open(path, "rb") as f:
+        return f.read().strip().decode("ascii")
+
+def _init_storage():
+    """Crea las colecciones que falten en el backend activo."""
+    db = _sqlite()
+    for name in COLLECTIONS:
+        if db is not None:
+            db.count(name)
+        elif not os.path.exists(_collection_path(name)):
+            _write(name, [])
+
+def _migrate_to_sqlite(force=False):
+    """
+    Copia los archivos de DB_DIR a la base SQLite. Si la base ya tiene datos
+    no hace nada, salvo con force=True. Devuelve {colección: registros} o None.
+    """
+    store = SqliteStore(_sqlite_path())
+    try:
+        if not force and any(store.count(n) for n in COLLECTIONS):
+            return None
+        return migrate_from_json(store, _load_files, COLLECTIONS)
+    finally:
+        store.close()
@@ -0,0 +1,14 @@
+"""
+Benchmarks y pruebas de carga reproducibles de EduSmart.
+
+    python -m bench generate --scale medium --db-dir /tmp/edusmart-bench
+    python -m bench run --scale medium --out bench-results.json
+    python -m bench compare antes.json despues.json
+
+Los datos son sintéticos y salen de una semilla: la misma escala y semilla
+generan exactamente los mismos archivos, así que dos versiones del código se
+miden sobre el mismo dataset. Ver bench/datagen.py y bench/runner.py.
+
+EDUSMART_DURABILITY=none mide sin fsync (el resultado registra el modo);
+para comparar con producción, usar el mismo modo que allá.
+"""
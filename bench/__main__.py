@@ -0,0 +1,97 @@
+"""CLI de benchmarks: python -m bench {generate,run,compare} --help"""
+import sys, tempfile
+
+import click
+
+from bench import datagen
+
+@click.group()
+def cli():
+    """Benchmarks y pruebas de carga de EduSmart."""
+
+@cli.command()
+@click.option("--db-dir", required=True, help="Directorio destino (se pisan los archivos).")
+@click.option("--scale", type=click.Choice(sorted(datagen.SCALES)), default="small", show_default=True)
+@click.option("--seed", type=int, default=1234, show_default=True)
+def generate(db_dir, scale, seed):
+    """Genera un dataset sintético reproducible."""
+    counts = datagen.generate(db_dir, scale, seed)
+    click.echo(", ".join(f"{n}: {c}" for n, c in counts.items()))
+
+@cli.command()
+@click.option("--db-dir", help="Datos existentes a usar tal cual (se modifican). Por defecto se genera un dataset en un directorio temporal.")
+@click.option("--scale", type=click.Choice(sorted(datagen.SCALES)), default="small", show_default=True)
+@click.option("--seed", type=int, default=1234, show_default=True)
+@click.option("--case", "cases", multiple=True, help="Solo estos casos (repetible).")
+@click.option("--iterations", type=int, default=200, show_default=True, help="Requests por caso en los microbenchmarks.")
+@click.option("--warmup", type=int, default=20, show_default=True)
+@click.option("--threads", type=int, default=8, show_default=True, help="Hilos de la carga mixta.")
+@click.option("--duration", type=float, default=10.0, show_default=True, help="Segundos de carga mixta.")
+@click.option("--skip-micro", is_flag=True)
+@click.option("--skip-mixed", is_flag=True)
+@click.option("--out", type=click.Path(dir_okay=False), help="Guardar los resultados en este JSON.")
+def run(db_dir, scale, seed, cases, iterations, warmup, threads, duration, skip_micro, skip_mixed, out):
+    """Corre microbenchmarks y carga mixta; imprime y guarda los resultados."""
+    from bench import runner
+    unknown = set(cases) - set(runner.CASES)
+    if unknown:
+        raise click.BadParameter(f"casos desconocidos: {', '.join(sorted(unknown))}", param_hint="--case")
+
+    dataset = None
+    if not db_dir:
+        db_dir = tempfile.mkdtemp(prefix="edusmart-bench-")
+        dataset = datagen.generate(db_dir, scale, seed)
+        click.echo(f"dataset {scale} en {db_dir}: " + ", ".join(f"{n}: {c}" for n, c in dataset.items()))
+
+    app, ctx = runner.load_app(db_dir)
+    results = {
+        "environment": runner.environment(),
+        "dataset": {"db_dir": db_dir, "scale": scale if dataset else None, "seed": seed if dataset else None, "counts": dataset},
+        "config": {"iterations": iterations, "warmup": warmup, "threads": threads, "duration_s": duration},
+    }
+    if not skip_micro:
+        results["micro"] = runner.run_micro(app, ctx, cases or None, iterations, warmup, seed)
+        _print_table("micro", results["micro"])
+    if not skip_mixed:
+        results["mixed"] = runner.run_mixed(app, ctx, threads, duration, cases=cases or None, seed=seed)
+        total = results["mixed"]["total"]
+        click.echo(f"\nmixed: {threads} hilos, {total['requests']} requests, {total.get('throughput_rps')} req/s, "
+                   f"p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, p99 {total['p99_ms']} ms, {total['errors']} errores")
+        _print_table("mixed", results["mixed"]["cases"])
+
+    if out:
+        from backend import serializer
+        with open(out, "wb") as f:
+            f.write(serializer.dumps(results, indent=True))
+        click.echo(f"\nresultados en {out}")
+
+def _print_table(title, cases):
+    click.echo(f"\n{title:<20} {'req':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'err':>5}")
+    for name, s in cases.items():
+        rps = s.get("throughput_rps")
+        click.echo(f"{name:<20} {s['requests']:>7} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} "
+                   f"{rps if rps is not None else '-':>9} {s['errors']:>5}")
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option("--metric", default="p95_ms", show_default=True, type=click.Choice(["p50_ms", "p95_ms", "p99_ms", "mean_ms"]))
+@click.option("--threshold", type=float, default=0.10, show_default=True, help="Empeoramiento relativo que cuenta como regresión.")
+def compare(baseline, current, metric, threshold):
+    """Compara dos resultados; sale con código 1 si hay regresiones."""
+    from backend import serializer
+    from bench import runner
+    with open(baseline, "rb") as f:
+        old = serializer.loads(f.read())
+    with open(current, "rb") as f:
+        new = serializer.loads(f.read())
+    rows = runner.compare(old, new, threshold, metric)
+    click.echo(f"{'':<6} {'caso':<20} {'antes':>9} {'después':>9} {'cambio':>8}")
+    for section, name, before, after, change, regressed in rows:
+        click.echo(f"{section:<6} {name:<20} {before:>9} {after:>9} {change:>+8.1%}" + ("  REGRESIÓN" if regressed else ""))
+    regressions = sum(r[5] for r in rows)
+    click.echo(f"\n{regressions} regresiones en {metric} (umbral {threshold:.0%})")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    cli(prog_name="python -m bench")
@@ -0,0 +1,168 @@
+"""
+Generador de datos sintéticos (students, videos, questions, results, rewards).
+
+Escribe directamente los archivos de DB_DIR (colecciones .json y logs
+.ndjson) con la misma forma que producen los endpoints, sin pasar por la
+API: una escala "large" se genera en segundos. Todo sale de random.Random
+(seed), por lo que el resultado es reproducible.
+"""
+import os, random
+from datetime import datetime, timedelta, timezone
+
+from backend import passwords, serializer
+
+# students, videos, questions, tests y videos completados por estudiante
+SCALES = {
+    "tiny":   {"students": 20,     "videos": 12,  "questions": 30,   "tests_per_student": 3,  "videos_per_student": 2},
+    "small":  {"students": 500,    "videos": 60,  "questions": 300,  "tests_per_student": 10, "videos_per_student": 5},
+    "medium": {"students": 5000,   "videos": 200, "questions": 1500, "tests_per_student": 20, "videos_per_student": 10},
+    "large":  {"students": 50000,  "videos": 500, "questions": 5000, "tests_per_student": 40, "videos_per_student": 20},
+}
+
+SUBJECTS = ["Matemáticas", "Lengua", "Ciencias", "Sociales", "Inglés", "Arte"]
+COURSES = ["1ro", "2do", "3ro", "4to", "5to", "6to"]
+FIRST_NAMES = ["Ana", "Luis", "María", "José", "Carmen", "Pedro", "Lucía", "Juan", "Sofía", "Miguel", "Valeria", "Diego"]
+LAST_NAMES = ["Pérez", "Gómez", "Rodríguez", "Martínez", "López", "Díaz", "Reyes", "Cruz", "Mejía", "Santos"]
+# Contraseña de todos los usuarios generados (para medir /api/auth/login)
+PASSWORD = "bench-password"
+LEVELS = (1, 2, 3, 4, 5)
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def _student(rng, n, created_at, password_hash):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    username = f"bench{n:06d}"
+    return {
+        "id": f"user_{username}",
+        "username": username,
+        "password_hash": password_hash,
+        "name": name,
+        "course": rng.choice(COURSES),
+        "created_at": _iso(created_at),
+        "total_points": 0,
+        "level": 2,
+        "tests_completed": 0,
+        "videos_watched": 0,
+    }
+
+def _video(rng, n):
+    subject = SUBJECTS[n % len(SUBJECTS)]
+    minutes = rng.randint(2, 25)
+    return {
+        "id": f"bench_vid_{n}",
+        "subject": subject,
+        "title": f"{subject} - clase {n}",
+        "description": f"Video sintético {n}",
+        "duration": f"{minutes:02d}:{rng.randint(0, 59):02d}",
+        "url": f"https://www.youtube.com/embed/bench{n}",
+        "_minutes": minutes,
+    }
+
+def _question(rng, n):
+    return {
+        "id": f"bench_q{n}",
+        "level": LEVELS[n % len(LEVELS)],
+        "text": f"Pregunta sintética {n}",
+        "options": ["A", "B", "C", "D"],
+        "answer_index": rng.randrange(4),
+    }
+
+def _test_points(correct, final_level, duration_seconds):
+    # Misma fórmula que _test_records en backend/app.py
+    return 10 + correct * 8 + max(0, 10 - duration_seconds // 60) + final_level * 5
+
+def _video_points(minutes):
+    # Misma regla que _video_points en backend/app.py
+    return 20 if minutes >= 10 else 10
+
+def generate(db_dir, scale="small", seed=1234, start=None):
+    """
+    Llena db_dir con un dataset de la escala dada (nombre de SCALES o un dict
+    con las mismas claves). Pisa los archivos que existan. Devuelve los
+    conteos por colección.
+    """
+    params = SCALES[scale] if isinstance(scale, str) else scale
+    rng = random.Random(seed)
+    start = start or datetime(2025, 1, 1, tzinfo=timezone.utc)
+    os.makedirs(db_dir, exist_ok=True)
+
+    # Un único hash para todos: hashear miles de contraseñas no es lo que se mide
+    password_hash = passwords._hash(PASSWORD, passwords.PASSWORD_METHOD)
+    videos = [_video(rng, n) for n in range(params["videos"])]
+    questions = [_question(rng, n) for n in range(params["questions"])]
+    students = [
+        _student(rng, n, start + timedelta(minutes=n), password_hash)
+        for n in range(params["students"])
+    ]
+
+    # Los eventos se intercalan entre estudiantes en orden cronológico, como
+    # en producción: los logs quedan ordenados por created_at
+    events = []
+    horizon = 90 * 24 * 3600
+    for student in students:
+        sid = student["id"]
+        for _ in range(params["tests_per_student"]):
+            events.append((rng.randrange(horizon), "test", sid, None))
+        for video in rng.sample(videos, min(params["videos_per_student"], len(videos))):
+            events.append((rng.randrange(horizon), "video", sid, video))
+    events.sort(key=lambda e: (e[0], e[2]))
+
+    totals = {s["id"]: s for s in students}
+    results_path = os.path.join(db_dir, "results.ndjson")
+    rewards_path = os.path.join(db_dir, "rewards.ndjson")
+    n_results = n_rewards = 0
+    with open(results_path, "wb") as results, open(rewards_path, "wb") as rewards:
+        for offset, kind, sid, video in events:
+            created_at = _iso(start + timedelta(seconds=offset, microseconds=rng.randrange(10**6)))
+            student = totals[sid]
+            if kind == "test":
+                correct = rng.randint(0, 5)
+                final_level = rng.choice(LEVELS)
+                duration = rng.randint(60, 900)
+                results.write(serializer.dumps({
+                    "student_id": sid,
+                    "correct": correct,
+                    "final_level": final_level,
+                    "duration_seconds": duration,
+                    "created_at": created_at,
+                }) + b"\n")
+                points = _test_points(correct, final_level, duration)
+                reward = {
+                    "student_id": sid,
+                    "type": "test",
+                    "points": points,
+                    "reason": f"Test completado ({correct}/5) nivel final {final_level} en {duration//60}m {duration%60}s",
+                    "created_at": created_at,
+                }
+                student["tests_completed"] += 1
+                student["level"] = final_level
+                n_results += 1
+            else:
+                points = _video_points(video["_minutes"])
+                reward = {
+                    "student_id": sid,
+                    "type": "video",
+                    "video_id": video["id"],
+                    "points": points,
+                    "reason": f"Video completado: {video['title']}",
+                    "created_at": created_at,
+                }
+                student["videos_watched"] += 1
+            student["total_points"] += points
+            rewards.write(serializer.dumps(reward) + b"\n")
+            n_rewards += 1
+
+    for video in videos:
+        del video["_minutes"]
+    for name, records in (("students", students), ("videos", videos), ("questions", questions)):
+        with open(os.path.join(db_dir, f"{name}.json"), "wb") as f:
+            f.write(serializer.dumps(records))
+
+    return {
+        "students": len(students),
+        "videos": len(videos),
+        "questions": len(questions),
+        "results": n_results,
+        "rewards": n_rewards,
+    }
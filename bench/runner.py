@@ -0,0 +1,255 @@
+"""
+Microbenchmarks por endpoint y carga mixta concurrente.
+
+Todo va por el test client de Flask (sin red ni servidor): se mide el costo
+de la app y de storage. Cada caso es una función (client, ctx, rng) que hace
+un request; las latencias se reportan en milisegundos con p50/p95/p99.
+
+backend.app se importa recién en load_app(), después de fijar
+EDUSMART_DB_DIR: storage lee la configuración al importarse.
+"""
+import math, os, platform, random, subprocess, sys, threading, time
+from datetime import datetime, timezone
+
+from bench.datagen import PASSWORD, LEVELS
+
+class Context:
+    """Ids del dataset de los que los casos eligen al azar."""
+
+    def __init__(self, students, videos):
+        self.students = [(s["id"], s.get("username"), s.get("course")) for s in students]
+        self.video_ids = [v["id"] for v in videos]
+
+def _student(ctx, rng):
+    return rng.choice(ctx.students)
+
+def _student_stats(client, ctx, rng):
+    return client.get(f"/api/student-stats/{_student(ctx, rng)[0]}")
+
+def _materias(client, ctx, rng):
+    return client.get("/api/materias")
+
+def _videos(client, ctx, rng):
+    return client.get("/api/videos")
+
+def _videos_student(client, ctx, rng):
+    return client.get("/api/videos", query_string={"student_id": _student(ctx, rng)[0]})
+
+def _videos_completados(client, ctx, rng):
+    return client.get("/api/videos-completados", query_string={"student_id": _student(ctx, rng)[0]})
+
+def _pregunta(client, ctx, rng):
+    return client.get("/api/pregunta", query_string={"nivel": rng.choice(LEVELS)})
+
+def _test_session(client, ctx, rng):
+    start = client.post("/api/test-session", json={"student_id": _student(ctx, rng)[0], "nivel": rng.choice(LEVELS)})
+    if start.status_code != 201:
+        return start
+    return client.post("/api/test-session/answer", json={"session": start.get_json()["session"], "answer": rng.randrange(4)})
+
+def _results(client, ctx, rng):
+    return client.get("/api/results", query_string={"student_id": _student(ctx, rng)[0], "limit": 20})
+
+def _rewards(client, ctx, rng):
+    return client.get("/api/rewards", query_string={"student_id": _student(ctx, rng)[0], "limit": 20})
+
+def _leaderboard(client, ctx, rng):
+    sid, _, course = _student(ctx, rng)
+    return client.get("/api/leaderboard", query_string={"course": course, "student_id": sid})
+
+def _test_result(client, ctx, rng):
+    return client.post("/api/test-result", json={
+        "student_id": _student(ctx, rng)[0],
+        "correct": rng.randint(0, 5),
+        "final_level": rng.choice(LEVELS),
+        "duration_seconds": rng.randint(60, 900),
+    })
+
+def _video_completo(client, ctx, rng):
+    return client.post("/api/video-completo", json={"student_id": _student(ctx, rng)[0], "video_id": rng.choice(ctx.video_ids)})
+
+def _login(client, ctx, rng):
+    return client.post("/api/auth/login", json={"username": _student(ctx, rng)[1], "password": PASSWORD})
+
+# nombre: (función, peso en la carga mixta). Pesos aproximados al uso real:
+# mayormente lecturas del estudiante, algunas escrituras, pocos logins.
+CASES = {
+    "student_stats":      (_student_stats, 10),
+    "materias":           (_materias, 5),
+    "videos":             (_videos, 5),
+    "videos_student":     (_videos_student, 8),
+    "videos_completados": (_videos_completados, 5),
+    "pregunta":           (_pregunta, 10),
+    "test_session":       (_test_session, 8),
+    "results":            (_results, 6),
+    "rewards":            (_rewards, 6),
+    "leaderboard":        (_leaderboard, 6),
+    "test_result":        (_test_result, 5),
+    "video_completo":     (_video_completo, 5),
+    "login":              (_login, 1),
+}
+
+def load_app(db_dir):
+    """Importa la app sobre db_dir y devuelve (app, Context)."""
+    os.environ["EDUSMART_DB_DIR"] = db_dir
+    from backend import app as app_module
+    from backend import storage
+    if os.path.abspath(storage.DB_DIR) != os.path.abspath(db_dir):
+        raise RuntimeError(f"backend.app ya estaba importado con DB_DIR={storage.DB_DIR}")
+    if storage._sqlite() is not None:
+        storage._migrate_to_sqlite(force=True)
+    app_module._init_storage()
+    app_module._leaderboard()
+    return app_module.app, Context(app_module._read("students"), app_module._read("videos"))
+
+def percentile(values, p):
+    """Percentil p (0-100) por rango más cercano; values ya ordenado."""
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[k]
+
+def summarize(latencies, errors, elapsed=None):
+    """Estadísticas de una lista de latencias en segundos (se reportan en ms)."""
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    out = {
+        "requests": len(values),
+        "errors": errors,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "min_ms": ms(values[0]) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+    if elapsed:
+        out["throughput_rps"] = round(len(values) / elapsed, 1)
+    return out
+
+def _timed(fn, client, ctx, rng):
+    t0 = time.perf_counter()
+    response = fn(client, ctx, rng)
+    elapsed = time.perf_counter() - t0
+    # 4xx esperables (p. ej. 409) no cuentan: solo fallas del servidor
+    return elapsed, response.status_code >= 500
+
+def run_micro(app, ctx, cases=None, iterations=200, warmup=20, seed=1234):
+    """Cada caso por separado, secuencial, con warmup previo."""
+    out = {}
+    for name in cases or CASES:
+        fn = CASES[name][0]
+        rng = random.Random(f"{seed}:{name}")
+        client = app.test_client()
+        for _ in range(warmup):
+            fn(client, ctx, rng)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            elapsed, failed = _timed(fn, client, ctx, rng)
+            latencies.append(elapsed)
+            errors += failed
+        out[name] = summarize(latencies, errors, time.perf_counter() - started)
+    return out
+
+def run_mixed(app, ctx, threads=8, duration=10.0, requests=None, cases=None, seed=1234):
+    """
+    threads hilos eligiendo casos según su peso durante duration segundos
+    (o hasta requests pedidos en total). Devuelve el total y el desglose.
+    """
+    names = list(cases or CASES)
+    weights = [CASES[n][1] for n in names]
+    lock = threading.Lock()
+    per_case = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    budget = [requests]
+    start_gate = threading.Barrier(threads + 1)
+
+    def take():
+        if budget[0] is None:
+            return True
+        with lock:
+            if budget[0] <= 0:
+                return False
+            budget[0] -= 1
+            return True
+
+    def worker(i):
+        rng = random.Random(f"{seed}:mixed:{i}")
+        client = app.test_client()
+        local = {n: [] for n in names}
+        local_errors = {n: 0 for n in names}
+        start_gate.wait()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline and take():
+            name = rng.choices(names, weights)[0]
+            elapsed, failed = _timed(CASES[name][0], client, ctx, rng)
+            local[name].append(elapsed)
+            local_errors[name] += failed
+        with lock:
+            for n in names:
+                per_case[n].extend(local[n])
+                errors[n] += local_errors[n]
+
+    workers = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for w in workers:
+        w.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    everything = [v for values in per_case.values() for v in values]
+    return {
+        "threads": threads,
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize(everything, sum(errors.values()), elapsed),
+        "cases": {n: summarize(per_case[n], errors[n]) for n in names if per_case[n]},
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    """Datos de la corrida que afectan los números (para comparar con criterio)."""
+    from backend import serializer, storage
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "storage_backend": "sqlite" if storage._sqlite() is not None else "json",
+        "durability": storage.DURABILITY,
+        "json_encoder": serializer.encoder_name(),
+    }
+
+def compare(baseline, current, threshold=0.10, metric="p95_ms"):
+    """
+    Compara dos resultados de run: [(sección, caso, antes, después, cambio,
+    regresión)]. cambio es relativo (0.25 = 25% más lento); hay regresión si
+    supera threshold.
+    """
+    rows = []
+    def add(section, name, old, new):
+        if not old or not new or old.get(metric) is None or new.get(metric) is None:
+            return
+        before, after = old[metric], new[metric]
+        change = (after - before) / before if before else 0.0
+        rows.append((section, name, before, after, change, change > threshold))
+
+    for name, stats in sorted(current.get("micro", {}).items()):
+        add("micro", name, baseline.get("micro", {}).get(name), stats)
+    old_mixed, new_mixed = baseline.get("mixed") or {}, current.get("mixed") or {}
+    if old_mixed and new_mixed:
+        add("mixed", "total", old_mixed.get("total"), new_mixed.get("total"))
+        for name, stats in sorted(new_mixed.get("cases", {}).items()):
+            add("mixed", name, old_mixed.get("cases", {}).get(name), stats)
+    return rows
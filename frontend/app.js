@@ -31,6 +31,18 @@ async function api(path, opts = {}) {
   throw err;
 }
 
+// Eventos en vivo del estudiante (SSE). handlers: {evento: fn(datos)}.
+// El navegador reconecta solo y al reconectar llega "totals" de nuevo.
+function liveUpdates(studentId, handlers) {
+  if (!window.EventSource) return null;
+  const source = new EventSource(`${API_BASE}/api/events/${encodeURIComponent(studentId)}`);
+  Object.entries(handlers).forEach(([event, fn]) => {
+    source.addEventListener(event, e => fn(JSON.parse(e.data)));
+  });
+  window.addEventListener("pagehide", () => source.close());
+  return source;
+}
+
 // Session helpers
 function setStudent(student) {
   localStorage.setItem("student", JSON.stringify(student));
@@ -73,3 +85,4 @@ window.hardReset = hardReset;
 window.authRegister = authRegister;
 window.authLogin = authLogin;
 window.getStudent = getStudent;
+window.liveUpdates = liveUpdates;
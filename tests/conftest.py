@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Los tests trabajan sobre un directorio de datos temporal y no tocan backend/db
+os.environ.setdefault("EDUSMART_DB_DIR", tempfile.mkdtemp(prefix="edusmart-tests-"))
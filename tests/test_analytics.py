@@ -0,0 +1,84 @@
+import pytest
+from backend import analytics
+from backend.analytics import CohortColumns
+
+STUDENTS = [
+    {"id": "a", "course": "1ro"},
+    {"id": "b", "course": "1ro"},
+    {"id": "c", "course": "2do"},
+]
+VIDEOS = [
+    {"id": "m1", "subject": "Matemáticas"},
+    {"id": "m2", "subject": "Matemáticas"},
+    {"id": "l1", "subject": "Lengua"},
+]
+RESULTS = [
+    {"student_id": "a", "correct": 5, "final_level": 3, "duration_seconds": 50},
+    {"student_id": "b", "correct": 2, "final_level": 1, "duration_seconds": 200},
+    {"student_id": "c", "correct": 4, "final_level": 2, "duration_seconds": 1000},
+    # Estudiante que ya no existe: no cuenta para ningún curso
+    {"student_id": "zz", "correct": 1, "final_level": 1, "duration_seconds": 10},
+]
+REWARDS = [
+    {"student_id": "a", "type": "video", "video_id": "m1", "points": 10},
+    {"student_id": "a", "type": "video", "video_id": "m1", "points": 10},
+    {"student_id": "b", "type": "video", "video_id": "m2", "points": 10},
+    {"student_id": "c", "type": "video", "video_id": "l1", "points": 10},
+    {"student_id": "a", "type": "test", "points": 40},
+]
+
+def feed(*batches):
+    """changes() falso: entrega cada lote una vez, el primero como reset."""
+    calls = iter(batches)
+    def changes(cursor):
+        records, reset = next(calls)
+        return records, (cursor or 0) + 1, reset
+    return changes
+
+def build(results=RESULTS, rewards=REWARDS):
+    cols = CohortColumns()
+    cols.sync(feed((results, True)), feed((rewards, True)))
+    return cols
+
+@pytest.fixture(params=["python", "numpy"])
+def engine(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(analytics, "ANALYTICS_ENGINE", request.param)
+    return request.param
+
+class TestCohortColumns:
+    def test_grouped_aggregates(self, engine):
+        assert analytics.engine() == engine
+        first, second = build().report(STUDENTS, VIDEOS)
+        
+        assert (first["course"], first["students"], first["tests"]) == ("1ro", 2, 2)
+        assert (first["avg_correct"], first["avg_final_level"], first["avg_duration_seconds"]) == (3.5, 2.0, 125.0)
+        assert first["score_histogram"] == {"0": 0, "1": 0, "2": 1, "3": 0, "4": 0, "5": 1}
+        assert first["final_level_histogram"] == {"1": 1, "2": 0, "3": 1, "4": 0, "5": 0}
+        assert [b["count"] for b in first["duration_histogram"]] == [1, 0, 0, 1, 0, 0, 0]
+        # 2 completados (el repetido cuenta una vez) de 2 estudiantes x 2 videos
+        assert first["subjects"]["Matemáticas"] == {"videos": 2, "completions": 2, "completion_rate": 0.5}
+        assert first["subjects"]["Lengua"] == {"videos": 1, "completions": 0, "completion_rate": 0.0}
+        
+        assert second["duration_histogram"][-1] == {"le": None, "count": 1}
+        assert second["subjects"]["Lengua"]["completion_rate"] == 1.0
+
+    def test_course_filter_and_empty(self, engine):
+        [only] = build().report(STUDENTS, VIDEOS, course="2do")
+        assert (only["course"], only["tests"]) == ("2do", 1)
+        assert build().report(STUDENTS, VIDEOS, course="9no") == []
+        
+        [empty, _] = build([], []).report(STUDENTS, VIDEOS)
+        assert empty["tests"] == 0 and empty["avg_correct"] is None
+
+    def test_incremental_sync(self, engine):
+        cols = CohortColumns()
+        results = feed((RESULTS[:1], True), (RESULTS[1:2], False), ([RESULTS[2]], True))
+        rewards = feed(([], True), ([], False), ([], False))
+        cols.sync(results, rewards)
+        cols.sync(results, rewards)
+        assert cols.report(STUDENTS, VIDEOS)[0]["tests"] == 2
+        # reset: la colección se reescribió y llega completa
+        cols.sync(results, rewards)
+        assert [c["tests"] for c in cols.report(STUDENTS, VIDEOS)] == [0, 1]
@@ -1,6 +1,16 @@
+import gzip
 import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import zlib
 import pytest
-from backend.app import app, _write, _read
+from backend import metrics, passwords, profiling, pubsub, storage
+import backend.app as app_module
+from backend.app import app
+from backend.storage import _write, _read
 
 @pytest.fixture
 def client():
@@ -126,6 +136,45 @@ class TestStudentManagement:
         assert "suggested_level" in stats
         assert "avg_score" in stats
 
+class TestAuth:
+    def test_register_and_login(self, client):
+        """Test registering and logging in without leaking the password hash"""
+        response = client.post("/api/auth/register", json={
+            "username": "Lucia", "password": "clave123", "name": "Lucía", "course": "4A"
+        })
+        assert response.status_code == 201
+        assert "password_hash" not in response.get_json()
+        
+        ok = client.post("/api/auth/login", json={"username": "lucia", "password": "clave123"})
+        assert ok.status_code == 200
+        assert ok.get_json()["id"] == "user_lucia"
+        bad = client.post("/api/auth/login", json={"username": "lucia", "password": "nope"})
+        assert bad.status_code == 401
+
+    def test_login_rehashes_outdated_hash(self, client, monkeypatch):
+        """Test that a hash made with old parameters is replaced on login"""
+        monkeypatch.setattr(passwords, "PASSWORD_METHOD", "pbkdf2:sha256:1000")
+        client.post("/api/auth/register", json={
+            "username": "mateo", "password": "clave123", "name": "Mateo", "course": "4A"
+        })
+        old_hash = _read("students")[0]["password_hash"]
+        
+        monkeypatch.setattr(passwords, "PASSWORD_METHOD", "pbkdf2:sha256:2000")
+        assert client.post("/api/auth/login", json={"username": "mateo", "password": "clave123"}).status_code == 200
+        new_hash = _read("students")[0]["password_hash"]
+        assert new_hash != old_hash and new_hash.startswith("pbkdf2:sha256:2000$")
+        assert client.post("/api/auth/login", json={"username": "mateo", "password": "clave123"}).status_code == 200
+
+    def test_login_returns_503_when_pool_is_saturated(self, client, monkeypatch):
+        client.post("/api/auth/register", json={
+            "username": "sofia", "password": "clave123", "name": "Sofía", "course": "4A"
+        })
+        monkeypatch.setattr(passwords, "_SLOTS", threading.BoundedSemaphore(1))
+        passwords._SLOTS.acquire()
+        response = client.post("/api/auth/login", json={"username": "sofia", "password": "clave123"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"]
+
 class TestVideoSystem:
     def test_get_materias(self, client):
         """Test getting list of available subjects"""
@@ -208,6 +257,239 @@ class TestVideoSystem:
         })
         assert response2.get_json()["awarded"] == 0
 
+    def test_concurrent_reward_appends_do_not_retry_completion(self, client, monkeypatch):
+        """Test a rewards append from another request does not fail the completion's CAS"""
+        sid = client.post("/api/students", json={"name": "Ana", "course": "1ro"}).get_json()["id"]
+        calls = []
+        real = app_module._video_reward
+
+        def reward_with_concurrent_append(*args):
+            if not calls:
+                # Como un test-result confirmado mientras corre la transacción
+                storage._append("rewards", {"student_id": "otro", "type": "test", "points": 5})
+            calls.append(args)
+            return real(*args)
+
+        monkeypatch.setattr(app_module, "_video_reward", reward_with_concurrent_append)
+        response = client.post("/api/video-completo", json={"student_id": sid, "video_id": "test_vid_1"})
+        assert response.get_json()["awarded"] > 0
+        assert len(calls) == 1
+
+    def test_same_video_completed_concurrently_awards_once(self, client, monkeypatch):
+        """Test the CAS on students still catches the same video completed in parallel"""
+        if storage._sqlite() is not None:
+            # Con SQLite la escritura anidada corre dentro de la misma transacción del hilo
+            pytest.skip("CAS del backend de archivos")
+        sid = client.post("/api/students", json={"name": "Ana", "course": "1ro"}).get_json()["id"]
+        real = app_module._video_reward
+        nested = []
+
+        def reward_with_concurrent_completion(*args):
+            if not nested:
+                # Otro worker confirma el mismo video mientras corre la transacción
+                reward = real(*args)
+                nested.append(reward)
+                storage._transaction([], lambda tx: (
+                    tx.append("rewards", reward),
+                    tx.update_one("students", "id", sid, {"videos_watched": 1, "total_points": reward["points"]}),
+                ))
+            return real(*args)
+
+        monkeypatch.setattr(app_module, "_video_reward", reward_with_concurrent_completion)
+        response = client.post("/api/video-completo", json={"student_id": sid, "video_id": "test_vid_1"})
+        assert response.get_json()["awarded"] == 0
+        assert len([r for r in _read("rewards") if r["student_id"] == sid]) == 1
+
+    def test_legacy_rewards_and_backfill(self, client):
+        """Rewards antiguos sin video_id cuentan por título hasta que se migran"""
+        sid = client.post("/api/students", json={"name": "Vieja", "course": "1ro"}).get_json()["id"]
+        _write("rewards", [
+            {"student_id": sid, "type": "video", "points": 10, "reason": "Video completado: Test Video Math",
+             "created_at": "2024-01-01T00:00:00Z"},
+            {"student_id": sid, "type": "video", "points": 10, "reason": "Video completado: Borrado",
+             "created_at": "2024-01-02T00:00:00Z"},
+        ])
+        again = client.post("/api/video-completo", json={"student_id": sid, "video_id": "test_vid_1"})
+        assert again.get_json()["awarded"] == 0
+
+        runner = app.test_cli_runner()
+        dry = runner.invoke(args=["backfill-video-ids", "--dry-run"])
+        assert "1 rewards con video_id agregado (dry run), 1 sin video" in dry.output
+        assert "video_id" not in _read("rewards")[0]
+
+        done = runner.invoke(args=["backfill-video-ids"])
+        assert done.exit_code == 0 and "Borrado" in done.output
+        assert _read("rewards")[0]["video_id"] == "test_vid_1"
+        completed = client.get(f"/api/videos-completados?student_id={sid}").get_json()
+        assert completed["video_ids"] == ["test_vid_1"]
+
+class TestHttpCaching:
+    def test_catalog_etag_and_304(self, client):
+        """Test conditional GET on the catalog: 304 until the videos change"""
+        first = client.get("/api/materias")
+        etag = first.headers["ETag"]
+        assert "public" in first.headers["Cache-Control"]
+        
+        again = client.get("/api/materias", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.data == b""
+        
+        _write("videos", _read("videos") + [{"id": "v3", "subject": "Historia", "title": "Nuevo"}])
+        changed = client.get("/api/materias", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+        assert "Historia" in changed.get_json()
+
+    def test_catalog_split_from_student_progress(self, client):
+        """Test that completion lives in its own private endpoint"""
+        student = client.post("/api/students", json={"name": "Cache", "course": "2A"}).get_json()
+        client.post("/api/video-completo", json={"student_id": student["id"], "video_id": "test_vid_1"})
+        
+        catalog = client.get("/api/videos?materia=Matemáticas")
+        assert "public" in catalog.headers["Cache-Control"]
+        assert all(not v["completed"] for v in catalog.get_json())
+        
+        done = client.get(f"/api/videos-completados?student_id={student['id']}")
+        assert done.headers["Cache-Control"] == "private, no-cache"
+        assert done.get_json()["video_ids"] == ["test_vid_1"]
+        
+        legacy = client.get(f"/api/videos?materia=Matemáticas&student_id={student['id']}")
+        assert "private" in legacy.headers["Cache-Control"]
+        assert legacy.get_json()[0]["completed"] is True
+
+    def test_static_cache_policies(self, client):
+        page = client.get("/menu.html")
+        assert page.status_code == 200
+        assert "no-cache" in page.headers["Cache-Control"]
+        # Sin fingerprint, JS/CSS también se revalidan: nunca un app.js viejo con un HTML nuevo
+        for asset in ("/style.css", "/app.js"):
+            response = client.get(asset)
+            assert "no-cache" in response.headers["Cache-Control"]
+            assert "max-age" not in response.headers["Cache-Control"]
+            assert client.get(asset, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    def test_fingerprinted_precompressed_assets(self, client, monkeypatch):
+        """Test the fingerprint mode: rewritten pages, immutable gzip assets"""
+        monkeypatch.setattr(app_module, "STATIC_FINGERPRINT", True)
+        monkeypatch.setattr(app_module, "_ASSETS", None)
+        page = client.get("/menu.html").get_data(as_text=True)
+        css_path = re.search(r'href="(style\.[0-9a-f]+\.css)"', page).group(1)
+        
+        css = client.get(f"/{css_path}", headers={"Accept-Encoding": "gzip"})
+        assert css.headers["Content-Encoding"] == "gzip"
+        assert "immutable" in css.headers["Cache-Control"]
+        assert gzip.decompress(css.data) == client.get("/style.css").data
+        assert client.get("/", headers={"If-None-Match": client.get("/").headers["ETag"]}).status_code == 304
+
+class TestCompression:
+    def test_large_json_is_compressed(self, client):
+        """Test gzip/deflate negotiation for big payloads"""
+        _write("rewards", [{"student_id": "big", "type": "test", "points": i, "created_at": f"2024-01-01T00:00:{i % 60:02d}Z"}
+                           for i in range(200)])
+        plain = client.get("/api/rewards?student_id=big&limit=200")
+        assert "Content-Encoding" not in plain.headers
+        
+        zipped = client.get("/api/rewards?student_id=big&limit=200", headers={"Accept-Encoding": "gzip, deflate"})
+        assert zipped.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in zipped.headers["Vary"]
+        assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+        assert len(zipped.data) < len(plain.data)
+        
+        deflated = client.get("/api/rewards?student_id=big&limit=200", headers={"Accept-Encoding": "deflate"})
+        assert deflated.headers["Content-Encoding"] == "deflate"
+        assert json.loads(zlib.decompress(deflated.data)) == plain.get_json()
+
+    def test_small_responses_stay_plain(self, client):
+        response = client.get("/api/materias", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+        
+        # Una respuesta comprimida conserva el ETag (débil) y sigue dando 304
+        _write("videos", [{"id": f"v{i}", "subject": f"Materia {i:03d}"} for i in range(200)])
+        big = client.get("/api/materias", headers={"Accept-Encoding": "gzip"})
+        assert big.headers["Content-Encoding"] == "gzip"
+        assert big.headers["ETag"].startswith("W/")
+        again = client.get("/api/materias", headers={"Accept-Encoding": "gzip", "If-None-Match": big.headers["ETag"]})
+        assert again.status_code == 304
+
+class TestMetrics:
+    def test_routes_and_storage_are_measured(self, client, monkeypatch):
+        """Test /metrics exposes per-route latency, status counts and storage timings"""
+        monkeypatch.setattr(storage, "DURABILITY", "always")
+        metrics.reset()
+        client.get("/api/student-stats/nobody")
+        client.get("/api/student-stats/other")
+        client.post("/api/test-result", json={"student_id": "m1", "correct": 3, "final_level": 2, "duration_seconds": 60})
+        
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain; version=0.0.4")
+        text = response.get_data(as_text=True)
+        # Una serie por regla de ruta, no por URL
+        assert 'edusmart_http_request_duration_seconds_count{route="/api/student-stats/<student_id>",method="GET"} 2' in text
+        assert 'edusmart_http_requests_total{route="/api/student-stats/<student_id>",method="GET",status="404"} 2' in text
+        assert 'edusmart_http_requests_total{route="/api/test-result",method="POST",status="200"} 1' in text
+        assert "edusmart_http_requests_in_flight 1" in text
+        assert metrics.STORAGE_WRITTEN_BYTES.value("results") > 0
+        assert metrics.STORAGE_FSYNC.count("rewards") == 1
+        assert metrics.STORAGE_LOCK_WAIT.count("results") >= 1
+
+    def test_unmatched_requests_share_one_series(self, client):
+        metrics.reset()
+        client.post("/api/materias")
+        client.delete("/api/leaderboard")
+        assert metrics.REQUESTS.value("<unmatched>", "POST", "405") == 1
+        assert metrics.REQUESTS.value("<unmatched>", "DELETE", "405") == 1
+
+class TestProfiling:
+    @pytest.fixture
+    def profiled(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secreto")
+        monkeypatch.setattr(profiling, "ENABLED", True)
+        monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+        return {"X-Admin-Token": "secreto"}
+
+    def test_profile_on_request_and_fetch(self, client, profiled):
+        """Test X-Profile stores a profile that the admin endpoints serve"""
+        plain = client.get("/api/student-stats/nobody", headers=profiled)
+        assert "X-Profile-Id" not in plain.headers
+        
+        response = client.get("/api/student-stats/nobody", headers={**profiled, "X-Profile": "1"})
+        profile_id = response.headers["X-Profile-Id"]
+        
+        listing = client.get("/api/admin/profiles", headers=profiled).get_json()
+        assert [p["id"] for p in listing["profiles"]] == [profile_id]
+        assert listing["profiles"][0]["route"] == "/api/student-stats/<student_id>"
+        assert listing["profiles"][0]["status"] == 404
+        
+        profile = client.get(f"/api/admin/profiles/{profile_id}", headers=profiled).get_json()
+        assert any(row["function"] == "get_student_stats" for row in profile["top"])
+        assert client.get(f"/api/admin/profiles/{profile_id}/pstats", headers=profiled).data
+        assert client.get("/api/admin/profiles/../../etc", headers=profiled).status_code == 404
+
+    def test_requires_admin_token(self, client, profiled):
+        response = client.get("/api/student-stats/nobody", headers={"X-Profile": "1", "X-Admin-Token": "otro"})
+        assert "X-Profile-Id" not in response.headers
+        assert client.get("/api/admin/profiles").status_code == 403
+
+    def test_sampling_and_ring_bound(self, client, profiled, monkeypatch):
+        monkeypatch.setattr(profiling, "SAMPLE_RATE", 1.0)
+        monkeypatch.setattr(profiling, "PROFILE_MAX", 3)
+        ids = [client.get("/api/materias").headers["X-Profile-Id"] for _ in range(5)]
+        
+        listing = client.get("/api/admin/profiles", headers=profiled).get_json()["profiles"]
+        # El propio listado también cae en la muestra
+        assert len(listing) == 3
+        assert ids[-1] in [p["id"] for p in listing]
+        assert ids[0] not in [p["id"] for p in listing]
+
+    def test_profiler_stops_when_view_raises(self, client, profiled, monkeypatch):
+        def boom():
+            raise RuntimeError("boom")
+        monkeypatch.setitem(app.view_functions, "get_materias", boom)
+        with pytest.raises(RuntimeError):
+            client.get("/api/materias", headers={**profiled, "X-Profile": "1"})
+        assert sys.getprofile() is None
+
 class TestAdaptiveTests:
     def test_get_question_by_level(self, client):
         """Test getting questions by difficulty level"""
@@ -227,6 +509,64 @@ class TestAdaptiveTests:
         # Should fallback to closest available level
         assert response.status_code == 200
 
+    def test_test_session_adapts_and_never_repeats(self, client):
+        """Test a server-side session: graded answers, adaptive level, no repeats"""
+        _write("questions", [
+            {"id": f"q{lvl}_{i}", "level": lvl, "text": f"L{lvl} #{i}", "options": ["A", "B"], "answer_index": 0}
+            for lvl in (1, 2, 3) for i in range(3)
+        ])
+        response = client.post("/api/test-session", json={"student_id": "s1", "nivel": 2})
+        assert response.status_code == 201
+        data = response.get_json()
+        assert data["step"] == 1 and data["total"] == 5
+        assert "answer_index" not in data["question"]
+        
+        asked = [data["question"]["id"]]
+        answers = [0, 0, 1, 0, 0]  # acierta, acierta, falla, acierta, acierta
+        for answer in answers:
+            level = data["level"]
+            data = client.post("/api/test-session/answer", json={"session": data["session"], "answer": answer}).get_json()
+            assert data["correct"] == (answer == 0)
+            if data["done"]:
+                break
+            assert data["level"] == (min(level + 1, 3) if answer == 0 else max(level - 1, 1))
+            asked.append(data["question"]["id"])
+        
+        assert len(asked) == len(set(asked)) == 5
+        assert data["result"]["correct"] == 4
+        assert data["result"]["final_level"] == 3
+
+    def test_test_session_runs_out_of_questions(self, client):
+        """Test that a session ends early when every pool is exhausted"""
+        data = client.post("/api/test-session", json={"student_id": "s1", "preguntas": 10}).get_json()
+        steps = 1
+        while not data.get("done"):
+            data = client.post("/api/test-session/answer", json={"session": data["session"], "answer": 1}).get_json()
+            steps += 1
+        # Tres preguntas en el banco de prueba: ninguna se repite
+        assert steps == 4
+        assert data["result"]["correct"] <= 3
+
+    def test_test_session_rejects_tampered_token(self, client):
+        data = client.post("/api/test-session", json={"student_id": "s1"}).get_json()
+        response = client.post("/api/test-session/answer", json={"session": data["session"] + "x", "answer": 0})
+        assert response.status_code == 400
+
+    def test_test_session_rejects_invalid_level(self, client):
+        for body in ({"student_id": "s1", "nivel": "x"}, {"student_id": "s1", "nivel": None}, {"student_id": "s1", "preguntas": []}):
+            assert client.post("/api/test-session", json=body).status_code == 400
+        assert client.post("/api/test-session", json=[]).status_code == 400
+        assert client.post("/api/test-session/answer", json=["x"]).status_code == 400
+
+    def test_test_session_token_works_on_another_worker(self, client, monkeypatch):
+        """Test a session token signed here is accepted by a second app instance"""
+        monkeypatch.delenv("EDUSMART_SECRET_KEY", raising=False)
+        session = client.post("/api/test-session", json={"student_id": "s1"}).get_json()["session"]
+        env = {**os.environ, "EDUSMART_DB_DIR": storage.DB_DIR}
+        script = "import sys; from backend.app import _session_serializer; print(_session_serializer().loads(sys.argv[1])['sid'])"
+        out = subprocess.run([sys.executable, "-c", script, session], env=env, capture_output=True, text=True, check=True)
+        assert out.stdout.strip() == "s1"
+
     def test_submit_test_result(self, client):
         """Test submitting test results with comprehensive data"""
         # Create student
@@ -256,6 +596,17 @@ class TestAdaptiveTests:
         assert "speed" in breakdown
         assert "level" in breakdown
 
+    def test_suggested_level_follows_recent_window(self, client):
+        sid = client.post("/api/students", json={"name": "Leo", "course": "1ro"}).get_json()["id"]
+        levels = []
+        for correct in (5, 5, 5, 0, 0, 0):
+            data = client.post("/api/test-result", json={"student_id": sid, "correct": correct}).get_json()
+            levels.append(data["suggested_level"])
+        # Ventana de 3: los aciertos altos salen de ella tras tres tests malos
+        assert levels == [3, 3, 3, 2, 1, 1]
+        stats = client.get(f"/api/student-stats/{sid}").get_json()
+        assert stats["stats"]["suggested_level"] == 1
+
 class TestRewardsAndResults:
     def test_get_rewards_with_summary(self, client):
         """Test getting rewards with summary statistics"""
@@ -329,6 +680,260 @@ class TestRewardsAndResults:
         assert analytics["total_tests"] == 3
         assert analytics["best_score"] == 4
 
+    def test_rewards_pagination(self, client):
+        """Test paging through rewards with limit and cursor"""
+        for i in range(5):
+            client.post("/api/test-result", json={"student_id": "pager", "correct": i})
+        
+        first = client.get("/api/rewards?student_id=pager&limit=2").get_json()
+        assert len(first["items"]) == 2
+        assert first["next_cursor"]
+        # El resumen cubre todo el historial, no solo la página
+        assert first["summary"]["test"]["count"] == 5
+        
+        items = first["items"]
+        cursor = first["next_cursor"]
+        while cursor:
+            page = client.get(f"/api/rewards?student_id=pager&limit=2&cursor={cursor}").get_json()
+            items += page["items"]
+            cursor = page["next_cursor"]
+        assert len(items) == 5
+        assert [r["created_at"] for r in items] == sorted((r["created_at"] for r in items), reverse=True)
+
+    def test_results_time_range(self, client):
+        """Test since/until filters on results and their analytics"""
+        _write("results", [
+            {"student_id": "ranged", "correct": c, "final_level": 2, "created_at": f"2024-03-0{d}T00:00:00Z"}
+            for d, c in ((1, 1), (2, 3), (3, 5))
+        ])
+        
+        data = client.get("/api/results?student_id=ranged&since=2024-03-02&until=2024-03-03").get_json()
+        assert [r["correct"] for r in data["results"]] == [3]
+        assert data["analytics"]["total_tests"] == 1
+        assert data["analytics"]["best_score"] == 3
+        
+        assert client.get("/api/results?cursor=%%%").status_code == 400
+
+class TestExport:
+    def _seed(self):
+        _write("students", [
+            {"id": "a", "name": "A", "course": "1ro"},
+            {"id": "b", "name": "B", "course": "2do"},
+        ])
+        _write("results", [
+            {"student_id": "ab"[i % 2], "correct": i % 6, "final_level": 2, "created_at": f"2024-01-{1 + i // 100:02d}T00:{i % 100 // 60:02d}:{i % 60:02d}Z"}
+            for i in range(300)
+        ])
+
+    def test_streams_ndjson_with_filters(self, client, monkeypatch):
+        """Test NDJSON export streams every record and honors course/student/date filters"""
+        self._seed()
+        # Tramos chicos para que el stream tenga varias partes
+        monkeypatch.setattr(app_module, "EXPORT_CHUNK_BYTES", 512)
+        response = client.get("/api/export/results")
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(rows) == 300
+        assert [r["created_at"] for r in rows] == sorted((r["created_at"] for r in rows), reverse=True)
+        
+        by_course = [json.loads(l) for l in client.get("/api/export/results?course=2do").get_data(as_text=True).splitlines()]
+        assert len(by_course) == 150 and {r["student_id"] for r in by_course} == {"b"}
+        ranged = client.get("/api/export/results?student_id=a&since=2024-01-02&until=2024-01-03").get_data(as_text=True)
+        assert len(ranged.splitlines()) == 50
+        assert client.get("/api/export/results?course=9no").get_data() == b""
+        assert client.get("/api/export/students").status_code == 404
+
+    def test_gzip_stream(self, client):
+        self._seed()
+        plain = client.get("/api/export/results").get_data()
+        zipped = client.get("/api/export/results", headers={"Accept-Encoding": "gzip"})
+        assert zipped.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(zipped.get_data()) == plain
+        assert len(zipped.get_data()) < len(plain)
+
+class TestCohortAnalytics:
+    def test_cohort_report_and_cache(self, client):
+        """Test class-wide analytics join results/rewards to course and subject"""
+        for name, course in [("Ana", "1ro"), ("Beto", "1ro"), ("Caro", "2do")]:
+            client.post("/api/students", json={"name": name, "course": course})
+        client.post("/api/test-result", json={"student_id": "ana__1ro", "correct": 4, "final_level": 3, "duration_seconds": 90})
+        client.post("/api/test-result", json={"student_id": "caro__2do", "correct": 1, "final_level": 1, "duration_seconds": 400})
+        client.post("/api/video-completo", json={"student_id": "beto__1ro", "video_id": "test_vid_2"})
+        
+        response = client.get("/api/analytics/cohorts")
+        assert response.status_code == 200
+        courses = {c["course"]: c for c in response.get_json()["courses"]}
+        assert courses["1ro"]["tests"] == 1 and courses["1ro"]["avg_correct"] == 4.0
+        assert courses["1ro"]["subjects"]["Lengua"]["completion_rate"] == 0.5
+        assert courses["2do"]["avg_duration_seconds"] == 400.0
+        
+        # Sin escrituras nuevas, 304; un test nuevo cambia el ETag y el reporte
+        etag = response.headers["ETag"]
+        assert client.get("/api/analytics/cohorts", headers={"If-None-Match": etag}).status_code == 304
+        client.post("/api/test-result", json={"student_id": "beto__1ro", "correct": 2, "final_level": 2, "duration_seconds": 90})
+        again = client.get("/api/analytics/cohorts?course=1ro", headers={"If-None-Match": etag})
+        assert again.status_code == 200
+        assert [c["tests"] for c in again.get_json()["courses"]] == [2]
+
+class TestLiveEvents:
+    def _next_event(self, chunks):
+        for chunk in chunks:
+            if chunk.startswith(b"event:"):
+                head, data = chunk.decode().strip().split("\n")
+                return head[len("event: "):], json.loads(data[len("data: "):])
+
+    def test_stream_pushes_commits_and_totals(self, client, monkeypatch):
+        """Test SSE sends totals on connect and each committed result/reward after"""
+        monkeypatch.setattr(pubsub, "SSE_HEARTBEAT_SECONDS", 0.05)
+        student = client.post("/api/students", json={"name": "Ana", "course": "1ro"}).get_json()
+        client.post("/api/video-completo", json={"student_id": student["id"], "video_id": "test_vid_1"})
+        
+        response = client.get(f"/api/events/{student['id']}", buffered=False)
+        assert response.mimetype == "text/event-stream"
+        chunks = iter(response.response)
+        assert self._next_event(chunks) == ("totals", {
+            "total_points": 10, "tests_completed": 0, "videos_watched": 1, "avg_score": 0,
+            "by_type": {"video": {"count": 1, "points": 10}},
+        })
+        
+        client.post("/api/test-result", json={"student_id": student["id"], "correct": 4, "final_level": 2, "duration_seconds": 60})
+        # Otro estudiante no aparece en este stream
+        client.post("/api/test-result", json={"student_id": "otro", "correct": 1, "final_level": 1, "duration_seconds": 60})
+        event, result = self._next_event(chunks)
+        assert (event, result["correct"]) == ("result", 4)
+        event, reward = self._next_event(chunks)
+        assert (event, reward["type"]) == ("reward", "test")
+        event, totals = self._next_event(chunks)
+        assert event == "totals"
+        assert (totals["tests_completed"], totals["total_points"]) == (1, 10 + reward["points"])
+        
+        response.close()
+        assert app_module._BROKER.subscribers() == 0
+
+    def test_poller_publishes_writes_from_other_workers(self, client, monkeypatch):
+        """Test writes that skip this worker's endpoints still reach subscribers"""
+        monkeypatch.setattr(pubsub, "SSE_POLL_SECONDS", 0.02)
+        response = client.get("/api/events/ana", buffered=False)
+        chunks = iter(response.response)
+        assert self._next_event(chunks)[0] == "totals"
+        
+        # Como otro worker: directo al storage, sin pasar por _publish_live
+        storage._append("rewards", {"student_id": "ana", "type": "video", "points": 10, "reason": "x"})
+        event, reward = self._next_event(chunks)
+        assert (event, reward["points"]) == ("reward", 10)
+        assert self._next_event(chunks)[1]["total_points"] == 10
+        response.close()
+
+    def test_rejects_when_full(self, client, monkeypatch):
+        monkeypatch.setattr(pubsub, "SSE_MAX_SUBSCRIBERS", 0)
+        assert client.get("/api/events/ana").status_code == 503
+
+class TestBatchSync:
+    def test_batch_test_results(self, client):
+        """Test syncing several test results at once, with replays and bad events"""
+        events = [
+            {"student_id": "tab", "correct": 4, "final_level": 3, "duration_seconds": 90, "created_at": "2024-05-01T10:00:00Z"},
+            {"student_id": "tab", "correct": 2, "created_at": "2024-05-01T11:00:00Z"},
+            {"correct": 5},
+            {"student_id": "tab", "correct": "x"},
+            {"student_id": "tab", "correct": 2, "created_at": "2024-05-01T11:00:00Z"},
+        ]
+        data = client.post("/api/test-result/batch", json={"events": events}).get_json()
+        
+        assert [o["status"] for o in data["items"]] == ["ok", "ok", "invalid", "invalid", "duplicate"]
+        assert data["awarded"] == data["items"][0]["awarded"] + data["items"][1]["awarded"]
+        assert len(_read("results")) == 2
+        assert len(_read("rewards")) == 2
+        
+        # Reenviar el lote completo no duplica nada
+        again = client.post("/api/test-result/batch", json=events).get_json()
+        assert [o["status"] for o in again["items"]] == ["duplicate", "duplicate", "invalid", "invalid", "duplicate"]
+        assert again["awarded"] == 0
+        assert len(_read("results")) == 2
+
+    def test_batch_rejects_bad_and_future_timestamps(self, client):
+        """Test created_at must be ISO-8601, not in the future, and is stored in UTC"""
+        events = [
+            {"student_id": "tab", "correct": 3, "created_at": "zzzz"},
+            {"student_id": "tab", "correct": 3, "created_at": "2999-01-01T00:00:00Z"},
+            {"student_id": "tab", "correct": 3, "created_at": 5},
+            {"student_id": "tab", "correct": 3, "created_at": "2024-05-01T12:00:00+02:00"},
+        ]
+        data = client.post("/api/test-result/batch", json={"events": events}).get_json()
+        assert [o["status"] for o in data["items"]] == ["invalid", "invalid", "invalid", "ok"]
+        assert [r["created_at"] for r in _read("results")] == ["2024-05-01T10:00:00Z"]
+        # La misma hora escrita en UTC es un reenvío
+        again = client.post("/api/test-result/batch", json=[{"student_id": "tab", "created_at": "2024-05-01T10:00:00Z"}])
+        assert again.get_json()["items"][0]["status"] == "duplicate"
+        
+        videos = client.post("/api/video-completo/batch", json={"events": [
+            {"student_id": "tab", "video_id": "test_vid_1", "created_at": "2999-01-01T00:00:00Z"},
+        ]}).get_json()
+        assert videos["items"][0]["status"] == "invalid"
+
+    def test_batch_video_completions(self, client):
+        """Test that batched completions follow the video_completo duplicate rules"""
+        student = client.post("/api/students", json={"name": "Tablet", "course": "3B"}).get_json()
+        sid = student["id"]
+        client.post("/api/video-completo", json={"student_id": sid, "video_id": "test_vid_1"})
+        
+        data = client.post("/api/video-completo/batch", json={"events": [
+            {"student_id": sid, "video_id": "test_vid_1"},
+            {"student_id": sid, "video_id": "test_vid_2"},
+            {"student_id": sid, "video_id": "test_vid_2"},
+            {"student_id": sid, "video_id": "missing"},
+            {"student_id": sid},
+        ]}).get_json()
+        
+        assert [o["status"] for o in data["items"]] == ["duplicate", "ok", "duplicate", "not_found", "invalid"]
+        assert data["awarded"] == 20  # test_vid_2 dura más de 10:00
+        stored = next(s for s in _read("students") if s["id"] == sid)
+        assert stored["videos_watched"] == 2
+        assert stored["total_points"] == 30
+
+    def test_batch_rejects_non_list_and_oversized(self, client):
+        assert client.post("/api/test-result/batch", json={"events": "nope"}).status_code == 400
+        too_many = [{"student_id": "x"}] * 501
+        assert client.post("/api/video-completo/batch", json=too_many).status_code == 413
+
+class TestLeaderboard:
+    def test_leaderboard_by_course(self, client):
+        """Test top students per course and the caller's own rank"""
+        ids = {}
+        for name, course in [("Ana", "5A"), ("Beto", "5A"), ("Caro", "5A"), ("Dani", "6B")]:
+            ids[name] = client.post("/api/students", json={"name": name, "course": course}).get_json()["id"]
+        client.post("/api/test-result", json={"student_id": ids["Ana"], "correct": 1})
+        client.post("/api/test-result", json={"student_id": ids["Beto"], "correct": 5})
+        client.post("/api/video-completo", json={"student_id": ids["Ana"], "video_id": "test_vid_2"})
+        client.post("/api/test-result", json={"student_id": ids["Dani"], "correct": 5, "final_level": 3})
+        
+        data = client.get(f"/api/leaderboard?course=5A&limit=1&student_id={ids['Ana']}").get_json()
+        points = {}
+        for r in _read("rewards"):
+            points[r["student_id"]] = points.get(r["student_id"], 0) + r["points"]
+        assert points[ids["Beto"]] > points[ids["Ana"]]
+        assert data["students"] == 2
+        assert data["top"] == [{"rank": 1, "student_id": ids["Beto"], "name": "Beto", "points": points[ids["Beto"]]}]
+        assert data["me"] == {"rank": 2, "student_id": ids["Ana"], "points": points[ids["Ana"]]}
+        
+        # Sin puntos todavía: detrás de todos
+        data = client.get(f"/api/leaderboard?course=5A&student_id={ids['Caro']}").get_json()
+        assert data["me"]["rank"] == 3
+        assert [r["name"] for r in data["top"]] == ["Beto", "Ana"]
+
+    def test_leaderboard_follows_batches(self, client):
+        """Test that batch-synced rewards reach the ranking too"""
+        sid = client.post("/api/students", json={"name": "Offline", "course": "7C"}).get_json()["id"]
+        client.post("/api/video-completo/batch", json=[
+            {"student_id": sid, "video_id": "test_vid_1"},
+            {"student_id": sid, "video_id": "test_vid_2"},
+        ])
+        data = client.get("/api/leaderboard?course=7C").get_json()
+        assert data["top"][0]["points"] == 30
+        assert client.get("/api/leaderboard").status_code == 400
+
 class TestIntegrationWorkflows:
     def test_complete_student_journey(self, client):
         """Test a complete student learning journey"""
@@ -368,6 +973,75 @@ class TestIntegrationWorkflows:
         assert stats_data["stats"]["total_points"] > 0
         assert len(stats_data["recent_activity"]) > 0
 
+    def test_stats_counters_follow_logs(self, client):
+        """Test that test results count in the student stats even if the record is stale"""
+        student = client.post("/api/students", json={"name": "Counter", "course": "5A"}).get_json()
+        for correct in (1, 4):
+            client.post("/api/test-result", json={
+                "student_id": student["id"],
+                "correct": correct,
+                "final_level": 2,
+                "duration_seconds": 60
+            })
+        data = client.get(f"/api/student-stats/{student['id']}").get_json()
+        
+        assert data["stats"]["tests_completed"] == 2
+        assert data["stats"]["avg_score"] == 2.5
+        assert data["student"]["tests_completed"] == 2
+        assert data["student"]["total_points"] == data["stats"]["total_points"]
+        assert [a["description"] for a in data["recent_activity"]][:2] == [
+            "Test completado: 4/5 correctas", "Test completado: 1/5 correctas"
+        ]
+
+    def test_reconcile_summaries_command(self, client):
+        """Test that the reconcile command reports and fixes stale student counters"""
+        student = client.post("/api/students", json={"name": "Stale", "course": "5A"}).get_json()
+        client.post("/api/test-result", json={"student_id": student["id"], "correct": 3})
+        runner = app.test_cli_runner()
+        
+        report = runner.invoke(args=["reconcile-summaries"])
+        assert report.exit_code == 0
+        assert f"students[{student['id']}]" in report.output
+        assert _read("students")[0]["tests_completed"] == 0
+        
+        fixed = runner.invoke(args=["reconcile-summaries", "--fix"])
+        assert "corregidos" in fixed.output
+        stored = _read("students")[0]
+        assert stored["tests_completed"] == 1
+        assert stored["total_points"] > 0
+        assert "0 resúmenes y 0 students" in runner.invoke(args=["reconcile-summaries"]).output
+
+    def test_compact_command_reports_savings(self, client):
+        """Test compaction keeps the history readable and reports size and load time"""
+        student = client.post("/api/students", json={"name": "Compacta", "course": "5A"}).get_json()
+        for correct in range(5):
+            client.post("/api/test-result", json={"student_id": student["id"], "correct": correct})
+        before = client.get(f"/api/results?student_id={student['id']}").get_json()
+
+        output = app.test_cli_runner().invoke(args=["compact"]).output
+        assert re.search(r"results: 5 registros; disco .+ -> .+; carga [\d.]+ ms -> [\d.]+ ms", output)
+        assert client.get(f"/api/results?student_id={student['id']}").get_json() == before
+        client.post("/api/test-result", json={"student_id": student["id"], "correct": 5})
+        assert client.get(f"/api/student-stats/{student['id']}").get_json()["stats"]["tests_completed"] == 6
+        stats = client.get("/api/storage/stats").get_json()
+        assert "compaction" in stats
+        assert stats["cache"]["log_bytes"] >= stats["cache"]["collections"]["results"] > 0
+
+    def test_storage_stats_count_grouped_writes(self, client):
+        """Test that test results show up in the group commit counters"""
+        before = client.get("/api/storage/stats").get_json()["group_commit"]
+        client.post("/api/test-result", json={
+            "student_id": "stats_student",
+            "correct": 3,
+            "final_level": 2,
+            "duration_seconds": 100
+        })
+        after = client.get("/api/storage/stats").get_json()["group_commit"]
+        
+        # El resultado y su recompensa viajan en la misma escritura
+        assert after["flushes"] == before["flushes"] + 1
+        assert after["records"] == before["records"] + 2
+
 if __name__ == "__main__":
     # Run tests with pytest
     pytest.main([__file__, "-v", "--tb=short"])
\ No newline at end of file
@@ -0,0 +1,58 @@
+import os
+
+from backend import serializer
+from bench import datagen, runner
+
+def read_dir(db_dir):
+    out = {}
+    for name in sorted(os.listdir(db_dir)):
+        with open(os.path.join(db_dir, name), "rb") as f:
+            out[name] = f.read()
+    # El hash de la contraseña lleva sal aleatoria: es lo único que varía
+    students = serializer.loads(out["students.json"])
+    out["students.json"] = [{k: v for k, v in s.items() if k != "password_hash"} for s in students]
+    return out
+
+def read_log(path):
+    with open(path, "rb") as f:
+        return [serializer.loads(line) for line in f if line.strip()]
+
+class TestDatagen:
+    def test_same_seed_same_files(self, tmp_path):
+        a, b, c = tmp_path / "a", tmp_path / "b", tmp_path / "c"
+        datagen.generate(str(a), "tiny", seed=7)
+        datagen.generate(str(b), "tiny", seed=7)
+        datagen.generate(str(c), "tiny", seed=8)
+        assert read_dir(a) == read_dir(b)
+        assert read_dir(a)["results.ndjson"] != read_dir(c)["results.ndjson"]
+
+    def test_counters_match_logs(self, tmp_path):
+        counts = datagen.generate(str(tmp_path), "tiny", seed=1)
+        params = datagen.SCALES["tiny"]
+        assert counts["results"] == params["students"] * params["tests_per_student"]
+        assert counts["rewards"] == counts["results"] + params["students"] * params["videos_per_student"]
+
+        with open(tmp_path / "students.json", "rb") as f:
+            students = serializer.loads(f.read())
+        rewards = read_log(tmp_path / "rewards.ndjson")
+        points = {}
+        for r in rewards:
+            points[r["student_id"]] = points.get(r["student_id"], 0) + r["points"]
+        assert all(s["total_points"] == points[s["id"]] for s in students)
+        # Logs en orden cronológico, como los escribe la API
+        created = [r["created_at"] for r in rewards]
+        assert created == sorted(created)
+
+class TestReport:
+    def test_percentiles(self):
+        values = [i / 1000 for i in range(1, 101)]
+        stats = runner.summarize(values, errors=0, elapsed=2.0)
+        assert (stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]) == (50.0, 95.0, 99.0)
+        assert stats["throughput_rps"] == 50.0
+        assert runner.summarize([], errors=0)["p99_ms"] is None
+
+    def test_compare_flags_regressions(self):
+        before = {"micro": {"pregunta": {"p95_ms": 1.0}, "login": {"p95_ms": 100.0}}}
+        after = {"micro": {"pregunta": {"p95_ms": 1.5}, "login": {"p95_ms": 105.0}, "nuevo": {"p95_ms": 3.0}}}
+        rows = {name: (change, regressed) for _, name, _, _, change, regressed in runner.compare(before, after, 0.10)}
+        assert rows == {"login": (0.05, False), "pregunta": (0.5, True)}
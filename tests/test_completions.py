@@ -0,0 +1,54 @@
+from backend.completions import CompletedVideos, match_legacy
+
+VIDEOS = [
+    {"id": "v1", "title": "Suma"},
+    {"id": "v2", "title": "Suma y resta"},
+    {"id": "v3", "title": "Fracciones"},
+]
+BY_TITLE = {"Suma": ["v1"], "Suma y resta": ["v2"], "Fracciones": ["v3"]}
+
+def video_reward(sid, video_id=None, reason=""):
+    r = {"student_id": sid, "type": "video", "reason": reason}
+    if video_id:
+        r["video_id"] = video_id
+    return r
+
+class TestCompletedVideos:
+    def test_ids_and_legacy_titles(self):
+        done = CompletedVideos()
+        done.add(video_reward("ana", "v1"))
+        done.add(video_reward("beto", reason="Video completado: Fracciones"))
+        done.add({"student_id": "ana", "type": "test", "reason": "Test completado (5/5)"})
+
+        assert done.ids("ana") == {"v1"}
+        assert done.has("ana", VIDEOS[0]) and not done.has("ana", VIDEOS[2])
+        assert done.has("beto", VIDEOS[2]) and not done.has("beto", VIDEOS[0])
+        assert done.legacy_count() == 1
+
+    def test_sync_applies_new_rewards_and_resets(self):
+        batches = iter([
+            ([video_reward("ana", "v1")], True),
+            ([video_reward("ana", "v2")], False),
+            ([video_reward("ana", "v3")], True),
+        ])
+        def changes(cursor):
+            records, reset = next(batches)
+            return records, (cursor or 0) + 1, reset
+
+        done = CompletedVideos()
+        done.sync(changes)
+        done.sync(changes)
+        assert done.ids("ana") == {"v1", "v2"}
+        done.sync(changes)
+        assert done.ids("ana") == {"v3"}
+
+class TestMatchLegacy:
+    def test_exact_title_wins_over_substring(self):
+        assert match_legacy(video_reward("a", reason="Video completado: Suma y resta"), BY_TITLE, VIDEOS) == "v2"
+        assert match_legacy(video_reward("a", reason="Video completado: Suma"), BY_TITLE, VIDEOS) == "v1"
+
+    def test_substring_fallback_needs_a_single_match(self):
+        assert match_legacy(video_reward("a", reason="Visto: Fracciones (repaso)"), BY_TITLE, VIDEOS) == "v3"
+        # "Suma" y "Suma y resta" aparecen los dos: ambiguo
+        assert match_legacy(video_reward("a", reason="Visto: Suma y resta"), BY_TITLE, VIDEOS) is None
+        assert match_legacy(video_reward("a", reason="Video completado: Geometría"), BY_TITLE, VIDEOS) is None
@@ -0,0 +1,44 @@
+from backend.leaderboard import Leaderboard
+
+def feed(batches):
+    """changes() falso: entrega cada lote una vez, el primero como reset."""
+    calls = iter(batches)
+    def changes(cursor):
+        rewards, reset = next(calls)
+        return rewards, (cursor or 0) + 1, reset
+    return changes
+
+class TestLeaderboard:
+    def test_ranks_by_points_with_ties(self):
+        board = Leaderboard()
+        for sid, points in [("ana", 30), ("beto", 50), ("caro", 30), ("dani", 10)]:
+            board.add(sid, "5A", points)
+        board.add("eva", "5B", 100)
+
+        assert board.top("5A", 3) == [(1, "beto", 50), (2, "ana", 30), (2, "caro", 30)]
+        assert board.rank("5A", "dani") == (4, 10)
+        assert board.rank("5A", "eva") == (5, 0)
+        assert board.rank("5B", "eva") == (1, 100)
+
+    def test_add_moves_student_up(self):
+        board = Leaderboard()
+        board.add("ana", "5A", 10)
+        board.add("beto", "5A", 20)
+        board.add("ana", "5A", 15)
+        assert board.top("5A", 2) == [(1, "ana", 25), (2, "beto", 20)]
+        assert board.size("5A") == 2
+
+    def test_sync_applies_new_rewards_and_resets(self):
+        board = Leaderboard()
+        courses = {"ana": "5A", "beto": "5A"}
+        changes = feed([
+            ([{"student_id": "ana", "points": 10}, {"student_id": "ghost", "points": 99}], True),
+            ([{"student_id": "beto", "points": 20}, {"student_id": "ana", "points": 5}], False),
+            ([{"student_id": "beto", "points": 1}], True),
+        ])
+        board.sync(changes, courses.get)
+        assert board.top("5A", 5) == [(1, "ana", 10)]
+        board.sync(changes, courses.get)
+        assert board.top("5A", 5) == [(1, "beto", 20), (2, "ana", 15)]
+        board.sync(changes, courses.get)
+        assert board.top("5A", 5) == [(1, "beto", 1)]
@@ -0,0 +1,26 @@
+from backend import metrics
+
+class TestMetrics:
+    def test_histogram_buckets_are_cumulative(self):
+        h = metrics.Histogram("lat_seconds", "Latencia.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            h.observe(value, "/a")
+        lines = h.render()
+        assert lines[:2] == ["# HELP lat_seconds Latencia.", "# TYPE lat_seconds histogram"]
+        assert lines[2:] == [
+            'lat_seconds_bucket{route="/a",le="0.1"} 2',
+            'lat_seconds_bucket{route="/a",le="1.0"} 3',
+            'lat_seconds_bucket{route="/a",le="+Inf"} 4',
+            'lat_seconds_sum{route="/a"} 3.65',
+            'lat_seconds_count{route="/a"} 4',
+        ]
+        assert h.count("/a") == 4
+
+    def test_counter_gauge_and_label_escaping(self):
+        c = metrics.Counter("hits_total", "Hits.", ("path",))
+        c.inc(1, 'a"b\\c')
+        c.inc(2, 'a"b\\c')
+        assert c.render()[2] == 'hits_total{path="a\\"b\\\\c"} 3'
+
+        g = metrics.Gauge("pending", "Pendientes.", fn=lambda: {(): 7})
+        assert g.render()[2] == "pending 7"
@@ -0,0 +1,50 @@
+import threading
+import time
+import pytest
+from backend import passwords
+
+class TestPasswordPool:
+    def test_hash_and_verify_in_pool(self):
+        pwhash = passwords.hash_password("secreto")
+        assert passwords.verify_password(pwhash, "secreto")
+        assert not passwords.verify_password(pwhash, "otro")
+        assert not passwords.verify_password("", "secreto")
+
+    def test_needs_rehash_follows_configured_method(self, monkeypatch):
+        monkeypatch.setattr(passwords, "PASSWORD_METHOD", "pbkdf2:sha256:1000")
+        cheap = passwords.hash_password("secreto")
+        assert cheap.startswith("pbkdf2:sha256:1000$")
+        assert not passwords.needs_rehash(cheap)
+        monkeypatch.setattr(passwords, "PASSWORD_METHOD", "pbkdf2:sha256:2000")
+        assert passwords.needs_rehash(cheap)
+
+    def test_saturated_when_queue_is_full(self, monkeypatch):
+        monkeypatch.setattr(passwords, "_SLOTS", threading.BoundedSemaphore(1))
+        passwords._SLOTS.acquire()
+        with pytest.raises(passwords.Saturated):
+            passwords.hash_password("secreto")
+        passwords._SLOTS.release()
+        assert passwords.hash_password("secreto")
+
+    def test_timed_out_job_holds_its_slot_until_done(self, monkeypatch):
+        monkeypatch.setattr(passwords, "PASSWORD_WORKERS", 1)
+        monkeypatch.setattr(passwords, "PASSWORD_TIMEOUT", 0.2)
+        monkeypatch.setattr(passwords, "_SLOTS", threading.BoundedSemaphore(1))
+        monkeypatch.setattr(passwords, "_POOL", None)
+        passwords._pool().submit(abs, 1).result()
+        try:
+            with pytest.raises(passwords.Saturated):
+                passwords._submit(time.sleep, 1)
+            # Sigue corriendo en el pool: su lugar no se libera hasta que termine
+            assert not passwords._SLOTS.acquire(blocking=False)
+            assert passwords._SLOTS.acquire(timeout=5)
+        finally:
+            passwords._POOL.shutdown()
+
+    def test_pool_does_not_fork(self, monkeypatch):
+        monkeypatch.setattr(passwords, "_POOL", None)
+        try:
+            assert passwords._pool()._mp_context.get_start_method() in ("forkserver", "spawn")
+            assert passwords._pool().submit(abs, -1).result() == 1
+        finally:
+            passwords._POOL.shutdown()
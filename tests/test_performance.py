@@ -0,0 +1,48 @@
+from backend import performance
+from backend.performance import RecentPerformance
+
+def result(sid, created_at, correct):
+    return {"student_id": sid, "created_at": created_at, "correct": correct}
+
+class TestRecentPerformance:
+    def test_window_keeps_latest_by_created_at(self):
+        perf = RecentPerformance(size=3)
+        for i, correct in enumerate([0, 5, 5, 5]):
+            perf.add("ana", f"2024-01-0{i + 1}", correct)
+        assert [c for _, c in perf.recent("ana")] == [5, 5, 5]
+        assert perf.suggested_level("ana") == 3
+
+        # Un result atrasado (lote offline) solo entra si es más nuevo que el más viejo
+        perf.add("ana", "2024-01-01", 0)
+        assert [c for _, c in perf.recent("ana")] == [5, 5, 5]
+        perf.add("ana", "2024-01-03T12", 0)
+        assert perf.recent("ana") == [("2024-01-03", 5), ("2024-01-03T12", 0), ("2024-01-04", 5)]
+        assert perf.suggested_level("ana") == 2
+
+    def test_default_and_thresholds(self, monkeypatch):
+        perf = RecentPerformance(size=2)
+        assert perf.suggested_level("nadie") == performance.DEFAULT_LEVEL
+        perf.add("beto", "2024-01-01", 1)
+        perf.add("beto", "2024-01-02", 2)
+        assert perf.suggested_level("beto") == 1
+        monkeypatch.setattr(performance, "LEVEL_KEEP_AVG", 1.5)
+        assert perf.suggested_level("beto") == 2
+
+    def test_sync_applies_new_results_and_resets(self):
+        batches = iter([
+            ([result("ana", "2024-01-01", 5)], True),
+            ([result("ana", "2024-01-02", 1), result("", "2024-01-02", 5)], False),
+            ([result("ana", "2024-01-03", 0)], True),
+        ])
+        def changes(cursor):
+            records, reset = next(batches)
+            return records, (cursor or 0) + 1, reset
+
+        perf = RecentPerformance(size=3)
+        perf.sync(changes)
+        assert perf.suggested_level("ana") == 3
+        perf.sync(changes)
+        assert perf.recent("ana") == [("2024-01-01", 5), ("2024-01-02", 1)]
+        perf.sync(changes)
+        assert perf.recent("ana") == [("2024-01-03", 0)]
+        assert perf.cursor == 3
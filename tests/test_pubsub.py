@@ -0,0 +1,49 @@
+import pytest
+from backend import pubsub
+
+class TestBroker:
+    def test_publish_reaches_topic_subscribers_only(self):
+        broker = pubsub.Broker()
+        a, b = broker.subscribe("ana"), broker.subscribe("beto")
+        assert broker.publish("ana", "reward", {"points": 10}) == 1
+        assert a.queue.get_nowait() == ("reward", {"points": 10})
+        assert b.queue.empty()
+        broker.unsubscribe(a)
+        broker.unsubscribe(a)
+        assert (broker.subscribers(), broker.subscribers("ana")) == (1, 0)
+
+    def test_slow_subscriber_is_dropped(self, monkeypatch):
+        monkeypatch.setattr(pubsub, "SSE_QUEUE_SIZE", 2)
+        broker = pubsub.Broker()
+        sub = broker.subscribe("ana")
+        for i in range(3):
+            broker.publish("ana", "reward", i)
+        assert sub.overflowed and broker.dropped == 1
+        assert broker.subscribers("ana") == 0
+
+    def test_subscriber_limit(self, monkeypatch):
+        monkeypatch.setattr(pubsub, "SSE_MAX_SUBSCRIBERS", 1)
+        broker = pubsub.Broker()
+        broker.subscribe("ana")
+        assert broker.full()
+        with pytest.raises(pubsub.TooManySubscribers):
+            broker.subscribe("beto")
+
+class TestStream:
+    def test_heartbeat_then_idle_close(self, monkeypatch):
+        monkeypatch.setattr(pubsub, "SSE_HEARTBEAT_SECONDS", 0.01)
+        monkeypatch.setattr(pubsub, "SSE_IDLE_TIMEOUT", 0.05)
+        broker = pubsub.Broker()
+        chunks = list(pubsub.stream(broker, "ana", lambda: [("totals", {"total_points": 0})]))
+        assert chunks[0] == b"retry: 3000\n\n"
+        assert chunks[1] == b'event: totals\ndata: {"total_points":0}\n\n'
+        assert b": ping\n\n" in chunks[2:]
+        assert broker.subscribers() == 0
+
+    def test_close_releases_subscription(self):
+        broker = pubsub.Broker()
+        stream = pubsub.stream(broker, "ana", lambda: [])
+        next(stream)
+        assert broker.subscribers("ana") == 1
+        stream.close()
+        assert broker.subscribers("ana") == 0
@@ -0,0 +1,27 @@
+import json
+import pytest
+from backend import serializer
+
+@pytest.fixture(params=["json", "orjson"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson" and serializer.orjson is None:
+        pytest.skip("orjson no instalado")
+    monkeypatch.setattr(serializer, "JSON_ENCODER", request.param)
+    return request.param
+
+class TestSerializer:
+    def test_compact_utf8_roundtrip(self, encoder):
+        data = {"name": "Lucía", "points": [1, 2.5, None, True], "nested": {"a": "ñ"}}
+        raw = serializer.dumps(data)
+        assert isinstance(raw, bytes)
+        assert b" " not in raw.replace("Lucía".encode("utf-8"), b"")
+        assert "Lucía".encode("utf-8") in raw
+        assert serializer.loads(raw) == serializer.loads(raw.decode("utf-8")) == data
+        assert serializer.encoder_name() == encoder
+
+    def test_options(self, encoder):
+        assert serializer.dumps({"b": 1, "a": 2}, sort_keys=True) == b'{"a":2,"b":1}'
+        assert json.loads(serializer.dumps([1], indent=True)) == [1]
+        assert b"\n" in serializer.dumps({"a": 1}, indent=True)
+        assert serializer.loads(serializer.dumps({1: "x"})) == {"1": "x"}
+        assert serializer.dumps({"s": {1}}, default=sorted) == b'{"s":[1]}'
@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import pytest
+from backend import storage
+from backend.app import app
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """Activa el backend SQLite sobre una base temporal"""
+    monkeypatch.setattr(storage, "DB_DIR", str(tmp_path))
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(storage, "SQLITE_PATH", str(tmp_path / "test.sqlite3"))
+    storage._write("videos", [
+        {"id": "v1", "subject": "Matemáticas", "title": "Sumas", "duration": "05:00"},
+        {"id": "v2", "subject": "Lengua", "title": "Verbos", "duration": "12:00"},
+    ])
+    storage._write("questions", [
+        {"id": "q1", "level": 1, "text": "?", "options": ["A", "B", "C", "D"], "answer_index": 0},
+        {"id": "q3", "level": 3, "text": "?", "options": ["A", "B", "C", "D"], "answer_index": 0},
+    ])
+    for name in ["students", "results", "rewards"]:
+        storage._write(name, [])
+    yield tmp_path
+    storage._SQLITE.pop(str(tmp_path / "test.sqlite3")).close()
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+class TestSqliteBackend:
+    def test_uses_wal_mode(self, sqlite_backend):
+        """The database is opened in WAL journal mode"""
+        conn = sqlite3.connect(str(sqlite_backend / "test.sqlite3"))
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conn.close()
+
+    def test_student_journey(self, sqlite_backend, client):
+        """Registration, videos, tests and stats work on top of SQLite"""
+        student = client.post("/api/auth/register", json={
+            "username": "Ana", "password": "1234", "name": "Ana", "course": "1ro"
+        }).get_json()
+        assert client.post("/api/auth/login", json={"username": "ANA", "password": "1234"}).status_code == 200
+
+        assert client.post("/api/video-completo", json={"student_id": student["id"], "video_id": "v2"}).get_json()["awarded"] == 20
+        assert client.post("/api/video-completo", json={"student_id": student["id"], "video_id": "v2"}).get_json()["awarded"] == 0
+        for correct in [2, 5]:
+            client.post("/api/test-result", json={
+                "student_id": student["id"], "correct": correct, "final_level": 2, "duration_seconds": 60
+            })
+
+        stats = client.get(f"/api/student-stats/{student['id']}").get_json()["stats"]
+        assert stats["videos_watched"] == 1
+        assert stats["tests_completed"] == 2
+        assert stats["avg_score"] == 3.5
+
+        results = client.get(f"/api/results?student_id={student['id']}").get_json()
+        assert results["analytics"]["best_score"] == 5
+        rewards = client.get(f"/api/rewards?student_id={student['id']}").get_json()
+        assert rewards["summary"]["video"] == {"count": 1, "points": 20}
+        assert rewards["total"] == sum(r["points"] for r in rewards["items"])
+
+        assert client.get("/api/materias").get_json() == ["Lengua", "Matemáticas"]
+        videos = client.get(f"/api/videos?materia=Lengua&student_id={student['id']}").get_json()
+        assert [(v["id"], v["completed"]) for v in videos] == [("v2", True)]
+        assert client.get("/api/pregunta?nivel=2").get_json()["level"] in (1, 3)
+
+    def test_iter_sorted_walks_in_chunks(self, sqlite_backend):
+        """_iter_sorted pages through SQLite by key, newest first"""
+        storage._write("results", [
+            {"student_id": f"s{i % 2}", "correct": i, "created_at": f"2024-01-01T00:00:{i:02d}Z"} for i in range(7)
+        ])
+        assert [r["correct"] for r in storage._iter_sorted("results", chunk=2)] == [6, 5, 4, 3, 2, 1, 0]
+        assert [r["correct"] for r in storage._iter_sorted("results", {"student_id": "s1"}, chunk=2)] == [5, 3, 1]
+        assert [r["correct"] for r in storage._iter_sorted(
+            "results", since="2024-01-01T00:00:02Z", until="2024-01-01T00:00:05Z", chunk=2)] == [4, 3, 2]
+
+    def test_changes_from_empty_table_are_not_a_reset(self, sqlite_backend):
+        """Rows appended after reading an empty table arrive as changes"""
+        records, cursor, reset = storage._changes("rewards")
+        assert (records, reset) == ([], True)
+        storage._append("rewards", {"n": 1})
+        records, cursor, reset = storage._changes("rewards", cursor)
+        assert (records, reset) == ([{"n": 1}], False)
+        storage._write("rewards", [{"n": 9}])
+        assert storage._changes("rewards", cursor)[::2] == ([{"n": 9}], True)
+
+class TestSqliteMigration:
+    def test_migrate_copies_json_files(self, tmp_path, monkeypatch):
+        """The migrate-sqlite command carries the JSON data over once"""
+        monkeypatch.setattr(storage, "DB_DIR", str(tmp_path))
+        monkeypatch.setattr(storage, "SQLITE_PATH", str(tmp_path / "migrated.sqlite3"))
+        (tmp_path / "students.json").write_text(json.dumps([{"id": "s1", "name": "Ana"}]), encoding="utf-8")
+        (tmp_path / "rewards.ndjson").write_text(json.dumps({"student_id": "s1", "points": 10}) + "\n", encoding="utf-8")
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["migrate-sqlite"])
+        assert "students: 1 registros" in result.output
+        assert "rewards: 1 registros" in result.output
+
+        again = runner.invoke(args=["migrate-sqlite"])
+        assert "ya tiene datos" in again.output
+
+        conn = sqlite3.connect(str(tmp_path / "migrated.sqlite3"))
+        assert conn.execute("SELECT student_id, points FROM rewards").fetchall() == [("s1", 10)]
+        conn.close()
@@ -0,0 +1,567 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from backend import storage
+
+@pytest.fixture
+def db_dir(tmp_path, monkeypatch):
+    """Apunta el almacenamiento a un directorio vacío"""
+    monkeypatch.setattr(storage, "DB_DIR", str(tmp_path))
+    storage._cache_clear()
+    yield tmp_path
+    storage._cache_clear()
+
+class TestAppendLog:
+    def test_append_adds_one_line_per_record(self, db_dir):
+        """Each insert appends a single NDJSON line instead of rewriting the file"""
+        storage._write("rewards", [])
+        storage._append("rewards", {"student_id": "s1", "points": 10})
+        storage._append("rewards", {"student_id": "s2", "points": 20})
+
+        lines = (db_dir / "rewards.ndjson").read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[1]) == {"student_id": "s2", "points": 20}
+
+    def test_read_keeps_list_semantics(self, db_dir):
+        """Readers see the same ordered list as with plain JSON files"""
+        records = [{"student_id": "s1", "correct": i} for i in range(3)]
+        storage._write("results", records)
+        storage._append("results", {"student_id": "s1", "correct": 5})
+
+        assert storage._read("results") == records + [{"student_id": "s1", "correct": 5}]
+
+    def test_legacy_json_is_migrated(self, db_dir):
+        """An existing <name>.json list is converted to the log on first access"""
+        legacy = [{"student_id": "s1", "type": "video", "points": 10}]
+        (db_dir / "rewards.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+        assert storage._read("rewards") == legacy
+        assert (db_dir / "rewards.ndjson").exists()
+        assert not (db_dir / "rewards.json").exists()
+
+    def test_catalog_collections_stay_json(self, db_dir):
+        """Non-log collections still use a JSON list file"""
+        storage._append("students", {"id": "s1"})
+        assert json.loads((db_dir / "students.json").read_text(encoding="utf-8")) == [{"id": "s1"}]
+
+class TestCollectionCache:
+    def test_read_is_served_from_cache(self, db_dir, monkeypatch):
+        """Repeated reads do not open the file again"""
+        storage._write("videos", [{"id": "v1"}])
+        opened = []
+        real_open = open
+        monkeypatch.setattr("builtins.open", lambda *a, **kw: opened.append(a[0]) or real_open(*a, **kw))
+
+        assert storage._read("videos") == [{"id": "v1"}]
+        assert storage._read("videos") == [{"id": "v1"}]
+        assert opened == []
+
+    def test_external_write_invalidates_cache(self, db_dir, monkeypatch):
+        """A change made by another process is picked up through mtime/size"""
+        monkeypatch.setattr(storage, "CACHE_REVALIDATE_SECONDS", 0)
+        storage._write("videos", [{"id": "v1"}])
+        assert storage._read("videos") == [{"id": "v1"}]
+
+        (db_dir / "videos.json").write_text(json.dumps([{"id": "v1"}, {"id": "v2"}]), encoding="utf-8")
+        assert [v["id"] for v in storage._read("videos")] == ["v1", "v2"]
+
+    def test_append_extends_cached_log(self, db_dir):
+        """Appends from this process keep the cached log current"""
+        storage._write("rewards", [{"points": 1}])
+        storage._read("rewards")
+        storage._append("rewards", {"points": 2})
+        assert storage._read("rewards") == [{"points": 1}, {"points": 2}]
+
+    def test_cache_respects_memory_cap(self, db_dir, monkeypatch):
+        """Least recently used collections are evicted above the cap"""
+        storage._cache_clear()
+        storage._write("videos", [{"id": "v" * 50}])
+        monkeypatch.setattr(storage, "CATALOG_CACHE_MAX_BYTES", 100 * storage.PARSED_BYTES_PER_BYTE)
+        storage._write("questions", [{"id": "q" * 50}])
+
+        assert "videos" not in storage._STATE
+        assert "questions" in storage._STATE
+        assert storage._cache_stats()["catalog_bytes"] <= storage.CATALOG_CACHE_MAX_BYTES
+
+    def test_oversized_log_stays_resident(self, db_dir, monkeypatch):
+        """A log above the cap is extended in place, not re-parsed on every write"""
+        monkeypatch.setattr(storage, "CATALOG_CACHE_MAX_BYTES", 1)
+        storage._write("rewards", [{"student_id": "s1", "points": 1}])
+        entry = storage._current("rewards").entry
+        loads = []
+        real = storage._read_history
+        monkeypatch.setattr(storage, "_read_history", lambda name: loads.append(name) or real(name))
+
+        for i in range(5):
+            storage._append("rewards", {"student_id": "s1", "points": i})
+            storage._read("rewards")
+
+        assert loads == []
+        assert storage._STATE["rewards"].entry is entry
+        assert len(storage._read("rewards")) == 6
+
+class TestSecondaryIndexes:
+    def test_find_uses_student_index(self, db_dir):
+        """Lookups by student_id return that student's records in insertion order"""
+        storage._write("results", [{"student_id": "a", "n": 1}, {"student_id": "b", "n": 2}])
+        storage._append("results", {"student_id": "a", "n": 3})
+
+        assert [r["n"] for r in storage._find("results", "student_id", "a")] == [1, 3]
+        assert "student_id" in storage._STATE["results"].entry.indexes
+        assert storage._find("results", "student_id", "missing") == []
+
+    def test_index_is_maintained_on_append(self, db_dir):
+        """Records appended after the index was built are found without a rebuild"""
+        storage._write("rewards", [])
+        assert storage._find("rewards", "student_id", "a") == []
+        index = storage._STATE["rewards"].entry.indexes["student_id"]
+
+        storage._append("rewards", {"student_id": "a", "points": 5})
+        assert storage._STATE["rewards"].entry.indexes["student_id"] is index
+        assert storage._find("rewards", "student_id", "a") == [{"student_id": "a", "points": 5}]
+
+    def test_username_lookup_is_case_insensitive(self, db_dir):
+        """The username index matches regardless of case"""
+        storage._write("students", [{"id": "user_ana", "username": "ana"}])
+        assert storage._find_one("students", "username", "ANA")["id"] == "user_ana"
+
+    def test_update_one_replaces_record(self, db_dir):
+        """_update_one writes a new copy of the record and keeps the index valid"""
+        storage._write("students", [{"id": "s1", "total_points": 0}, {"id": "s2", "total_points": 0}])
+        updated = storage._update_one("students", "id", "s2", {"total_points": 10})
+
+        assert updated == {"id": "s2", "total_points": 10}
+        assert storage._find_one("students", "id", "s2")["total_points"] == 10
+        assert storage._update_one("students", "id", "nope", {"total_points": 1}) is None
+
+    def test_indexed_buckets_respect_snapshot(self, db_dir):
+        storage._write("questions", [{"id": f"q{i}", "level": i % 3} for i in range(9)])
+        with storage._snapshot("questions"):
+            bucket = storage._indexed("questions", "level", 1)
+            storage._transaction([], lambda tx: tx.append("questions", {"id": "q9", "level": 1}))
+            assert [bucket[i]["id"] for i in range(len(bucket))] == ["q1", "q4", "q7"]
+            assert bucket[-1]["id"] == "q7"
+        assert len(storage._indexed("questions", "level", 1)) == 4
+        assert storage._distinct("questions", "level") == [1, 2]
+
+    def test_changes_feed(self, db_dir):
+        storage._write("rewards", [{"n": 0}])
+        records, cursor, reset = storage._changes("rewards")
+        assert (records, reset) == ([{"n": 0}], True)
+        storage._append("rewards", {"n": 1})
+        storage._append("rewards", {"n": 2})
+        records, cursor, reset = storage._changes("rewards", cursor)
+        assert ([r["n"] for r in records], reset) == ([1, 2], False)
+        assert storage._changes("rewards", cursor)[0] == []
+        tail = storage._changes_cursor("rewards")
+        storage._append("rewards", {"n": 3})
+        records, _, reset = storage._changes("rewards", tail)
+        assert (records, reset) == ([{"n": 3}], False)
+
+    def test_changes_survive_reloads(self, db_dir):
+        """Reloading or compacting a log resumes the feed; only a rewrite resets it"""
+        storage._write("rewards", [{"n": 0}, {"n": 1}])
+        _, cursor, _ = storage._changes("rewards")
+        storage._cache_clear()
+        storage._append("rewards", {"n": 2})
+        records, cursor, reset = storage._changes("rewards", cursor)
+        assert ([r["n"] for r in records], reset) == ([2], False)
+
+        storage._compact("rewards")
+        storage._cache_clear()
+        storage._append("rewards", {"n": 3})
+        records, cursor, reset = storage._changes("rewards", cursor)
+        assert ([r["n"] for r in records], reset) == ([3], False)
+
+        storage._write("rewards", [{"n": 9}])
+        records, cursor, reset = storage._changes("rewards", cursor)
+        assert (records, reset) == ([{"n": 9}], True)
+        # Una reescritura completa obliga a empezar de nuevo
+        storage._write("rewards", [{"n": 9}])
+        assert storage._changes("rewards", cursor)[::2] == ([{"n": 9}], True)
+
+class TestSnapshotsAndTransactions:
+    def test_snapshot_is_stable_across_collections(self, db_dir):
+        """A pinned snapshot does not see writes committed after it was taken"""
+        storage._write("results", [{"student_id": "a", "correct": 1}])
+        storage._write("rewards", [{"student_id": "a", "points": 10}])
+
+        with storage._snapshot("results", "rewards"):
+            storage._transaction([], lambda tx: (
+                tx.append("results", {"student_id": "a", "correct": 2}),
+                tx.append("rewards", {"student_id": "a", "points": 20}),
+            ))
+            assert len(storage._find("results", "student_id", "a")) == 1
+            assert len(storage._read("rewards")) == 1
+
+        assert len(storage._find("results", "student_id", "a")) == 2
+        assert len(storage._read("rewards")) == 2
+
+    def test_conflicting_commit_is_retried(self, db_dir):
+        """A write that lands between read and commit forces a retry on fresh data"""
+        storage._write("students", [{"id": "s1", "total_points": 0}])
+        attempts = []
+
+        def add_points(tx):
+            student = storage._find_one("students", "id", "s1")
+            if not attempts:
+                # Otro escritor confirma mientras esta transacción calcula
+                storage._update_one("students", "id", "s1", {"total_points": 100})
+            attempts.append(student["total_points"])
+            tx.update_one("students", "id", "s1", {"total_points": student["total_points"] + 5})
+
+        storage._transaction(["students"], add_points)
+        assert attempts == [0, 100]
+        assert storage._find_one("students", "id", "s1")["total_points"] == 105
+
+    def test_concurrent_increments_are_not_lost(self, db_dir):
+        """Read-modify-write from many threads keeps every increment"""
+        storage._write("students", [{"id": "s1", "total_points": 0}])
+
+        def add_point(tx):
+            student = storage._find_one("students", "id", "s1")
+            tx.update_one("students", "id", "s1", {"total_points": student["total_points"] + 1})
+
+        threads = [
+            threading.Thread(target=lambda: [storage._transaction(["students"], add_point) for _ in range(10)])
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert storage._find_one("students", "id", "s1")["total_points"] == 80
+
+WORKER_SCRIPT = """
+from backend import storage
+
+def add_point(tx):
+    student = storage._find_one("students", "id", "s1")
+    tx.update_one("students", "id", "s1", {"total_points": student["total_points"] + 1})
+
+for i in range(25):
+    storage._transaction(["students"], add_point)
+    storage._append("rewards", {"student_id": "s1", "points": 1})
+"""
+
+class TestMultiProcess:
+    def test_workers_do_not_lose_or_tear_writes(self, db_dir):
+        """Several processes sharing DB_DIR keep every update and every log line"""
+        storage._write("students", [{"id": "s1", "total_points": 0}])
+        storage._write("rewards", [])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = {**os.environ, "EDUSMART_DB_DIR": str(db_dir)}
+        workers = [
+            subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT], cwd=root, env=env)
+            for _ in range(4)
+        ]
+        assert all(w.wait(timeout=60) == 0 for w in workers)
+
+        storage._cache_clear()
+        assert storage._find_one("students", "id", "s1")["total_points"] == 100
+        assert len(storage._read("rewards")) == 100
+        assert not [f for f in os.listdir(db_dir) if f.endswith(".tmp")]
+
+    def test_foreign_appends_are_read_incrementally(self, db_dir):
+        """Lines appended by another process are parsed without reloading the whole log"""
+        storage._write("results", [{"student_id": "a", "correct": 1}])
+        entry = storage._current("results").entry
+        with open(db_dir / "results.ndjson", "a", encoding="utf-8") as f:
+            f.write(json.dumps({"student_id": "a", "correct": 2}) + "\n")
+            f.write('{"student_id": "a", "corr')  # append de otro proceso a medio escribir
+
+        view = storage._current("results", revalidate=True)
+        assert view.entry is entry
+        assert [r["correct"] for r in storage._find("results", "student_id", "a")] == [1, 2]
+
+    def test_json_files_are_compact(self, db_dir):
+        storage._write("students", [{"id": "s1", "name": "Lucía"}])
+        assert (db_dir / "students.json").read_bytes() == '[{"id":"s1","name":"Lucía"}]'.encode("utf-8")
+
+    def test_rewrites_are_atomic(self, db_dir):
+        """Full rewrites replace the file through a rename, never in place"""
+        storage._write("students", [{"id": "s1"}])
+        inode = os.stat(db_dir / "students.json").st_ino
+        storage._write("students", [{"id": "s1"}, {"id": "s2"}])
+        assert os.stat(db_dir / "students.json").st_ino != inode
+
+class TestDurability:
+    @pytest.fixture
+    def fsyncs(self, monkeypatch):
+        """Cuenta los fsync (sin hacerlos)"""
+        calls = []
+        monkeypatch.setattr(storage.os, "fsync", calls.append)
+        return calls
+
+    def test_always_syncs_appends_and_renames(self, db_dir, fsyncs, monkeypatch):
+        monkeypatch.setattr(storage, "DURABILITY", "always")
+        storage._write("students", [{"id": "s1"}])
+        # temporal + directorio
+        assert len(fsyncs) == 2
+        storage._read("rewards")
+        fsyncs.clear()
+        storage._transaction(["rewards"], lambda tx: tx.append("rewards", {"n": 1}))
+        assert len(fsyncs) == 1
+
+    def test_batched_defers_to_flusher(self, db_dir, fsyncs, monkeypatch):
+        monkeypatch.setattr(storage, "DURABILITY", "batched")
+        monkeypatch.setattr(storage, "FSYNC_INTERVAL_MS", 60_000)
+        monkeypatch.setattr(storage, "_FLUSHER", storage._Flusher())
+        storage._read("rewards")
+        # Crear el log marcó el directorio
+        storage._FLUSHER.flush()
+        fsyncs.clear()
+        storage._append("rewards", {"n": 1})
+        storage._append("rewards", {"n": 2})
+        assert fsyncs == []
+        assert str(db_dir / "rewards.ndjson") in storage._FLUSHER.dirty
+        storage._FLUSHER.flush()
+        assert len(fsyncs) == 1 and storage._FLUSHER.dirty == {}
+
+    def test_none_never_syncs(self, db_dir, fsyncs, monkeypatch):
+        monkeypatch.setattr(storage, "DURABILITY", "none")
+        storage._write("students", [{"id": "s1"}])
+        storage._append("rewards", {"n": 1})
+        assert fsyncs == []
+
+    def test_recover_removes_temporaries_and_torn_lines(self, db_dir):
+        storage._write("rewards", [{"n": 0}])
+        with open(db_dir / "rewards.ndjson", "ab") as f:
+            f.write(b'{"n": 1}\n{"n": 2, "poi')
+        (db_dir / "students.json.123.456.tmp").write_bytes(b'[{"id": "s')
+        storage._cache_clear()
+
+        assert storage._recover() == {
+            "students": {"tmp_removed": 1},
+            "rewards": {"truncated_bytes": len(b'{"n": 2, "poi')},
+        }
+        assert not (db_dir / "students.json.123.456.tmp").exists()
+        # El próximo append no queda pegado a la línea cortada
+        storage._append("rewards", {"n": 3})
+        storage._cache_clear()
+        assert [r["n"] for r in storage._read("rewards")] == [0, 1, 3]
+        assert storage._recover() == {}
+
+class TestCompaction:
+    def history(self, n):
+        return [{"student_id": f"s{i % 3}", "type": "test", "points": i, "created_at": f"2024-01-01T00:00:{i:02d}Z"}
+                for i in range(n)]
+
+    def test_snapshot_plus_tail_reads_the_same(self, db_dir):
+        records = self.history(20)
+        storage._write("rewards", records)
+        _, cursor, _ = storage._changes("rewards")
+        size = storage._current("rewards").size
+
+        report = storage._compact("rewards")
+        assert report["records"] == 20 and report["snapshot_bytes"] < report["before_bytes"]
+        # La caché cuenta el snapshot descomprimido, no lo que ocupa en disco
+        assert storage._current("rewards").size >= size
+        assert (db_dir / "rewards.ndjson").read_bytes().startswith(b'{"_snapshot":')
+        # Misma entrada en memoria: los cursores siguen valiendo
+        storage._append("rewards", {"student_id": "s1", "type": "video", "points": 5, "created_at": "2024-01-02T00:00:00Z"})
+        new, cursor, reset = storage._changes("rewards", cursor)
+        assert (len(new), reset) == (1, False)
+
+        expected = storage._read("rewards")
+        stats = storage._stats("rewards", {"student_id": "s1"}, ["points"], group_by="type")
+        storage._cache_clear()
+        assert storage._read("rewards") == expected == records + new
+        assert storage._current("rewards").size >= size
+        # Los agregados vienen del snapshot, extendidos con la cola
+        assert storage._stats("rewards", {"student_id": "s1"}, ["points"], group_by="type") == stats
+        assert storage._rebuild_summaries("rewards") == {}
+
+    def test_interrupted_compaction_is_finished_on_recover(self, db_dir, monkeypatch):
+        records = self.history(10)
+        storage._write("rewards", records)
+        replace = storage._replace_file
+
+        def crash_on_log(path, write, name):
+            if path.endswith(".ndjson"):
+                raise OSError("corte")
+            return replace(path, write, name)
+
+        monkeypatch.setattr(storage, "_replace_file", crash_on_log)
+        with pytest.raises(OSError):
+            storage._compact("rewards")
+        monkeypatch.setattr(storage, "_replace_file", replace)
+        storage._append("rewards", {"student_id": "s9", "points": 1})
+
+        # Snapshot nuevo + log viejo: nada se duplica
+        storage._cache_clear()
+        assert storage._read("rewards") == records + [{"student_id": "s9", "points": 1}]
+        assert storage._recover() == {"rewards": {"snapshot": "finished"}}
+        storage._cache_clear()
+        assert storage._read("rewards") == records + [{"student_id": "s9", "points": 1}]
+        assert storage._recover() == {}
+
+    def test_full_rewrite_drops_the_snapshot(self, db_dir):
+        storage._write("rewards", self.history(5))
+        storage._compact("rewards")
+        storage._write("rewards", [{"n": 1}])
+        assert not (db_dir / "rewards.snapshot").exists()
+        storage._cache_clear()
+        assert storage._read("rewards") == [{"n": 1}]
+
+    def test_background_compaction_past_threshold(self, db_dir, monkeypatch):
+        monkeypatch.setattr(storage, "COMPACT_TAIL_BYTES", 512)
+        monkeypatch.setattr(storage, "_COMPACTOR", storage._Compactor())
+        storage._read("rewards")
+        for record in self.history(15):
+            storage._append("rewards", record)
+        for _ in range(200):
+            if storage._compaction_stats()["runs"] and not storage._compaction_stats()["running"]:
+                break
+            threading.Event().wait(0.01)
+        assert storage._compaction_stats()["runs"] >= 1
+        assert (db_dir / "rewards.snapshot").exists()
+        storage._cache_clear()
+        assert storage._read("rewards") == self.history(15)
+
+class TestGroupCommit:
+    def test_concurrent_appends_share_flushes(self, db_dir, monkeypatch):
+        """Appends that arrive within the window are written together, none is lost"""
+        monkeypatch.setattr(storage, "DURABILITY", "always")
+        monkeypatch.setattr(storage, "GROUP_COMMIT_MAX_DELAY_MS", 20.0)
+        monkeypatch.setattr(storage, "_GROUP_COMMIT", storage._GroupCommit())
+        storage._read("results")
+
+        def submit(i):
+            storage._transaction([], lambda tx: (
+                tx.append("results", {"student_id": "a", "n": i}),
+                tx.append("rewards", {"student_id": "a", "n": i}),
+            ))
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = storage._group_commit_stats()
+        assert stats["records"] == 80
+        assert stats["flushes"] < 40
+        assert sorted(r["n"] for r in storage._read("results")) == list(range(40))
+        storage._cache_clear()
+        assert len(storage._read("rewards")) == 40
+
+    def test_batch_size_is_capped(self, db_dir, monkeypatch):
+        monkeypatch.setattr(storage, "GROUP_COMMIT_MAX_DELAY_MS", 20.0)
+        monkeypatch.setattr(storage, "GROUP_COMMIT_MAX_BATCH", 4)
+        monkeypatch.setattr(storage, "_GROUP_COMMIT", storage._GroupCommit())
+        threads = [threading.Thread(target=storage._append, args=("rewards", {"n": i})) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = storage._group_commit_stats()
+        assert stats["records"] == 20
+        assert stats["max_batch"] <= 4
+
+    def test_flush_errors_reach_every_caller(self, db_dir, monkeypatch):
+        monkeypatch.setattr(storage, "_GROUP_COMMIT", storage._GroupCommit())
+
+        def broken(*args, **kwargs):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(storage, "_append_file", broken)
+        with pytest.raises(OSError):
+            storage._append("rewards", {"n": 1})
+
+
+class TestSummaries:
+    def scan(self, name, sid, fields, group_by=None):
+        # Mismo cálculo sin resúmenes: filtro que no es la clave
+        return storage._stats(name, {"student_id": sid, "missing": None}, fields, group_by)
+
+    def test_appends_update_summaries_incrementally(self, db_dir):
+        storage._write("rewards", [{"student_id": "a", "type": "video", "points": 10}])
+        assert storage._stats("rewards", {"student_id": "a"}, ["points"])["sum"]["points"] == 10
+        summaries = storage._STATE["rewards"].entry.summaries
+
+        storage._append("rewards", {"student_id": "a", "type": "test", "points": 30})
+        storage._append("rewards", {"student_id": "b", "type": "test", "points": 5})
+
+        assert storage._STATE["rewards"].entry.summaries is summaries
+        for sid in ("a", "b", "nobody"):
+            assert storage._stats("rewards", {"student_id": sid}, ["points"], group_by="type") == \
+                self.scan("rewards", sid, ["points"], group_by="type")
+            assert storage._stats("rewards", {"student_id": sid}, ["points"]) == self.scan("rewards", sid, ["points"])
+
+    def test_snapshot_behind_newer_appends(self, db_dir):
+        storage._write("results", [{"student_id": "a", "correct": 2}])
+        storage._stats("results", {"student_id": "a"}, ["correct"])
+        with storage._snapshot("results"):
+            storage._append("results", {"student_id": "a", "correct": 5})
+            stats = storage._stats("results", {"student_id": "a"}, ["correct"])
+            assert (stats["count"], stats["max"]["correct"]) == (1, 2)
+        assert storage._stats("results", {"student_id": "a"}, ["correct"])["count"] == 2
+
+    def test_latest_walks_index_from_the_end(self, db_dir):
+        storage._write("rewards", [{"student_id": "a" if i % 2 else "b", "n": i, "type": "video" if i % 3 else "test"}
+                                   for i in range(20)])
+        assert [r["n"] for r in storage._latest("rewards", {"student_id": "a"}, 3)] == [19, 17, 15]
+        assert [r["n"] for r in storage._latest("rewards", {"student_id": "a", "type": "test"}, 2)] == [15, 9]
+        assert [r["n"] for r in storage._latest("rewards", None, 2)] == [19, 18]
+
+    def test_rebuild_reports_drift(self, db_dir):
+        storage._write("rewards", [{"student_id": "a", "type": "test", "points": 10}])
+        storage._stats("rewards", {"student_id": "a"}, ["points"])
+        assert storage._rebuild_summaries("rewards") == {}
+
+        total, _ = storage._STATE["rewards"].entry.summaries["a"]
+        total.sum["points"] += 1
+        drift = storage._rebuild_summaries("rewards")
+        assert list(drift) == ["a"]
+        assert drift["a"][1][0]["sum"]["points"] == 10
+        assert storage._stats("rewards", {"student_id": "a"}, ["points"])["sum"]["points"] == 10
+
+
+class TestPagination:
+    def records(self):
+        # created_at fuera de orden en disco, con un empate
+        days = [3, 1, 2, 5, 4, 2]
+        return [{"student_id": "a" if i % 2 == 0 else "b", "n": i, "created_at": f"2024-01-0{d}"}
+                for i, d in enumerate(days)]
+
+    def test_full_build_matches_incremental_order(self, db_dir):
+        """Loading out-of-order history sorts once and agrees with per-append insertion"""
+        records = [{"student_id": f"s{i % 3}", "created_at": f"2024-01-01T00:{(i * 37) % 60:02d}:00Z"} for i in range(60)]
+        incremental = ([], {})
+        for pos, record in enumerate(records):
+            storage._sorted_add("results", incremental, record, pos)
+        assert storage._build_sorted("results", records) == incremental
+
+    def test_pages_follow_created_at_then_position(self, db_dir):
+        storage._write("results", self.records())
+        seen, cursor = [], None
+        while True:
+            page, cursor = storage._page("results", limit=2, cursor=cursor)
+            seen += [r["n"] for r in page]
+            if cursor is None:
+                break
+        assert seen == [3, 4, 0, 5, 2, 1]
+
+    def test_range_and_key_filters(self, db_dir):
+        storage._write("results", self.records())
+        page, cursor = storage._page("results", {"student_id": "a"}, since="2024-01-02", until="2024-01-04", limit=10)
+        assert [r["n"] for r in page] == [0, 2] and cursor is None
+        stats = storage._stats("results", {"student_id": "b"}, ["n"], since="2024-01-02")
+        assert (stats["count"], stats["sum"]["n"]) == (2, 8)
+
+    def test_out_of_order_appends_are_placed_by_date(self, db_dir):
+        storage._write("results", self.records())
+        storage._page("results", limit=1)
+        storage._append("results", {"student_id": "a", "n": 6, "created_at": "2024-01-02"})
+        page, _ = storage._page("results", {"student_id": "a"}, limit=10)
+        assert [r["n"] for r in page] == [4, 0, 6, 2]
+
+    def test_invalid_cursor(self, db_dir):
+        with pytest.raises(ValueError):
+            storage._page("results", cursor="not-a-cursor")